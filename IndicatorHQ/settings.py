@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'indicatorDataApp',
 ]
 
@@ -134,3 +135,39 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Caches
+# 'default' holds the hierarchy version of the place and variable registry, see
+# indicatorDataApp/registry.py, and the variables assigned to each user for a
+# minute, see indicatorDataApp/assignments.py.
+# 'series' holds evaluated indicator series, see indicatorDataApp/series_cache.py.
+# Local memory caches are per process and evict the least recently used entries.
+# With several worker processes both must use a shared backend (Redis, Memcached)
+# so a version bump or a revoked assignment in one process reaches the others.
+# Otherwise other processes only see new places after registry.MAX_AGE and
+# revoked assignments after assignments.CACHE_TIMEOUT.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'series': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'series',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+
+# Seed districts from nested ISO 3166-2 subdivisions when a country is added,
+# otherwise every subdivision becomes a region
+SEED_DISTRICTS = False
+
+
+# Where export jobs write their files
+EXPORT_ROOT = BASE_DIR / 'exports'
+
+# Memory-mapped indicator series snapshots, see indicatorDataApp/snapshots.py
+SNAPSHOT_ROOT = BASE_DIR / 'snapshots'
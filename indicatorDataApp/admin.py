@@ -8,13 +8,12 @@ from django.core.exceptions import ValidationError
 from .models import Country, Region, District
 from .models import Indicator, IndicatorVariable, NationalIndicatorVariable
 from .models import RegionalIndicatorVariable, DistrictIndicatorVariable
-from .models import Value, AggregationLevelChoice
+from .models import AggregationLevelChoice
+from .models import Job, JobKindChoice
 from .models import NationalVarValue, RegionalVarValue, DistrictVarValue
 from .forms import CountryForm
-
-
-class CountryAdmin(admin.ModelAdmin):
-    form = CountryForm
+from .formulas import compile_formula, FormulaError
+from .jobs import enqueue
 
 
 class IndicatorAdminForm(forms.ModelForm):
@@ -60,6 +59,20 @@ class IndicatorAdminForm(forms.ModelForm):
             if error_msgs:
                 raise ValidationError(error_msgs)
 
+        formula = cleaned_data.get("computing_formula")
+        if formula:
+            try:
+                compiled_formula = compile_formula(formula)
+            except FormulaError as e:
+                raise ValidationError({"computing_formula": str(e)})
+
+            codes = {variable.code for variable in variables.all()} if variables else set()
+            unknown_codes = compiled_formula.variables - codes
+            if unknown_codes:
+                raise ValidationError({
+                    "computing_formula": f"Unknown variable(s): {', '.join(sorted(unknown_codes))}"
+                })
+
         return cleaned_data
 
 
@@ -67,6 +80,19 @@ class IndicatorAdmin(admin.ModelAdmin):
     form = IndicatorAdminForm
 
     filter_horizontal = ("variables",)
+    actions = ["recompute_values", "export_csv"]
+
+    @admin.action(description="Recompute stored values in the background")
+    def recompute_values(self, request, queryset):
+        for indicator in queryset:
+            enqueue(JobKindChoice.RECOMPUTE, indicator=indicator)
+        self.message_user(request, f"Queued {queryset.count()} recompute job(s)")
+
+    @admin.action(description="Export as CSV in the background")
+    def export_csv(self, request, queryset):
+        for indicator in queryset:
+            enqueue(JobKindChoice.EXPORT, indicator=indicator, params={"format": "csv"})
+        self.message_user(request, f"Queued {queryset.count()} export job(s)")
 
     def add_view(self, request, form_url="", extra_context=None):
         extra_context = extra_context or {}
@@ -76,7 +102,28 @@ class IndicatorAdmin(admin.ModelAdmin):
 
 class IndicatorVariableAdmin(admin.ModelAdmin):
     # TODO: make sure districts for country exist if level chosen district
-    pass
+    filter_horizontal = ("assignees",)
+    actions = ["rebuild_rollups"]
+
+    @admin.action(description="Rebuild rollups in the background")
+    def rebuild_rollups(self, request, queryset):
+        for variable in queryset:
+            enqueue(JobKindChoice.ROLLUPS, variable=variable)
+        self.message_user(request, f"Queued {queryset.count()} rollup job(s)")
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "kind", "indicator", "variable", "period_start", "period_end",
+                    "status", "progress_display", "created_at", "finished_at")
+    list_filter = ("status", "kind")
+    readonly_fields = [field.name for field in Job._meta.fields] + ["progress_display"]
+
+    @admin.display(description="Progress")
+    def progress_display(self, job):
+        return f"{job.progress:.0%} ({job.done}/{job.total})"
+
+    def has_add_permission(self, request):
+        return False
 
 
 class DistrictInline(admin.TabularInline):
@@ -90,6 +137,7 @@ class RegionInline(admin.TabularInline):
 
 
 class CountryAdmin(admin.ModelAdmin):
+    form = CountryForm
     list_display = ("name", "code")
     inlines = [RegionInline]
 
@@ -111,10 +159,10 @@ admin.site.register(Country, CountryAdmin)
 # admin.site.register(District)
 admin.site.register(Indicator, IndicatorAdmin)
 admin.site.register(IndicatorVariable, IndicatorVariableAdmin)
+admin.site.register(Job, JobAdmin)
 # admin.site.register(NationalIndicatorVariable)
 # admin.site.register(RegionalIndicatorVariable)
 # admin.site.register(DistrictIndicatorVariable)
-# admin.site.register(Value)
 # admin.site.register(NationalVarValue)
 # admin.site.register(RegionalVarValue)
 # admin.site.register(DistrictVarValue)
@@ -0,0 +1,93 @@
+"""
+Bulk as-of lookups: the value of a variable at a date is the value of its first
+value with a period on or after that date, as in get_value_at.
+
+values_at resolves that for many variables and many dates at once: a single
+LATERAL query on Postgres, elsewhere one range query followed by a vectorized
+searchsorted over each variable's sorted periods.
+"""
+import numpy as np
+import pandas as pd
+from django.db import connection
+
+
+def asof_indices(periods, dates):
+    """
+    Index of the first period on or after each date, len(periods) if there is none
+    Input:
+        periods -> sorted datetime64 array
+        dates -> dates to look up
+    """
+    dates = pd.to_datetime(list(dates)).to_numpy()
+    return np.searchsorted(periods, dates, side='left')
+
+
+def source_of(variable_model, computed=False):
+    """The model holding a variable class's values, or its rollups if computed"""
+    relation = 'rollups' if computed else 'value_models'
+    return variable_model._meta.get_field(relation).related_model
+
+
+def values_at(variables, dates, computed=False):
+    """
+    Returns the value of each variable at each date, like get_value_at
+    Input:
+        variables -> variables of a single class, eg RegionalIndicatorVariable
+        dates -> dates to read the values at
+        computed -> read the stored rollups instead of the inputted values
+    Output:
+        dict of variable pk to an array of values per date, NaN when there is none
+    """
+    variables, dates = list(variables), list(dates)
+    result = {variable.pk: np.full(len(dates), np.nan) for variable in variables}
+    if not variables or not dates:
+        return result
+
+    source = source_of(type(variables[0]), computed)
+    value_field = 'value' if computed else 'inputted_value'
+
+    if connection.vendor == 'postgresql':
+        for date_index, variable_pk, value in lateral_values(source, value_field,
+                                                              list(result), dates):
+            if value is not None:
+                result[variable_pk][date_index] = float(value)
+        return result
+
+    rows = source.objects.filter(
+        variable__in=list(result), period__gte=min(dates)
+    ).order_by('variable', 'period').values_list('variable', 'period', value_field)
+    frame = pd.DataFrame.from_records(list(rows), columns=['variable', 'period', 'value'])
+
+    for variable_pk, group in frame.groupby('variable', sort=False):
+        periods = pd.to_datetime(group['period']).to_numpy()
+        amounts = group['value'].astype(float).to_numpy()
+        indices = asof_indices(periods, dates)
+        found = indices < len(periods)
+        result[variable_pk][found] = amounts[indices[found]]
+    return result
+
+
+def lateral_values(source, value_field, variable_pks, dates):
+    """
+    One query for every (variable, date) pair: a LATERAL subquery picks the first
+    value on or after the date, walking the (variable, period) index.
+    Yields the date index, variable pk and value.
+    """
+    qn = connection.ops.quote_name
+    column = qn(source._meta.get_field(value_field).column)
+    variable_column = qn(source._meta.get_field('variable').column)
+    sql = f"""
+        SELECT dates.i - 1, variables.id, found.value
+        FROM unnest(%s::date[]) WITH ORDINALITY AS dates(day, i)
+        CROSS JOIN unnest(%s::bigint[]) AS variables(id)
+        CROSS JOIN LATERAL (
+            SELECT {column} AS value
+            FROM {qn(source._meta.db_table)}
+            WHERE {variable_column} = variables.id AND period >= dates.day
+            ORDER BY period
+            LIMIT 1
+        ) AS found
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [dates, variable_pks])
+        yield from cursor.fetchall()
@@ -0,0 +1,90 @@
+"""
+The variables a user is assigned to input values for.
+
+Assignments are made on indicator variables and cover their national, regional
+and district vars, and the indicators all of whose variables are assigned.
+
+The assigned indicator variable pks of a user are read once and kept in the
+default cache for at most CACHE_TIMEOUT seconds, or until the user's
+assignments change, and a resolver built per request reads them at most once,
+only when they are first needed.
+
+Changes drop the cached pks of the default cache, which with a per process
+backend only reaches the process making the change. The timeout bounds how long
+other processes keep granting a revoked assignment, use a shared cache backend
+for revocations to apply at once.
+"""
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from .models import Indicator, IndicatorVariable
+from .models import NationalIndicatorVariable, RegionalIndicatorVariable, DistrictIndicatorVariable
+
+
+# Variable models by class name, as they appear in urls and forms
+VARIABLE_MODELS = {
+    model.__name__: model
+    for model in (NationalIndicatorVariable, RegionalIndicatorVariable, DistrictIndicatorVariable)
+}
+
+CACHE_KEY = 'assigned-variables:{}'
+
+CACHE_TIMEOUT = 60
+
+
+def assigned_indicator_var_pks(user_pk):
+    """The pks of the indicator variables assigned to a user, cached for a while"""
+    key = CACHE_KEY.format(user_pk)
+    pks = cache.get(key)
+    if pks is None:
+        pks = frozenset(IndicatorVariable.objects.filter(assignees=user_pk)
+                        .values_list('pk', flat=True))
+        cache.set(key, pks, CACHE_TIMEOUT)
+    return pks
+
+
+def forget_assignments(user_pks):
+    """Drops the cached assignments of users, read again on their next request"""
+    cache.delete_many([CACHE_KEY.format(user_pk) for user_pk in user_pks])
+
+
+class AssignedVariables:
+    """
+    Resolves the variables a user may input values for. Superusers may input
+    values for every variable, anonymous users for none.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def indicator_var_pks(self):
+        """The assigned indicator variable pks, None if every variable is assigned"""
+        if self.user.is_superuser:
+            return None
+        if not self.user.is_authenticated:
+            return frozenset()
+        return assigned_indicator_var_pks(self.user.pk)
+
+    def queryset(self, model):
+        """The assigned variables of a variable model"""
+        if self.indicator_var_pks is None:
+            return model.objects.all()
+        return model.objects.filter(indicator_var__in=self.indicator_var_pks)
+
+    def indicators(self):
+        """The indicators whose variables are all assigned"""
+        if self.indicator_var_pks is None:
+            return Indicator.objects.all()
+        return Indicator.objects.exclude(
+            variables__in=IndicatorVariable.objects.exclude(pk__in=self.indicator_var_pks)
+        )
+
+    def get(self, var_class_name, pk):
+        """
+        The assigned variable of a class name and pk, with its indicator variable
+        loaded. Raises the model's DoesNotExist if it is not assigned, and
+        KeyError for an unknown class name.
+        """
+        model = VARIABLE_MODELS[var_class_name]
+        return self.queryset(model).select_related('indicator_var').get(pk=pk)
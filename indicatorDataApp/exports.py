@@ -0,0 +1,93 @@
+"""
+Streaming exports of indicator series.
+
+Places are evaluated a chunk at a time, reading their values through
+server-side cursors, and every chunk is encoded and handed to the response as
+soon as it is ready. Memory stays constant however many places and dates are
+exported, and the first bytes go out before the whole export is computed.
+"""
+import csv
+import io
+from itertools import islice
+
+import pandas as pd
+
+from .series import indicator_frame, level_storage
+
+
+COLUMNS = ['place', 'place_name', 'date', 'value']
+
+
+class ExportError(ValueError):
+    """Raised when an export can not be produced"""
+
+
+def export_frames(indicator, dates, chunk_size=500):
+    """Yields the indicator series as long frames, one per chunk of places"""
+    storage = level_storage(indicator)
+    dates = list(dates)
+    places = storage.places(indicator.country).order_by('pk').values_list('pk', 'name')
+    places = places.iterator(chunk_size=chunk_size)
+
+    while True:
+        chunk = dict(islice(places, chunk_size))
+        if not chunk:
+            break
+        frame = indicator_frame(indicator, dates, places=list(chunk)).reindex(list(chunk))
+        frame = frame.rename_axis('place').reset_index().melt(
+            id_vars='place', var_name='date', value_name='value'
+        ).sort_values(['place', 'date'], kind='stable')
+        frame.insert(1, 'place_name', frame['place'].map(chunk))
+        yield frame[COLUMNS]
+
+
+def stream_csv(frames):
+    """Encodes frames as one CSV document, a chunk per frame"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow(COLUMNS)
+    yield buffer.getvalue()
+    for frame in frames:
+        yield frame.to_csv(header=False, index=False, date_format='%Y-%m-%d', lineterminator='\n')
+
+
+def stream_arrow(frames):
+    """Encodes frames as an Arrow IPC stream, a record batch per frame"""
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ('place', pa.int64()),
+        ('place_name', pa.string()),
+        ('date', pa.date32()),
+        ('value', pa.float64()),
+    ])
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for frame in frames:
+            frame = frame.assign(date=pd.to_datetime(frame['date']).dt.date)
+            writer.write_batch(pa.RecordBatch.from_pandas(frame, schema=schema,
+                                                          preserve_index=False))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv'),
+    'arrow': (stream_arrow, 'application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def get_encoder(export_format):
+    """
+    Returns the encoder, content type and file extension of a format. Checked
+    before streaming starts, as errors can not be reported once it has.
+    """
+    if export_format not in FORMATS:
+        raise ExportError(f"Unknown format {export_format}, use one of {', '.join(FORMATS)}")
+    if export_format == 'arrow':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError("pyarrow is required for Arrow exports") from None
+    return FORMATS[export_format]
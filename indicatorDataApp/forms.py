@@ -1,26 +1,34 @@
 from typing import Any
 from django import forms
 from .models import Country
-import pycountry
+from .geography import country_choices, country_name
+
+
+def country_field_choices():
+    return [('', 'Select a country')] + country_choices()
 
 
 class CountryForm(forms.ModelForm):
-    countries = [('', 'Select a country')] + [(country.alpha_2, country.name) for country in pycountry.countries]
-    country = forms.ChoiceField(choices=countries, validators=[lambda x: x != ''])
+    # A callable, so pycountry is only read when a form is first rendered or validated
+    country = forms.ChoiceField(choices=country_field_choices, validators=[lambda x: x != ''])
 
     class Meta:
         model = Country
         exclude = ['name', 'code']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial.setdefault('country', self.instance.code)
+
     def clean(self):
         cleaned_data = super().clean()
         country_code = cleaned_data.get('country')
-        if country_code:
-            for code, name in [[c.alpha_2, c.name] for c in list(pycountry.countries)]:
-                if code == country_code:
-                    cleaned_data['name'] = name
-                    cleaned_data['code'] = code
-    
+        name = country_name(country_code) if country_code else None
+        if name is not None:
+            cleaned_data['name'] = name
+            cleaned_data['code'] = country_code
+
     def save(self, commit=True):
         instance = super().save(commit=False)
         instance.code = self.cleaned_data['code']
@@ -28,4 +36,3 @@ class CountryForm(forms.ModelForm):
         if commit:
             instance.save()
         return instance
-
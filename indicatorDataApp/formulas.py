@@ -0,0 +1,141 @@
+"""
+Parsing and evaluation of indicator computing formulas.
+
+A formula is parsed once into a restricted syntax tree: numbers, variable codes,
+arithmetic operators and a few whitelisted functions. Anything else is rejected,
+so formulas never run as Python. The compiled formula works the same on single
+values and on numpy arrays, which lets one evaluation cover many places and dates.
+"""
+import ast
+import operator
+from functools import lru_cache, reduce
+
+import numpy as np
+
+
+class FormulaError(ValueError):
+    """Raised when a computing formula can not be parsed or uses forbidden syntax"""
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+# Function name -> (function, least and most arguments, None for any number).
+# Arguments are never passed on to numpy as is, where an extra one would be the
+# ufunc's output array.
+FUNCTIONS = {
+    'abs': (np.abs, 1, 1),
+    'sqrt': (np.sqrt, 1, 1),
+    'log': (np.log, 1, 1),
+    'exp': (np.exp, 1, 1),
+    'round': (np.round, 1, 2),
+    'min': (lambda *args: reduce(np.minimum, args), 2, None),
+    'max': (lambda *args: reduce(np.maximum, args), 2, None),
+}
+
+
+class Formula:
+    """A compiled computing formula"""
+    __slots__ = ('source', 'variables', '_evaluate')
+
+    def __init__(self, source, evaluate, variables):
+        self.source = source
+        self.variables = variables
+        self._evaluate = evaluate
+
+    def __call__(self, values):
+        """
+        Evaluates the formula
+        Input:
+            values -> mapping of variable code to a number or numpy array,
+                    arrays must share one shape and are combined elementwise
+        """
+        missing = self.variables - values.keys()
+        if missing:
+            raise FormulaError(f"No value for {', '.join(sorted(missing))}")
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return self._evaluate(values)
+
+    def __repr__(self):
+        return f'<Formula {self.source!r}>'
+
+
+def _build(node, variables):
+    """Turns a syntax tree node into a function of the variable values"""
+    if isinstance(node, ast.Expression):
+        return _build(node.body, variables)
+
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise FormulaError(f"{node.value!r} is not a number")
+        # As numpy floats, powers overflow to inf instead of growing Python ints without bound
+        try:
+            constant = np.float64(node.value)
+        except OverflowError:
+            raise FormulaError(f"{node.value!r} is too large") from None
+        return lambda values: constant
+
+    if isinstance(node, ast.Name):
+        code = node.id
+        variables.add(code)
+        return lambda values: values[code]
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        func = BINARY_OPERATORS[type(node.op)]
+        left, right = _build(node.left, variables), _build(node.right, variables)
+        return lambda values: func(left(values), right(values))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        func = UNARY_OPERATORS[type(node.op)]
+        operand = _build(node.operand, variables)
+        return lambda values: func(operand(values))
+
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS and not node.keywords):
+        name = node.func.id
+        func, least, most = FUNCTIONS[name]
+        count = len(node.args)
+        if count < least or (most is not None and count > most):
+            raise FormulaError(f"{name}() can not take {count} arguments")
+        if name == 'round' and count == 2:
+            digits = node.args[1]
+            if not (isinstance(digits, ast.Constant) and type(digits.value) is int):
+                raise FormulaError("round() takes a whole number of digits")
+            number = _build(node.args[0], variables)
+            return lambda values: func(number(values), digits.value)
+        args = [_build(arg, variables) for arg in node.args]
+        return lambda values: func(*(arg(values) for arg in args))
+
+    raise FormulaError(f"'{ast.unparse(node)}' is not allowed in a formula")
+
+
+@lru_cache(maxsize=1024)
+def compile_formula(source):
+    """
+    Parses a computing formula. '^' is read as a power as users are used to.
+    Compiled formulas are cached by source so indicators sharing one share the tree.
+    """
+    try:
+        tree = ast.parse(source.replace('^', '**'), mode='eval')
+    except SyntaxError as e:
+        raise FormulaError(f"Invalid formula {source!r}: {e.msg}") from None
+    variables = set()
+    evaluate = _build(tree, variables)
+    return Formula(source, evaluate, frozenset(variables))
+
+
+def default_formula(codes):
+    """The formula used when none is given: the sum of all variables, 0 if there are none"""
+    return ' + '.join(sorted(codes)) or '0'
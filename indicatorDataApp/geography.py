@@ -0,0 +1,84 @@
+"""
+Lookups of countries and their subdivisions from the ISO 3166 data shipped
+with pycountry.
+
+pycountry is only imported, and its databases read, on the first lookup, so
+management commands and worker processes that never look a country up do not
+pay for it. Each database is then read once per process into dicts by code,
+so resolving a code or seeding a country does not search pycountry's tables
+again.
+"""
+from collections import defaultdict
+from functools import lru_cache
+
+
+class Subdivision:
+    """A region or district of a country"""
+    __slots__ = ('code', 'name', 'parent_code')
+
+    def __init__(self, code, name, parent_code):
+        self.code = code
+        self.name = name
+        self.parent_code = parent_code
+
+
+@lru_cache(maxsize=None)
+def country_names():
+    """ISO 3166-1 alpha 2 code -> name of every country, in pycountry's order"""
+    import pycountry
+
+    return {country.alpha_2: country.name for country in pycountry.countries}
+
+
+def country_name(code):
+    """The name of the country with code, None if there is none"""
+    return country_names().get(code)
+
+
+def country_choices():
+    """(code, name) choices of every country"""
+    return list(country_names().items())
+
+
+@lru_cache(maxsize=None)
+def subdivision_index():
+    """All subdivisions grouped by country code, built in one pass over the data"""
+    import pycountry
+
+    index = defaultdict(list)
+    for subdivision in pycountry.subdivisions:
+        index[subdivision.country_code].append(
+            Subdivision(subdivision.code, subdivision.name, subdivision.parent_code)
+        )
+    return dict(index)
+
+
+def subdivisions(country_code):
+    """The subdivisions of a country, empty if it has none"""
+    return subdivision_index().get(country_code, [])
+
+
+def top_level_code(subdivision, by_code):
+    """The code of the subdivision's top most ancestor, its own if it has no parent"""
+    while subdivision.parent_code in by_code:
+        subdivision = by_code[subdivision.parent_code]
+    return subdivision.code
+
+
+def regions_and_districts(country_code):
+    """
+    Splits a country's subdivisions into regions, the top level ones, and
+    districts, the ones nested under a region.
+    Returns the regions and a list of (district, region code) pairs.
+    """
+    all_subdivisions = subdivisions(country_code)
+    by_code = {subdivision.code: subdivision for subdivision in all_subdivisions}
+
+    regions, districts = [], []
+    for subdivision in all_subdivisions:
+        region_code = top_level_code(subdivision, by_code)
+        if region_code == subdivision.code:
+            regions.append(subdivision)
+        else:
+            districts.append((subdivision, region_code))
+    return regions, districts
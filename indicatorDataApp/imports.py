@@ -0,0 +1,187 @@
+"""
+Bulk import of district values from CSV or Excel files.
+
+Rows are read lazily and written in chunks, so memory stays bounded whatever
+the file size. Each row is resolved to a district variable through maps loaded
+once per import. The values are then upserted with one statement per chunk.
+Rollups of every affected (regional variable, period) are recomputed once at
+the end, since bulk writes skip the per value signals. The indicators over the
+imported variables are then queued for a background recompute.
+
+Expected columns: variable (variable code), district (district code),
+period (YYYY-MM-DD) and value.
+"""
+import csv
+import io
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from .jobs import enqueue_recomputes
+from .models import DistrictIndicatorVariable, DistrictVarValue, RegionalIndicatorVariable
+from .rollups import rebuild_rollups
+
+
+MAX_REPORTED_ERRORS = 20
+
+
+class ValueImportError(ValueError):
+    """Raised when a file can not be imported at all"""
+
+
+def read_csv(file):
+    """Yields the rows of a CSV file as dicts, file may be binary or text"""
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    yield from csv.DictReader(file)
+
+
+def read_excel(file):
+    """Yields the rows of the first sheet of an Excel workbook as dicts"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueImportError("openpyxl is required to import Excel files") from None
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(cell).strip().lower() if cell is not None else '' for cell in next(rows, ())]
+        for row in rows:
+            yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def read_rows(file, file_name):
+    """Picks the reader from the file extension"""
+    if file_name.lower().endswith(('.xlsx', '.xlsm')):
+        return read_excel(file)
+    if file_name.lower().endswith('.csv'):
+        return read_csv(file)
+    raise ValueImportError(f"Can not import {file_name}, use a .csv or .xlsx file")
+
+
+def parse_period(raw):
+    if isinstance(raw, datetime):
+        return raw.date()
+    if isinstance(raw, date):
+        return raw
+    return date.fromisoformat(str(raw).strip())
+
+
+class ImportResult:
+    """Counts of an import and the first row errors"""
+
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Row {line}: {reason}")
+
+    def as_dict(self):
+        return {'imported': self.imported, 'skipped': self.skipped, 'errors': self.errors}
+
+
+def parse_value(raw):
+    """The value as stored, ValueError if it is not a number the column can hold"""
+    field = DistrictVarValue._meta.get_field('inputted_value')
+    amount = Decimal(str(raw).strip())
+    if not amount.is_finite() or abs(amount) >= 10 ** (field.max_digits - field.decimal_places):
+        raise ValueError(raw)
+    return amount.quantize(Decimal(1).scaleb(-field.decimal_places))
+
+
+class ValueImporter:
+    """
+    Imports district values for the variables of one country, only those of
+    indicator_var_pks unless it is None
+    """
+
+    def __init__(self, country, indicator_var_pks=None, chunk_size=5000):
+        self.chunk_size = chunk_size
+        district_vars = DistrictIndicatorVariable.objects.filter(
+            indicator_var__country=country,
+            district__isnull=False,
+        )
+        if indicator_var_pks is not None:
+            district_vars = district_vars.filter(indicator_var__in=indicator_var_pks)
+        # (variable code, district code) -> (district var pk, regional var pk)
+        self.district_vars = {
+            (code, district_code): (pk, regional_var_pk)
+            for code, district_code, pk, regional_var_pk in
+            district_vars.values_list('indicator_var__code',
+                                      'district__code', 'pk', 'regional_var')
+        }
+
+    def run(self, rows):
+        """Imports the rows and recomputes the affected rollups"""
+        result = ImportResult()
+        affected = set()
+        numbered_rows = enumerate(rows, start=2) # Line 1 is the header
+        while True:
+            chunk = list(islice(numbered_rows, self.chunk_size))
+            if not chunk:
+                break
+            affected |= self.write_chunk(chunk, result)
+
+        rebuild_rollups(affected)
+        if affected:
+            # Values are read as of the first period on or after a date, so any
+            # date up to the last imported period may have changed
+            enqueue_recomputes(
+                RegionalIndicatorVariable.objects.filter(
+                    pk__in={regional_var_pk for regional_var_pk, _ in affected}
+                ).values_list('indicator_var', flat=True).distinct(),
+                period_end=max(period for _, period in affected),
+            )
+        return result
+
+    def write_chunk(self, chunk, result):
+        """Upserts a chunk of rows, returns the (regional var pk, period) pairs touched"""
+        values = {}
+        affected = set()
+        for line, row in chunk:
+            row = {str(key).strip().lower(): value for key, value in row.items() if key}
+            try:
+                code, district_code = str(row['variable']).strip(), str(row['district']).strip()
+                period = parse_period(row['period'])
+                amount = parse_value(row['value'])
+            except KeyError as e:
+                result.skip(line, f"missing column {e}")
+                continue
+            except (ValueError, InvalidOperation):
+                result.skip(line, "invalid period or value")
+                continue
+
+            district_var = self.district_vars.get((code, district_code))
+            if district_var is None:
+                result.skip(line, f"no variable {code} for district {district_code}")
+                continue
+
+            district_var_pk, regional_var_pk = district_var
+            # A later row for the same variable and period wins
+            values[district_var_pk, period] = DistrictVarValue(
+                variable_id=district_var_pk, period=period, inputted_value=amount
+            )
+            affected.add((regional_var_pk, period))
+
+        DistrictVarValue.objects.bulk_create(
+            values.values(), update_conflicts=True,
+            unique_fields=['variable', 'period'], update_fields=['inputted_value'],
+        )
+        result.imported += len(values)
+        return affected
+
+
+def import_values(file, file_name, country, indicator_var_pks=None, chunk_size=5000):
+    """
+    Imports a CSV or Excel file of district values, returns an ImportResult.
+    Rows of variables outside indicator_var_pks are skipped, unless it is None.
+    """
+    importer = ValueImporter(country, indicator_var_pks=indicator_var_pks, chunk_size=chunk_size)
+    return importer.run(read_rows(file, file_name))
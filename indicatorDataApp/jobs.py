@@ -0,0 +1,182 @@
+"""
+Background jobs for heavy recomputation.
+
+Jobs are rows of the Job table. enqueue() adds one unless the same kind, target
+and period range is already queued, so bursts of changes collapse into a single
+job. The run_jobs command claims queued jobs with SELECT ... FOR UPDATE SKIP
+LOCKED, so several workers can share the queue, and runs each in a process pool.
+Handlers report their progress on the job row, which the admin shows.
+
+Workers renew a heartbeat on the jobs they run. A running job whose heartbeat is
+older than LEASE seconds lost its worker, it is queued again when jobs are next
+claimed, so indicators are not left waiting on it forever.
+"""
+import math
+import os
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Indicator, Job, JobKindChoice, JobStatusChoice
+
+
+LEASE = 300
+
+
+def enqueue(kind, indicator=None, variable=None, period_start=None, period_end=None,
+            params=None):
+    """Queues a job unless the same one is already queued, returns the queued job"""
+    job = Job(kind=kind, indicator=indicator, variable=variable, period_start=period_start,
+              period_end=period_end, params=params or {})
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                job.save()
+            return job
+        except IntegrityError:
+            queued = Job.objects.filter(dedupe_key=job.dedupe_key,
+                                        status=JobStatusChoice.QUEUED).first()
+            if queued is not None:
+                return queued
+            # Retried once if the queued one was claimed in between, anything
+            # else violating a constraint is raised
+            if attempt:
+                raise
+
+
+def enqueue_recomputes(indicator_var_pks, period_start=None, period_end=None):
+    """Queues a recompute of every indicator using the variables over a period range"""
+    indicators = Indicator.objects.filter(variables__in=list(indicator_var_pks)).distinct()
+    return [enqueue(JobKindChoice.RECOMPUTE, indicator=indicator,
+                    period_start=period_start, period_end=period_end)
+            for indicator in indicators]
+
+
+def requeue_stale_jobs(lease=LEASE):
+    """
+    Queues again the running jobs without a heartbeat for lease seconds, or fails
+    them if the same job is queued already. Returns their pks.
+    """
+    cutoff = timezone.now() - timedelta(seconds=lease)
+    with transaction.atomic():
+        pks = list(Job.objects.select_for_update(skip_locked=True).filter(
+            Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+            status=JobStatusChoice.RUNNING,
+        ).values_list('pk', flat=True))
+        for pk in pks:
+            try:
+                with transaction.atomic():
+                    Job.objects.filter(pk=pk).update(status=JobStatusChoice.QUEUED, done=0,
+                                                     started_at=None, heartbeat_at=None)
+            except IntegrityError:
+                finish_job(pk, JobStatusChoice.FAILED, "Worker lost, the job was queued again")
+    return pks
+
+
+def claim_jobs(limit):
+    """
+    Marks up to limit queued jobs as running, oldest first, and returns their pks.
+    Jobs whose worker was lost are queued again first.
+    """
+    requeue_stale_jobs()
+    with transaction.atomic():
+        pks = list(Job.objects.select_for_update(skip_locked=True).filter(
+            status=JobStatusChoice.QUEUED
+        ).order_by('created_at').values_list('pk', flat=True)[:limit])
+        now = timezone.now()
+        Job.objects.filter(pk__in=pks).update(status=JobStatusChoice.RUNNING,
+                                              started_at=now, heartbeat_at=now)
+    return pks
+
+
+def heartbeat(job_pks):
+    """Renews the lease of the running jobs"""
+    Job.objects.filter(pk__in=job_pks, status=JobStatusChoice.RUNNING).update(
+        heartbeat_at=timezone.now())
+
+
+def report_progress(job, done, total=None):
+    """Records how much of a job is done"""
+    job.done = done
+    fields = {'done': done, 'heartbeat_at': timezone.now()}
+    if total is not None:
+        job.total = fields['total'] = total
+    Job.objects.filter(pk=job.pk).update(**fields)
+
+
+def finish_job(job_pk, status, result=''):
+    fields = {'status': status, 'result': result, 'finished_at': timezone.now()}
+    if status == JobStatusChoice.DONE:
+        fields['done'] = F('total')
+    Job.objects.filter(pk=job_pk).update(**fields)
+
+
+def recompute(job):
+    from .recompute import store_indicator_values
+    from .snapshots import write_snapshot
+
+    report_progress(job, 0, 2)
+    stored = store_indicator_values(job.indicator, job.period_start, job.period_end)
+    report_progress(job, 1)
+    write_snapshot(job.indicator)
+    return f"Stored {stored} values"
+
+
+def rebuild_rollups(job):
+    from .series_cache import bump_variable_series
+
+    report_progress(job, 0, 1)
+    job.variable.rebuild_rollups()
+    bump_variable_series([job.variable_id])
+    # The indicators over the variable read its rollups
+    enqueue_recomputes([job.variable_id])
+    return "Rollups rebuilt"
+
+
+def export(job):
+    from .exports import export_frames, get_encoder
+    from .recompute import indicator_dates
+    from .series import level_storage
+
+    indicator = job.indicator
+    chunk_size = job.params.get('chunk_size', 500)
+    encode, _, extension = get_encoder(job.params.get('format', 'csv'))
+    dates = indicator_dates(indicator, job.period_start, job.period_end)
+    places = level_storage(indicator).places(indicator.country).count()
+    report_progress(job, 0, math.ceil(places / chunk_size))
+
+    def counted(frames):
+        for done, frame in enumerate(frames, start=1):
+            yield frame
+            report_progress(job, done)
+
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    path = os.path.join(settings.EXPORT_ROOT, f'{indicator.code}-{job.pk}.{extension}')
+    with open(path, 'wb') as file:
+        for chunk in encode(counted(export_frames(indicator, dates, chunk_size=chunk_size))):
+            file.write(chunk.encode() if isinstance(chunk, str) else chunk)
+    return path
+
+
+JOB_HANDLERS = {
+    JobKindChoice.RECOMPUTE: recompute,
+    JobKindChoice.ROLLUPS: rebuild_rollups,
+    JobKindChoice.EXPORT: export,
+}
+
+
+def run_job(job_pk):
+    """Runs a claimed job, recording how it ended"""
+    job = Job.objects.select_related('indicator', 'variable').get(pk=job_pk)
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except Exception:
+        finish_job(job_pk, JobStatusChoice.FAILED, traceback.format_exc())
+        return False
+    else:
+        finish_job(job_pk, JobStatusChoice.DONE, result or '')
+        return True
@@ -0,0 +1,122 @@
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from indicatorDataApp.models import Country, IndicatorVariable
+from indicatorDataApp.models import NationalIndicatorVariable, NationalVarValue
+from indicatorDataApp.models import AggregationLevelChoice, ValueTypeChoice
+
+
+class Rollback(Exception):
+    """Raised to undo everything the benchmark wrote"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Times as-of and range lookups on value rows with and without the "
+        "(variable, period) index. Runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000,
+                            help="Number of value rows to generate")
+        parser.add_argument('--variables', type=int, default=1000,
+                            help="Number of variables the rows are spread over")
+        parser.add_argument('--lookups', type=int, default=200,
+                            help="Number of timed lookups per query kind")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The benchmark generates its rows with Postgres generate_series")
+
+        try:
+            with transaction.atomic():
+                variable_pks = self.seed(options['rows'], options['variables'])
+                self.report(variable_pks, options['lookups'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows, variable_count):
+        """Creates the variables and bulk inserts the value rows in SQL"""
+        # bulk_create skips seeding regions, the benchmark has no use for them
+        country, = Country.objects.bulk_create([Country(name='Benchmark', code='ZZ')])
+        IndicatorVariable.objects.bulk_create([
+            IndicatorVariable(name=f'Benchmark {i}', code=str(i), country=country,
+                              value_type=ValueTypeChoice.INPUTTED,
+                              level=AggregationLevelChoice.NATIONAL)
+            for i in range(variable_count)
+        ])
+        for indicator_var in IndicatorVariable.objects.filter(country=country):
+            indicator_var.get_create_national_var()
+        variable_pks = list(NationalIndicatorVariable.objects.filter(
+            indicator_var__country=country).values_list('pk', flat=True))
+
+        days_per_variable = max(rows // len(variable_pks), 1)
+        self.start_date = date(2000, 1, 1)
+        self.days = days_per_variable
+
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {connection.ops.quote_name(NationalVarValue._meta.db_table)}
+                    (variable_id, period, inputted_value)
+                SELECT variables.id, %s::date + days.n, round((random() * 1000)::numeric, 2)
+                FROM unnest(%s::bigint[]) AS variables(id)
+                CROSS JOIN generate_series(0, %s - 1) AS days(n)
+                """,
+                [self.start_date, variable_pks, days_per_variable],
+            )
+            # Run the deferred foreign key checks now so the table can be altered later
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(NationalVarValue._meta.db_table)}")
+        self.stdout.write(
+            f"Inserted {days_per_variable * len(variable_pks):,} rows "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return variable_pks
+
+    def report(self, variable_pks, lookups):
+        """Times the lookups with the index, then without it"""
+        random.seed(0)
+        samples = [
+            (random.choice(variable_pks),
+             self.start_date + timedelta(days=random.randrange(self.days)))
+            for _ in range(lookups)
+        ]
+        self.time_lookups("with (variable, period) index", samples)
+
+        constraint = NationalVarValue._meta.constraints[0]
+        with transaction.atomic():
+            with connection.schema_editor() as schema_editor:
+                schema_editor.remove_constraint(NationalVarValue, constraint)
+            self.time_lookups("without (variable, period) index", samples)
+            transaction.set_rollback(True)
+
+    def time_lookups(self, label, samples):
+        as_of, ranges = [], []
+        for variable_pk, day in samples:
+            started = time.perf_counter()
+            NationalVarValue.objects.filter(
+                variable_id=variable_pk, period__gte=day
+            ).order_by('period').values_list('inputted_value', flat=True).first()
+            as_of.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            list(NationalVarValue.objects.filter(
+                variable_id=variable_pk, period__range=(day, day + timedelta(days=365))
+            ).values_list('period', 'inputted_value'))
+            ranges.append(time.perf_counter() - started)
+
+        self.stdout.write(label)
+        for name, timings in (('as-of', as_of), ('range', ranges)):
+            timings.sort()
+            self.stdout.write(
+                f"  {name:6} median {statistics.median(timings) * 1000:8.2f} ms"
+                f"   p95 {timings[int(len(timings) * 0.95) - 1] * 1000:8.2f} ms"
+            )
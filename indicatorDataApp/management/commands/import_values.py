@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from indicatorDataApp.imports import import_values, ValueImportError
+from indicatorDataApp.models import Country
+
+
+class Command(BaseCommand):
+    help = "Imports district values from a CSV or Excel file with variable, district, period and value columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the .csv or .xlsx file")
+        parser.add_argument('--country', required=True,
+                            help="Code of the country the variables belong to, eg GH")
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help="Number of rows written per statement")
+
+    def handle(self, *args, **options):
+        try:
+            country = Country.objects.get(code=options['country'].upper())
+        except Country.DoesNotExist:
+            raise CommandError(f"No country with code {options['country']}")
+
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as file:
+                result = import_values(file, options['path'], country,
+                                       chunk_size=options['chunk_size'])
+        except (OSError, ValueImportError) as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - started
+        for error in result.errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported:,} values, skipped {result.skipped:,} rows "
+            f"in {elapsed:.1f}s ({result.imported / max(elapsed, 1e-9):,.0f} values/s)"
+        ))
@@ -0,0 +1,55 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from indicatorDataApp.partitions import (
+    detach_partitions, extend_partitions, is_partitioned, partition_years, value_tables,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Manages the yearly partitions of the value tables: creates the partitions of the "
+        "coming years and detaches, or drops, the partitions of old ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=2,
+                            help="Years after the current one to have partitions for")
+        parser.add_argument('--from-year', type=int,
+                            help="First year to have a partition for, earlier periods share one")
+        parser.add_argument('--detach-before', type=int,
+                            help="Detaches the partitions of the years before this one, with their values")
+        parser.add_argument('--drop', action='store_true',
+                            help="Drops the detached partitions instead of keeping them as tables")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Value tables are only partitioned on Postgres")
+        if options['drop'] and options['detach_before'] is None:
+            raise CommandError("--drop only applies with --detach-before")
+
+        last = date.today().year + options['ahead']
+        for table in value_tables():
+            with transaction.atomic(), connection.cursor() as cursor:
+                if not is_partitioned(cursor, table):
+                    raise CommandError(f"{table} is not partitioned, run the migrations first")
+
+                first = options['from_year'] or partition_years(cursor, table)[0]
+                try:
+                    created = extend_partitions(cursor, table, first, last)
+                except ValueError as e:
+                    raise CommandError(f"{table}: {e}")
+                if created:
+                    self.stdout.write(f"{table}: created {', '.join(map(str, created))}")
+
+                if options['detach_before'] is not None:
+                    retired = detach_partitions(cursor, table, options['detach_before'],
+                                                drop=options['drop'])
+                    if retired:
+                        action = 'dropped' if options['drop'] else 'detached'
+                        self.stdout.write(f"{table}: {action} {', '.join(map(str, retired))}")
+
+                years = partition_years(cursor, table)
+                self.stdout.write(self.style.SUCCESS(f"{table}: partitions {years[0]} to {years[-1]}"))
@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from indicatorDataApp.models import Country, Indicator
+from indicatorDataApp.worker import init_worker, rebuild_country, rebuild_indicator
+
+
+class InProcessExecutor(Executor):
+    """Runs each task as it is submitted, in this process and on its connection"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        # Worker entry points close stale connections after each task, this one is still in use
+        future.set_result(fn.__wrapped__(*args, **kwargs))
+        return future
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every rollup and stored indicator value, after migrations or data fixes. "
+        "Rollups are rebuilt per country, then indicator values per indicator, each "
+        "partition in a worker process with its own database connection. With a single "
+        "worker, partitions are rebuilt one after another in this process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of partitions rebuilt at once, defaults to the number of cores")
+        parser.add_argument('--country', action='append', default=[],
+                            help="Code of a country to rebuild, may be repeated. Defaults to all")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        countries = Country.objects.all()
+        if options['country']:
+            countries = countries.filter(code__in=options['country'])
+            missing = set(options['country']) - set(countries.values_list('code', flat=True))
+            if missing:
+                raise CommandError(f"Unknown countries: {', '.join(sorted(missing))}")
+        country_pks = list(countries.values_list('pk', flat=True))
+        indicator_pks = list(Indicator.objects.filter(country__in=country_pks)
+                             .values_list('pk', flat=True))
+
+        started = time.perf_counter()
+        if options['workers'] == 1:
+            pool = InProcessExecutor()
+        else:
+            # Spawned workers start without the parent's database connections
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        with pool:
+            # Indicators read the rollups, so every country is done before them
+            rollups = self.run(pool, rebuild_country, country_pks, 'countries', 'rollups')
+            values = self.run(pool, rebuild_indicator, indicator_pks, 'indicators', 'indicator values')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {rollups} rollups and {values} indicator values in {elapsed:.1f}s "
+            f"({(rollups + values) / max(elapsed, 1e-9):,.0f} rows/s, {options['workers']} workers)"
+        ))
+
+    def run(self, pool, task, pks, partitions, rows):
+        """Runs task over every pk in the pool, returns the total of rows written"""
+        started = time.perf_counter()
+        futures = {pool.submit(task, pk): pk for pk in pks}
+        written = 0
+        for done, future in enumerate(as_completed(futures), start=1):
+            written += future.result()
+            if self.verbosity >= 2:
+                self.stdout.write(f"{partitions} {done}/{len(pks)}, #{futures[future]} done")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{len(pks)} {partitions}: {written} {rows} in {elapsed:.1f}s "
+            f"({written / max(elapsed, 1e-9):,.0f} rows/s)"
+        )
+        return written
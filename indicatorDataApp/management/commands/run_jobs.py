@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.management.base import BaseCommand
+
+from indicatorDataApp.jobs import claim_jobs, finish_job, heartbeat
+from indicatorDataApp.models import JobStatusChoice
+from indicatorDataApp.worker import init_worker, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued background jobs (indicator recomputes, rollup rebuilds, exports) "
+        "in a pool of worker processes. Several workers may share the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of jobs run at once, defaults to the number of cores")
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help="Seconds to wait for new jobs when the queue is empty")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of waiting for jobs")
+
+    def new_pool(self, workers):
+        # Spawned workers start without the parent's database connections
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                   mp_context=multiprocessing.get_context('spawn'))
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        pool = self.new_pool(workers)
+        running = {}
+        try:
+            while True:
+                if len(running) < workers:
+                    for pk in claim_jobs(workers - len(running)):
+                        try:
+                            running[pool.submit(run_job, pk)] = pk
+                        except BrokenProcessPool as e:
+                            self.fail(pk, e)
+                            continue
+                        self.stdout.write(f"Started job {pk}")
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                finished, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                # Keeps the running jobs from being taken for lost
+                heartbeat(list(running.values()))
+                broken = False
+                for future in finished:
+                    pk = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # The worker process died, the job could not record it itself
+                        self.fail(pk, error)
+                        broken = broken or isinstance(error, BrokenProcessPool)
+                    elif future.result():
+                        self.stdout.write(self.style.SUCCESS(f"Finished job {pk}"))
+                    else:
+                        self.stderr.write(f"Job {pk} failed, see its result in the admin")
+
+                if broken:
+                    # A broken pool fails every job it holds, start over with a new one
+                    for pk in running.values():
+                        self.fail(pk, BrokenProcessPool("Worker pool restarted"))
+                    running = {}
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.new_pool(workers)
+        finally:
+            pool.shutdown()
+
+    def fail(self, pk, error):
+        finish_job(pk, JobStatusChoice.FAILED, repr(error))
+        self.stderr.write(f"Job {pk} crashed: {error!r}")
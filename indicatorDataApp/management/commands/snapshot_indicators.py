@@ -0,0 +1,42 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from indicatorDataApp.models import Indicator
+from indicatorDataApp.worker import init_worker, snapshot_indicator
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the on disk snapshot of every indicator's series, read by Indicator.data(). "
+        "Meant to be run periodically, recompute jobs also refresh the snapshots they touch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of indicators snapshotted at once, defaults to the number of cores")
+        parser.add_argument('--indicator', type=int, action='append', default=[],
+                            help="Pk of an indicator to snapshot, may be repeated. Defaults to all")
+
+    def handle(self, *args, **options):
+        if getattr(settings, 'SNAPSHOT_ROOT', None) is None:
+            raise CommandError("Set SNAPSHOT_ROOT to write snapshots")
+
+        indicators = Indicator.objects.all()
+        if options['indicator']:
+            indicators = indicators.filter(pk__in=options['indicator'])
+        pks = list(indicators.values_list('pk', flat=True))
+
+        started = time.perf_counter()
+        # Spawned workers start without the parent's database connections
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            places = sum(pool.map(snapshot_indicator, pks))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(pks)} snapshots of {places} places in {time.perf_counter() - started:.1f}s"
+        ))
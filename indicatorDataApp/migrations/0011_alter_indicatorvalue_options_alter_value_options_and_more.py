@@ -0,0 +1,70 @@
+# Generated by Django 4.2 on 2026-10-16 22:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0010_remove_indicator_reporting_period_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='indicatorvalue',
+            options={'ordering': ['period']},
+        ),
+        migrations.AlterModelOptions(
+            name='value',
+            options={'ordering': ['period']},
+        ),
+        migrations.AlterField(
+            model_name='indicator',
+            name='measurement_freq',
+            field=models.CharField(choices=[('Bien', 'Biennial [2]'), ('Yr', 'Yearly [1]'), ('Bia', 'Biannually [1/2]'), ('Qr', 'Quarterly [1/4]'), ('Mt', 'Monthly [1/12]'), ('Wk', 'Weekly [1/52]'), ('Dy', 'Daily [1/365.5]')], max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='value',
+            name='period',
+            field=models.DateField(),
+        ),
+        migrations.CreateModel(
+            name='RegionalVarRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=15, null=True)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('variable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='indicatorDataApp.regionalindicatorvariable')),
+            ],
+            options={
+                'ordering': ['period'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='NationalVarRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('value', models.DecimalField(decimal_places=2, max_digits=15, null=True)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('variable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='indicatorDataApp.nationalindicatorvariable')),
+            ],
+            options={
+                'ordering': ['period'],
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='regionalvarrollup',
+            constraint=models.UniqueConstraint(fields=('variable', 'period'), name='unique_regional_rollup_period'),
+        ),
+        migrations.AddConstraint(
+            model_name='nationalvarrollup',
+            constraint=models.UniqueConstraint(fields=('variable', 'period'), name='unique_national_rollup_period'),
+        ),
+    ]
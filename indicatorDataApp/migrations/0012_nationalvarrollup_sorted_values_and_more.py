@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-16 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0011_alter_indicatorvalue_options_alter_value_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nationalvarrollup',
+            name='sorted_values',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='regionalvarrollup',
+            name='sorted_values',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
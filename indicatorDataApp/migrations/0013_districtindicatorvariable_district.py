@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-16 22:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0012_nationalvarrollup_sorted_values_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='districtindicatorvariable',
+            name='district',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='variables', to='indicatorDataApp.district'),
+        ),
+    ]
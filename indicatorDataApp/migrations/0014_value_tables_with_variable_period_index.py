@@ -0,0 +1,140 @@
+# Moves the period and inputted_value of every value out of the shared
+# multi-table inherited Value table into the per level tables, so each value
+# is one row that can be indexed and kept unique on (variable, period).
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+LEVELS = [
+    ('NationalVarValue', 'NationalIndicatorVariable', 'national'),
+    ('RegionalVarValue', 'RegionalIndicatorVariable', 'regional'),
+    ('DistrictVarValue', 'DistrictIndicatorVariable', 'district'),
+]
+
+
+def copy_values(apps, schema_editor):
+    """
+    Copies values to the new tables in SQL, keeping their pks. Fails if a
+    variable has several values for a period, rather than drop any of them.
+    """
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    parent = apps.get_model('indicatorDataApp', 'Value')._meta
+    for model_name, _, _ in LEVELS:
+        old = apps.get_model('indicatorDataApp', model_name)._meta
+        new_model = apps.get_model('indicatorDataApp', 'New' + model_name)
+        new = new_model._meta
+        rows = (
+            f"FROM {qn(old.db_table)} AS child"
+            f" JOIN {qn(parent.db_table)} AS parent"
+            f" ON parent.{qn(parent.pk.column)} = child.{qn(old.pk.column)}"
+        )
+        variable = f"child.{qn(old.get_field('variable').column)}"
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {variable}, parent.period, COUNT(*) {rows}"
+                f" GROUP BY {variable}, parent.period HAVING COUNT(*) > 1"
+                f" ORDER BY {variable}, parent.period"
+            )
+            duplicates = cursor.fetchall()
+            if duplicates:
+                listed = ', '.join(f"variable {variable_id} at {period} ({count} values)"
+                                   for variable_id, period, count in duplicates[:20])
+                raise RuntimeError(
+                    f"{len(duplicates)} (variable, period) pairs of {model_name} have several "
+                    f"values, keep one value of each and migrate again: {listed}"
+                )
+
+            cursor.execute(
+                f"INSERT INTO {qn(new.db_table)}"
+                f" ({qn(new.pk.column)}, {qn(new.get_field('variable').column)}, period, inputted_value)"
+                f" SELECT child.{qn(old.pk.column)}, {variable}, parent.period, parent.inputted_value"
+                f" {rows}"
+            )
+            # Ids were copied, so move the id sequence past them
+            for sql in connection.ops.sequence_reset_sql(no_style(), [new_model]):
+                cursor.execute(sql)
+
+
+def copy_values_back(apps, schema_editor):
+    """
+    Copies values back to the inherited tables in SQL. Each level numbered its
+    values on its own since, so a level's ids are moved past the shared Value
+    table's before they are copied.
+    """
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    parent_model = apps.get_model('indicatorDataApp', 'Value')
+    parent = parent_model._meta
+    for model_name, _, _ in LEVELS:
+        old = apps.get_model('indicatorDataApp', model_name)._meta
+        new = apps.get_model('indicatorDataApp', 'New' + model_name)._meta
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX({qn(parent.pk.column)}), 0) FROM {qn(parent.db_table)}")
+            offset = cursor.fetchone()[0]
+            cursor.execute(
+                f"INSERT INTO {qn(parent.db_table)} ({qn(parent.pk.column)}, period, inputted_value)"
+                f" SELECT {qn(new.pk.column)} + %s, period, inputted_value FROM {qn(new.db_table)}",
+                [offset]
+            )
+            cursor.execute(
+                f"INSERT INTO {qn(old.db_table)}"
+                f" ({qn(old.pk.column)}, {qn(old.get_field('variable').column)})"
+                f" SELECT {qn(new.pk.column)} + %s, {qn(new.get_field('variable').column)}"
+                f" FROM {qn(new.db_table)}",
+                [offset]
+            )
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [parent_model]):
+            cursor.execute(sql)
+
+
+def new_value_model(model_name, variable_model_name):
+    return migrations.CreateModel(
+        name='New' + model_name,
+        fields=[
+            ('id', models.BigAutoField(auto_created=True, primary_key=True,
+                                       serialize=False, verbose_name='ID')),
+            ('period', models.DateField()),
+            ('inputted_value', models.DecimalField(decimal_places=2, default=None, max_digits=9)),
+            ('variable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                           related_name='+',
+                                           to='indicatorDataApp.' + variable_model_name.lower())),
+        ],
+        options={
+            'ordering': ['period'],
+            'abstract': False,
+        },
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0013_districtindicatorvariable_district'),
+    ]
+
+    operations = [
+        *[new_value_model(model_name, variable_model_name)
+          for model_name, variable_model_name, _ in LEVELS],
+        migrations.RunPython(copy_values, copy_values_back),
+        *[migrations.DeleteModel(name=model_name) for model_name, _, _ in LEVELS],
+        migrations.DeleteModel(name='Value'),
+        *[migrations.RenameModel(old_name='New' + model_name, new_name=model_name)
+          for model_name, _, _ in LEVELS],
+        *[migrations.AlterField(
+            model_name=model_name.lower(),
+            name='variable',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='value_models',
+                                    to='indicatorDataApp.' + variable_model_name.lower()),
+        ) for model_name, variable_model_name, _ in LEVELS],
+        *[migrations.AddConstraint(
+            model_name=model_name.lower(),
+            constraint=models.UniqueConstraint(fields=('variable', 'period'),
+                                               name=f'unique_{level}_value_period'),
+        ) for model_name, _, level in LEVELS],
+    ]
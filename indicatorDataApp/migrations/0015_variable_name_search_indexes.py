@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-16 22:57
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0014_value_tables_with_variable_period_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='districtindicatorvariable',
+            index=models.Index(fields=['name', 'id'], name='district_var_name_page'),
+        ),
+        migrations.AddIndex(
+            model_name='districtindicatorvariable',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='district_var_name_prefix'),
+        ),
+        migrations.AddIndex(
+            model_name='regionalindicatorvariable',
+            index=models.Index(fields=['name', 'id'], name='regional_var_name_page'),
+        ),
+        migrations.AddIndex(
+            model_name='regionalindicatorvariable',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='regional_var_name_prefix'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-16 22:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('indicatorDataApp', '0015_variable_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indicatorvariable',
+            name='assignees',
+            field=models.ManyToManyField(blank=True, related_name='assigned_variables', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,86 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_ancestors(apps, schema_editor):
+    """Copies every ancestor down from the parent rows, a statement per column"""
+    Region = apps.get_model('indicatorDataApp', 'Region')
+    District = apps.get_model('indicatorDataApp', 'District')
+    NationalIndicatorVariable = apps.get_model('indicatorDataApp', 'NationalIndicatorVariable')
+    RegionalIndicatorVariable = apps.get_model('indicatorDataApp', 'RegionalIndicatorVariable')
+    DistrictIndicatorVariable = apps.get_model('indicatorDataApp', 'DistrictIndicatorVariable')
+
+    District.objects.update(country=Subquery(
+        Region.objects.filter(pk=OuterRef('region')).values('country')[:1]
+    ))
+    RegionalIndicatorVariable.objects.update(indicator_var=Subquery(
+        NationalIndicatorVariable.objects.filter(pk=OuterRef('national_var')).values('indicator_var')[:1]
+    ))
+    regional_vars = RegionalIndicatorVariable.objects.filter(pk=OuterRef('regional_var'))
+    DistrictIndicatorVariable.objects.update(
+        national_var=Subquery(regional_vars.values('national_var')[:1]),
+        indicator_var=Subquery(regional_vars.values('indicator_var')[:1]),
+        region=Subquery(regional_vars.values('region')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0016_indicatorvariable_assignees'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='district',
+            name='country',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='districts', to='indicatorDataApp.country'),
+        ),
+        migrations.AddField(
+            model_name='regionalindicatorvariable',
+            name='indicator_var',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='regional_vars', to='indicatorDataApp.indicatorvariable'),
+        ),
+        migrations.AddField(
+            model_name='districtindicatorvariable',
+            name='national_var',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='district_vars', to='indicatorDataApp.nationalindicatorvariable'),
+        ),
+        migrations.AddField(
+            model_name='districtindicatorvariable',
+            name='indicator_var',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='district_vars', to='indicatorDataApp.indicatorvariable'),
+        ),
+        migrations.AddField(
+            model_name='districtindicatorvariable',
+            name='region',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='district_vars', to='indicatorDataApp.region'),
+        ),
+        migrations.RunPython(fill_ancestors, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='district',
+            name='country',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='districts', to='indicatorDataApp.country'),
+        ),
+        migrations.AlterField(
+            model_name='regionalindicatorvariable',
+            name='indicator_var',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='regional_vars', to='indicatorDataApp.indicatorvariable'),
+        ),
+        migrations.AlterField(
+            model_name='districtindicatorvariable',
+            name='national_var',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='district_vars', to='indicatorDataApp.nationalindicatorvariable'),
+        ),
+        migrations.AlterField(
+            model_name='districtindicatorvariable',
+            name='indicator_var',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='district_vars', to='indicatorDataApp.indicatorvariable'),
+        ),
+        migrations.AlterField(
+            model_name='districtindicatorvariable',
+            name='region',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='district_vars', to='indicatorDataApp.region'),
+        ),
+    ]
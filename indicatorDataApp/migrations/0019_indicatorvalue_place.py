@@ -0,0 +1,37 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_places(apps, schema_editor):
+    """Only national values were stored so far, their place is the country"""
+    Indicator = apps.get_model('indicatorDataApp', 'Indicator')
+    IndicatorValue = apps.get_model('indicatorDataApp', 'IndicatorValue')
+
+    IndicatorValue.objects.update(place=Subquery(
+        Indicator.objects.filter(pk=OuterRef('indicator')).values('country')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0018_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indicatorvalue',
+            name='place',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(fill_places, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='indicatorvalue',
+            name='place',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='indicatorvalue',
+            constraint=models.UniqueConstraint(fields=('indicator', 'period', 'place'), name='unique_indicator_place_period'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.db import migrations
+
+from indicatorDataApp.partitions import data_years, is_partitioned, rebuild_table
+
+
+TABLES = [
+    'indicatorDataApp_nationalvarvalue',
+    'indicatorDataApp_regionalvarvalue',
+    'indicatorDataApp_districtvarvalue',
+]
+
+# Years after the current one given a partition up front, the partition_values
+# command adds the following ones
+YEARS_AHEAD = 2
+
+
+def partition_values(apps, schema_editor):
+    """Rebuilds the value tables partitioned by year, a partition per year of data"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            if is_partitioned(cursor, table):
+                continue
+            first, last = data_years(cursor, table)
+            this_year = date.today().year
+            rebuild_table(cursor, table, min(first or this_year, this_year),
+                          max(last or this_year, this_year) + YEARS_AHEAD)
+
+
+def unpartition_values(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            if is_partitioned(cursor, table):
+                rebuild_table(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0019_indicatorvalue_place'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_values, unpartition_values),
+    ]
@@ -0,0 +1,90 @@
+from collections import defaultdict
+from decimal import Decimal
+from statistics import median
+
+from django.db import migrations
+
+
+# Choice values as of this migration
+DISTRICT = 'Dis'
+REGIONAL = 'Reg'
+NET = 'Net'
+MEDIAN = 'Mdn'
+
+
+def group_values(rows):
+    """Groups (variable, period, value) rows by (variable, period), skipping empty values"""
+    grouped = defaultdict(list)
+    for variable_pk, period, value in rows:
+        if value is not None:
+            grouped[variable_pk, period].append(Decimal(value))
+    return grouped
+
+
+def make_rollups(rollup_model, grouped, compute_formats):
+    """The rollups of grouped values, aggregated like Rollup.set_values"""
+    rollups = []
+    for (variable_pk, period), values in grouped.items():
+        compute_format = compute_formats[variable_pk]
+        total = sum(values, Decimal(0))
+        if compute_format == NET:
+            value = total
+        elif compute_format == MEDIAN:
+            value = median(values)
+        else:
+            value = total / len(values)
+        rollups.append(rollup_model(
+            variable_id=variable_pk, period=period, total=total, count=len(values),
+            value=Decimal(value).quantize(Decimal('0.01')),
+            sorted_values=[str(v) for v in sorted(values)] if compute_format == MEDIAN else [],
+        ))
+    return rollups
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Computes the rollups of the values entered before the rollup tables existed,
+    which 0011 created empty
+    """
+    RegionalIndicatorVariable = apps.get_model('indicatorDataApp', 'RegionalIndicatorVariable')
+    NationalIndicatorVariable = apps.get_model('indicatorDataApp', 'NationalIndicatorVariable')
+    DistrictVarValue = apps.get_model('indicatorDataApp', 'DistrictVarValue')
+    RegionalVarValue = apps.get_model('indicatorDataApp', 'RegionalVarValue')
+    RegionalVarRollup = apps.get_model('indicatorDataApp', 'RegionalVarRollup')
+    NationalVarRollup = apps.get_model('indicatorDataApp', 'NationalVarRollup')
+
+    # Regional rollups aggregate the district values
+    regional_vars = RegionalIndicatorVariable.objects.values_list(
+        'pk', 'national_var', 'indicator_var__level', 'indicator_var__compute_format')
+    national_vars = {pk: (national_var, level) for pk, national_var, level, _ in regional_vars}
+    regional = group_values(DistrictVarValue.objects.order_by().values_list(
+        'variable__regional_var', 'period', 'inputted_value').iterator())
+    regional_rollups = make_rollups(
+        RegionalVarRollup, regional,
+        {pk: compute_format for pk, _, _, compute_format in regional_vars})
+
+    # National rollups aggregate the regional rollups of district level variables
+    # and the regional values of regional level variables
+    rows = [(national_vars[rollup.variable_id][0], rollup.period, rollup.value)
+            for rollup in regional_rollups if national_vars[rollup.variable_id][1] == DISTRICT]
+    rows += RegionalVarValue.objects.filter(variable__indicator_var__level=REGIONAL).order_by(
+    ).values_list('variable__national_var', 'period', 'inputted_value')
+    national_rollups = make_rollups(
+        NationalVarRollup, group_values(rows),
+        dict(NationalIndicatorVariable.objects.values_list('pk', 'indicator_var__compute_format')))
+
+    for rollup_model, rollups in [(RegionalVarRollup, regional_rollups),
+                                  (NationalVarRollup, national_rollups)]:
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create(rollups, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('indicatorDataApp', '0020_partition_values'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
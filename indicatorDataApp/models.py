@@ -1,8 +1,16 @@
-from django.db import models
-from django.db.models import Min, Max, Q
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import OpClass
+from django.utils.functional import cached_property
+from bisect import bisect_left, insort
+from decimal import Decimal, ROUND_HALF_UP
 from statistics import mean, median
 
-from dateutil.rrule import rrule, YEARLY
+import numpy as np
+
+from .formulas import compile_formula, default_formula
 
 
 # Choice Fiels
@@ -52,6 +60,21 @@ class CalFormatChoice(models.TextChoices):
     MEDIAN = 'Mdn', 'Median'
 
 
+class JobKindChoice(models.TextChoices):
+    """The work a background job does"""
+    RECOMPUTE = 'Recomp', 'Recompute indicator'
+    ROLLUPS = 'Rollups', 'Rebuild rollups'
+    EXPORT = 'Export', 'Export indicator'
+
+
+class JobStatusChoice(models.TextChoices):
+    """Where a background job is in its life"""
+    QUEUED = 'Queued', 'Queued'
+    RUNNING = 'Running', 'Running'
+    DONE = 'Done', 'Done'
+    FAILED = 'Failed', 'Failed'
+
+
 #Models
 class Country(models.Model):
     """A normal country"""
@@ -66,6 +89,13 @@ class Country(models.Model):
         return self.name + " (" + self.code + ")"
 
 
+def country_code(country_pk):
+    """The code of a country, from the hierarchy registry so without a query"""
+    from .registry import lookup
+
+    return lookup(lambda registry: registry.country_code(country_pk))
+
+
 class Region(models.Model):
     """Region of a country"""
 
@@ -73,8 +103,15 @@ class Region(models.Model):
     code = models.CharField(max_length=10, unique=True)
     country = models.ForeignKey(Country, related_name='regions', on_delete=models.CASCADE)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            # Keep the districts' denormalized country in step
+            self.districts.exclude(country=self.country_id).update(country=self.country_id)
+
     def __str__(self):
-        return self.name + " " + self.country.code
+        return self.name + " " + country_code(self.country_id)
 
 
 class District(models.Model):
@@ -83,10 +120,20 @@ class District(models.Model):
     name = models.CharField(max_length=80)
     code = models.CharField(max_length=10, unique=True)
     region = models.ForeignKey(Region, related_name='districts', on_delete=models.CASCADE)
+    # The region's country, denormalized so districts of a country are one lookup away
+    country = models.ForeignKey(Country, related_name='districts', on_delete=models.CASCADE)
+
+    def save(self, *args, **kwargs):
+        self.country_id = self.region.country_id
+        super().save(*args, **kwargs)
 
 
 class Value(models.Model):
-    """The actual value a Variable"""
+    """
+    The actual value a Variable.
+    Abstract, each level keeps its values in a single table of its own, so
+    reads and writes of values never join or insert into a parent table.
+    """
     period = models.DateField()
     inputted_value = models.DecimalField(decimal_places=2, max_digits=9, default=None)
 
@@ -101,10 +148,37 @@ class Value(models.Model):
     def normal_string_period(self):
         return self.period.isoformat()
 
-    # Not explicitely made abstract but they are abstract
-    value_type = None    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded()
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Forms pass datetimes and floats. Keep the date and the rounded value the
+        # database stores, so rollups shift by exactly that and an unchanged
+        # period compares equal to the loaded one.
+        self.period = self._meta.get_field('period').to_python(self.period)
+        if self.inputted_value is not None:
+            places = self._meta.get_field('inputted_value').decimal_places
+            self.inputted_value = as_decimal(self.inputted_value).quantize(
+                Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+        super().save(*args, **kwargs)
+
+    def remember_loaded(self):
+        """Keeps the stored period and value so their rollups can be shifted on save"""
+        self._loaded_period = self.__dict__.get('period')
+        self._loaded_value = self.__dict__.get('inputted_value')
+
+    value_type = None
+    level = None
     def computed_value(self):
         pass
+
+    @property
+    def is_leaf(self):
+        """True if values are inputted at this level, ie no lower level exists"""
+        return self.variable_level == self.level
     
     def compute(self, values, compute_format):
         """Computes values base on compute format"""
@@ -113,38 +187,141 @@ class Value(models.Model):
 
     @property
     def value(self):
-        if self.value_type == ValueTypeChoice.INPUTTED:
+        if self.value_type == ValueTypeChoice.INPUTTED or self.is_leaf:
             return self.inputted_value
         return self.computed_value()
     
     class Meta:
+        abstract = True
         ordering = ['period']
 
 
+class Rollup(models.Model):
+    """
+    Stored aggregate of the values one level below a variable at a period.
+    Written by the upward aggregation (district -> region -> nation) so that
+    computed values are read instead of recomputed.
+    Keeps a running total and count, and for medians the sorted child values,
+    so a single child change is applied without reading its siblings.
+    Shifting a median still reads and rewrites the whole sorted list, so it
+    costs O(children) per write; the other formats only touch total and count.
+    """
+    period = models.DateField()
+    value = models.DecimalField(decimal_places=2, max_digits=15, null=True)
+    total = models.DecimalField(decimal_places=2, max_digits=15, default=0)
+    count = models.PositiveIntegerField(default=0)
+    sorted_values = models.JSONField(default=list, blank=True)
+
+    @staticmethod
+    def compute(values, compute_format):
+        """Aggregates values by compute format, None if there is nothing to aggregate"""
+        if not values:
+            return None
+        return Value.computing_funcs[compute_format](values)
+
+    def set_values(self, values, compute_format):
+        """Replaces the aggregated child values"""
+        self.total = sum(values, Decimal(0))
+        self.count = len(values)
+        self.sorted_values = []
+        if compute_format == CalFormatChoice.MEDIAN:
+            self.sorted_values = [str(v) for v in sorted(values)]
+        self.value = self.aggregate(compute_format)
+
+    def shift(self, compute_format, added=None, removed=None):
+        """Applies one child value being added and/or removed"""
+        if removed is not None:
+            self.total -= removed
+            self.count -= 1
+        if added is not None:
+            self.total += added
+            self.count += 1
+        if compute_format == CalFormatChoice.MEDIAN:
+            members = [Decimal(v) for v in self.sorted_values]
+            if removed is not None:
+                index = bisect_left(members, removed)
+                if index < len(members) and members[index] == removed:
+                    members.pop(index)
+            if added is not None:
+                insort(members, added)
+            self.sorted_values = [str(v) for v in members]
+        else:
+            self.sorted_values = []
+        self.value = self.aggregate(compute_format)
+
+    def aggregate(self, compute_format):
+        """The rollup value from the running total, count and sorted values"""
+        if not self.count:
+            return None
+        if compute_format == CalFormatChoice.NET:
+            value = self.total
+        elif compute_format == CalFormatChoice.MEDIAN:
+            value = median(Decimal(v) for v in self.sorted_values)
+        else:
+            value = self.total / self.count
+        return Decimal(value).quantize(Decimal('0.01'))
+
+    class Meta:
+        abstract = True
+        ordering = ['period']
+
+
+class NationalVarRollup(Rollup):
+    """Aggregate of the regional values of a national variable at a period"""
+    variable = models.ForeignKey('NationalIndicatorVariable',
+                                 related_name='rollups',
+                                 on_delete=models.CASCADE)
+
+    class Meta(Rollup.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['variable', 'period'],
+                                    name='unique_national_rollup_period'),
+        ]
+
+
+class RegionalVarRollup(Rollup):
+    """Aggregate of the district values of a regional variable at a period"""
+    variable = models.ForeignKey('RegionalIndicatorVariable',
+                                 related_name='rollups',
+                                 on_delete=models.CASCADE)
+
+    class Meta(Rollup.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['variable', 'period'],
+                                    name='unique_regional_rollup_period'),
+        ]
+
+
 
 class NationalVarValue(Value):
     """The value at a period for a national variable"""
     variable = models.ForeignKey('NationalIndicatorVariable',
                                  related_name='value_models',
                                  on_delete=models.CASCADE)
+    level = AggregationLevelChoice.NATIONAL
+
     @property
     def value_type(self):
         return self.variable.indicator_var.value_type
 
+    @property
+    def variable_level(self):
+        return self.variable.indicator_var.level
+
     def computed_value(self):
-        #TODO: Values should be computed and stored once and for all
-        """Returns the computed value instead of inputted value"""
-        regional_vars = RegionalIndicatorVariable.objects.filter(
-            Q(region__country=self.variable.country) &
-            Q(country_var__indicator_var=self.variable.indicator_var)
-        )
-        regional_var_values = RegionalVarValue.objects.filter(variable__in=regional_vars)
-        all_values = regional_var_values.values_list('value_value', flat=True)
-        
-        return self.compute(all_values, self.variable.indicator_var.compute_format)
+        """Returns the stored rollup of the regional values at this period"""
+        return NationalVarRollup.objects.filter(
+            variable_id=self.variable_id, period=self.period
+        ).values_list('value', flat=True).first()
 
     def __str__(self):
-        return self.variable.name + ' @ ' + self.period
+        return self.variable.name + ' @ ' + self.period.isoformat()
+
+    class Meta(Value.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['variable', 'period'],
+                                    name='unique_national_value_period'),
+        ]
 
 
 class RegionalVarValue(Value):
@@ -152,24 +329,30 @@ class RegionalVarValue(Value):
     variable = models.ForeignKey('RegionalIndicatorVariable',
                                  related_name='value_models',
                                  on_delete=models.CASCADE)
+    level = AggregationLevelChoice.REGIONAL
+
     @property
     def value_type(self):
-        return self.variable.national_var.indicator_var.value_type
-    
+        return self.variable.indicator_var.value_type
+
+    @property
+    def variable_level(self):
+        return self.variable.indicator_var.level
+
     def computed_value(self):
-        """Returns the computed value instead of inputted value"""
-        indicator_variable = self.variable.national_var.indicator_var
-        district_vars = DistrictIndicatorVariable.objects.filter(
-            Q(district__region=self.variable.region) &
-            Q(regional_var__national_var__indicator_var=indicator_variable)
-        )
-        district_var_values = DistrictVarValue.objects.filter(variable__in=district_vars)
-        all_values = district_var_values.value_list('value__value', flat=True) 
-        
-        return self.compute(all_values, self.variable.national_var.indicator_var.compute_format)
+        """Returns the stored rollup of the district values at this period"""
+        return RegionalVarRollup.objects.filter(
+            variable_id=self.variable_id, period=self.period
+        ).values_list('value', flat=True).first()
     
     def __str__(self):
-        return self.variable.name + ' @ ' + self.period
+        return self.variable.name + ' @ ' + self.period.isoformat()
+
+    class Meta(Value.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['variable', 'period'],
+                                    name='unique_regional_value_period'),
+        ]
 
 
 class DistrictVarValue(Value):
@@ -177,18 +360,108 @@ class DistrictVarValue(Value):
     variable = models.ForeignKey('DistrictIndicatorVariable',
                                  related_name='value_models',
                                  on_delete=models.CASCADE)
-    
+    level = AggregationLevelChoice.DISTRICT
+    variable_level = AggregationLevelChoice.DISTRICT
+
     def computed_value(self):
         """Region has no computed values, so returns inputted value"""
         return self.inputted_value
 
     @property
     def value_type(self):
-        return self.variable.regional_var.national_var.indicator_var.value_type
+        return self.variable.indicator_var.value_type
 
     def __str__(self):
         return self.variable.name + ' @ ' + self.period.isoformat()
 
+    class Meta(Value.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['variable', 'period'],
+                                    name='unique_district_value_period'),
+        ]
+
+
+def as_decimal(value):
+    """Values may come in as floats from forms, rollups are kept in Decimal"""
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def store_rollup(rollup_model, variable, period, values, compute_format):
+    """
+    Writes the aggregate of values as the rollup of variable at period.
+    The rollup is removed when there is nothing left to aggregate.
+    """
+    if not values:
+        rollup_model.objects.filter(variable=variable, period=period).delete()
+        return None
+
+    rollup = rollup_model(variable=variable, period=period)
+    rollup.set_values([as_decimal(v) for v in values], compute_format)
+    rollup, _ = rollup_model.objects.update_or_create(
+        variable=variable,
+        period=period,
+        defaults={
+            'value': rollup.value,
+            'total': rollup.total,
+            'count': rollup.count,
+            'sorted_values': rollup.sorted_values,
+        }
+    )
+    return rollup
+
+
+def shift_rollup(rollup_model, variable, period, compute_format, added=None, removed=None):
+    """
+    Applies one child value being added and/or removed to the rollup of
+    variable at period without touching the other children.
+    Returns the rollup value before and after the change.
+    """
+    added, removed = as_decimal(added), as_decimal(removed)
+    if added is None and removed is None:
+        return None, None
+
+    with transaction.atomic():
+        rollups = rollup_model.objects.select_for_update()
+        if added is None:
+            # Nothing to remove from, eg the rollup went with a deleted variable
+            rollup = rollups.filter(variable=variable, period=period).first()
+            if rollup is None:
+                return None, None
+        else:
+            rollup, _ = rollups.get_or_create(variable=variable, period=period)
+        before = rollup.value
+        rollup.shift(compute_format, added=added, removed=removed)
+        if rollup.count:
+            rollup.save()
+        else:
+            rollup.delete()
+    return before, rollup.value
+
+
+def create_district_vars(regional_vars):
+    """
+    Creates the missing district vars under regional_vars with a constant number
+    of queries: one for the regional vars, one to diff the districts that already
+    have a var and one insert
+    """
+    regional_vars = {var.region_id: var for var in regional_vars}
+    missing_districts = District.objects.filter(
+        region__in=list(regional_vars)
+    ).exclude(variables__regional_var__in=list(regional_vars.values()))
+    DistrictIndicatorVariable.objects.bulk_create([
+        DistrictIndicatorVariable(
+            regional_var=regional_vars[district.region_id],
+            national_var_id=regional_vars[district.region_id].national_var_id,
+            indicator_var_id=regional_vars[district.region_id].indicator_var_id,
+            region_id=district.region_id,
+            district=district,
+            name=regional_vars[district.region_id].name + ' ' + district.code,
+        )
+        for district in missing_districts
+    ])
+
 
 class IndicatorVariable(models.Model):
     """Base Indicator variable"""
@@ -203,15 +476,20 @@ class IndicatorVariable(models.Model):
     compute_format = models.CharField(max_length=10,
                                         choices=CalFormatChoice.choices,
                                         default=CalFormatChoice.NET)
+    # Users allowed to input values of the variable's national, regional and district vars
+    assignees = models.ManyToManyField(settings.AUTH_USER_MODEL,
+                                       related_name='assigned_variables', blank=True)
+
+    def is_computed_at(self, level):
+        """True if the values at level are rollups of a lower level"""
+        return self.value_type == ValueTypeChoice.COMPUTED and self.level != level
 
     def get_all_district_vars(self):
-        district_vars = DistrictIndicatorVariable.objects.filter(
-            regional_var__national_var__indicator_var=self
-        )
+        district_vars = DistrictIndicatorVariable.objects.filter(indicator_var=self)
         return district_vars
 
     def get_all_regional_vars(self):
-        reg_vars = RegionalIndicatorVariable.objects.filter(national_var__indicator_var=self)
+        reg_vars = RegionalIndicatorVariable.objects.filter(indicator_var=self)
         return reg_vars
     
     def get_regional_var(self, target=None):
@@ -236,7 +514,7 @@ class IndicatorVariable(models.Model):
         """
         if target.isinstance(Region):
             # Get all district vars in target region
-            return self.get_all_district_vars().filter(district__region=target)
+            return self.get_all_district_vars().filter(region=target)
 
         if target.isinstance(District):
             return self.get_all_district_vars().get(district=target)
@@ -244,10 +522,12 @@ class IndicatorVariable(models.Model):
         raise ValueError("Target must be a Region or District")
 
     def get_create_national_var(self):
-        NationalIndicatorVariable.objects.get_or_create(
+        national_var, _ = NationalIndicatorVariable.objects.get_or_create(
             indicator_var=self,
             defaults={'name': self.country.code + ' ' + self.name}
         )
+        self.national_var = national_var
+        return national_var
 
     def delete_national_var(self):
         self.national_var.delete()
@@ -259,13 +539,30 @@ class IndicatorVariable(models.Model):
         self.national_var.delete_regional_vars()
 
     def create_district_vars(self):
-        for var in self.national_var.regional_vars.all():
-            var.create_district_vars()
+        self.national_var.create_district_vars()
 
     def delete_district_vars(self):
-        for var in self.national_var.regional_vars.all():
-            var.delete_district_vars()
-            
+        self.national_var.delete_district_vars()
+
+    def rebuild_rollups(self):
+        """Recomputes every stored rollup of this variable, bottom up"""
+        from .rollups import rebuild_regional_rollups, rebuild_national_rollups
+
+        national_var = self.national_var
+        RegionalVarRollup.objects.filter(variable__national_var=national_var).delete()
+        NationalVarRollup.objects.filter(variable=national_var).delete()
+
+        if self.level == AggregationLevelChoice.DISTRICT:
+            rebuild_regional_rollups(DistrictVarValue.objects.filter(
+                variable__national_var=national_var
+            ).values_list('variable__regional_var', 'period').distinct())
+
+        if self.level != AggregationLevelChoice.NATIONAL:
+            periods = set(RegionalVarValue.objects.filter(
+                variable__national_var=national_var).values_list('period', flat=True))
+            periods |= set(RegionalVarRollup.objects.filter(
+                variable__national_var=national_var).values_list('period', flat=True))
+            rebuild_national_rollups((national_var.pk, period) for period in periods)
 
     def get(self, target=None, get_net_value=True, get_all_districts=False):
         """
@@ -303,7 +600,7 @@ class IndicatorVariable(models.Model):
         raise ValueError("Target must be a Region, Country, District or None")
         
     def __str__(self):
-        return self.country.code + " " + self.name + " | " + self.code
+        return country_code(self.country_id) + " " + self.name + " | " + self.code
 
 
 class NationalIndicatorVariable(models.Model):
@@ -322,22 +619,71 @@ class NationalIndicatorVariable(models.Model):
     @property
     def values(self):
         return self.value_models.all()
+
+    @property
+    def place(self):
+        return self.indicator_var.country
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:
+            # Keep the denormalized indicator var of the vars below in step
+            RegionalIndicatorVariable.objects.filter(national_var=self).exclude(
+                indicator_var=self.indicator_var_id).update(indicator_var=self.indicator_var_id)
+            DistrictIndicatorVariable.objects.filter(national_var=self).exclude(
+                indicator_var=self.indicator_var_id).update(indicator_var=self.indicator_var_id)
     
     def get_create_regional_vars(self):
-        for region in self.indicator_var.country.regions.all():
-            RegionalIndicatorVariable.objects.get_or_create(
+        """Creates the vars of the country's regions that have none yet, in one insert"""
+        missing_regions = Region.objects.filter(
+            country__variables=self.indicator_var_id
+        ).exclude(variables__national_var=self)
+        RegionalIndicatorVariable.objects.bulk_create([
+            RegionalIndicatorVariable(
                 national_var = self,
+                indicator_var_id=self.indicator_var_id,
                 region=region,
                 name = self.name + ' ' + region.code
             )
+            for region in missing_regions
+        ])
     
     def delete_regional_vars(self):
         RegionalIndicatorVariable.objects.filter(national_var=self).delete()
 
+    def create_district_vars(self):
+        """Creates the vars of every district in the country that has none yet"""
+        create_district_vars(self.regional_vars.all())
+
+    def delete_district_vars(self):
+        DistrictIndicatorVariable.objects.filter(national_var=self).delete()
+
     def get_value_at(self, date):
-        all_vars_at_date = self.value_models.filter(pariod__gte=date)
+        all_vars_at_date = self.value_models.filter(period__gte=date)
         least_var = all_vars_at_date.order_by('period').first()
-        return least_var.value
+        return least_var.value if least_var else None
+
+    def child_values_at(self, period):
+        """Returns the regional values this variable aggregates at period"""
+        if self.indicator_var.level == AggregationLevelChoice.DISTRICT:
+            # Regional values are themselves rollups of the districts
+            return list(RegionalVarRollup.objects.filter(
+                variable__national_var=self, period=period, value__isnull=False
+            ).values_list('value', flat=True))
+        return list(RegionalVarValue.objects.filter(
+            variable__national_var=self, period=period
+        ).values_list('inputted_value', flat=True))
+
+    def rollup_at(self, period):
+        """Recomputes and stores the aggregate of the regional values at period"""
+        return store_rollup(NationalVarRollup, self, period, self.child_values_at(period),
+                            self.indicator_var.compute_format)
+
+    def shift_rollup(self, period, added=None, removed=None):
+        """Applies a single regional value change to the national rollup at period"""
+        return shift_rollup(NationalVarRollup, self, period, self.indicator_var.compute_format,
+                            added=added, removed=removed)
 
     def create_value(self, period, inputted_value):
         return NationalVarValue.objects.create(
@@ -362,30 +708,63 @@ class RegionalIndicatorVariable(models.Model):
     national_var = models.ForeignKey(NationalIndicatorVariable,
                                     related_name='regional_vars',
                                     on_delete=models.CASCADE)
+    # The national var's indicator var, denormalized to skip a join
+    indicator_var = models.ForeignKey(IndicatorVariable,
+                                      related_name='regional_vars',
+                                      on_delete=models.CASCADE)
     # Linked to value_models by ForeignKey
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        self.indicator_var_id = self.national_var.indicator_var_id
+        super().save(*args, **kwargs)
+        if not adding:
+            # Keep the denormalized ancestors of the district vars in step
+            self.district_vars.exclude(
+                national_var=self.national_var_id, indicator_var=self.indicator_var_id,
+                region=self.region_id,
+            ).update(national_var=self.national_var_id, indicator_var=self.indicator_var_id,
+                     region=self.region_id)
     
     @property
     def values(self):
         return self.value_models.all()
 
+    @property
+    def place(self):
+        return self.region
+
     def get_value_at(self, date):
-        all_vars_at_date = self.value_models.filter(pariod__gte=date)
+        all_vars_at_date = self.value_models.filter(period__gte=date)
         least_var = all_vars_at_date.order_by('period').first()
-        return least_var.value
+        return least_var.value if least_var else None
+
+    def child_values_at(self, period):
+        """Returns the district values this variable aggregates at period"""
+        return list(DistrictVarValue.objects.filter(
+            variable__regional_var=self, period=period
+        ).values_list('inputted_value', flat=True))
+
+    def rollup_at(self, period):
+        """Recomputes and stores the aggregate of the district values at period"""
+        return store_rollup(RegionalVarRollup, self, period, self.child_values_at(period),
+                            self.indicator_var.compute_format)
+
+    def shift_rollup(self, period, added=None, removed=None):
+        """
+        Applies a single district value change to the regional rollup at period,
+        then carries the resulting change up to the national rollup
+        """
+        before, after = shift_rollup(RegionalVarRollup, self, period,
+                                     self.indicator_var.compute_format,
+                                     added=added, removed=removed)
+        if before != after:
+            self.national_var.shift_rollup(period, added=after, removed=before)
+        return before, after
 
     def create_district_vars(self):
-        districts = District.objects.filter(
-            region__country=self.national_var.indicator_var.country
-        )
-        for district in districts:
-            regional_var = RegionalIndicatorVariable.objects.get(
-                Q(region=district.region) & Q(national_var=self.national_var)
-            )
-            DistrictIndicatorVariable.objects.get_or_create(
-                regional_var = regional_var,
-                district = district,
-                name = self.name + '_' + self.name,
-            )
+        """Creates the vars of the region's districts that have none yet"""
+        create_district_vars([self])
     
     def delete_district_vars(self):
         DistrictIndicatorVariable.objects.filter(regional_var=self).delete()
@@ -401,6 +780,14 @@ class RegionalIndicatorVariable(models.Model):
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # Keyset pages of the variable list, and case insensitive prefix search
+            models.Index(fields=['name', 'id'], name='regional_var_name_page'),
+            models.Index(OpClass(Upper('name'), name='text_pattern_ops'),
+                         name='regional_var_name_prefix'),
+        ]
+
 
 class DistrictIndicatorVariable(models.Model):
     """District level indicator variable"""
@@ -409,14 +796,35 @@ class DistrictIndicatorVariable(models.Model):
     regional_var = models.ForeignKey(RegionalIndicatorVariable,
                                      related_name='district_vars',
                                      on_delete=models.CASCADE)
+    district = models.ForeignKey(District, related_name='variables',
+                                 on_delete=models.CASCADE, null=True)
+    # Ancestors of the regional var, denormalized so every district var under a
+    # variable, national var or region is a single indexed lookup
+    national_var = models.ForeignKey(NationalIndicatorVariable,
+                                     related_name='district_vars',
+                                     on_delete=models.CASCADE)
+    indicator_var = models.ForeignKey(IndicatorVariable,
+                                      related_name='district_vars',
+                                      on_delete=models.CASCADE)
+    region = models.ForeignKey(Region, related_name='district_vars', on_delete=models.CASCADE)
+
+    def save(self, *args, **kwargs):
+        self.national_var_id = self.regional_var.national_var_id
+        self.indicator_var_id = self.regional_var.indicator_var_id
+        self.region_id = self.regional_var.region_id
+        super().save(*args, **kwargs)
+
+    @property
+    def place(self):
+        return self.district
 
     def get_value_at(self, date):
-        all_vars_at_date = self.value_models.filter(pariod__gte=date)
+        all_vars_at_date = self.value_models.filter(period__gte=date)
         least_var = all_vars_at_date.order_by('period').first()
-        return least_var.value
+        return least_var.value if least_var else None
 
     def create_value(self, period, inputted_value):
-        return RegionalVarValue.objects.create(
+        return DistrictVarValue.objects.create(
             variable = self,
             period = period,
             inputted_value = inputted_value
@@ -426,22 +834,32 @@ class DistrictIndicatorVariable(models.Model):
     def values(self):
         return self.value_models.all()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='district_var_name_page'),
+            models.Index(OpClass(Upper('name'), name='text_pattern_ops'),
+                         name='district_var_name_prefix'),
+        ]
+
 
 class IndicatorValue(models.Model):
-    """The actual value of an indicator at a particular period"""
+    """
+    The computed value of an indicator at a place and period, stored by the
+    recompute jobs (see recompute.py). The place is the country, region or
+    district pk, according to the indicator's level.
+    """
     period = models.DateField()
     indicator = models.ForeignKey('Indicator', related_name='values', on_delete=models.CASCADE)
+    place = models.BigIntegerField()
     value = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
 
-    # @staticmethod
-    # def create(indicator):
-    #     """Creates a new indicator value for the current period"""
-    #     IndicatorValue.objects.create(
-    #         indicator=indicator
-    #     )
-
     class Meta:
         ordering = ['period']
+        constraints = [
+            # Also the index history reads range scan
+            models.UniqueConstraint(fields=['indicator', 'period', 'place'],
+                                    name='unique_indicator_place_period'),
+        ]
 
 class Indicator(models.Model):
     """The base Item in this project is the indicator"""
@@ -463,94 +881,179 @@ class Indicator(models.Model):
                                          help_text="Not useful if only one variable is selected.\
                                             Leave blank to use addtion of all varibles.")
 
+    @cached_property
+    def formula(self):
+        """The compiled computing formula, dropped on save so edits are picked up"""
+        source = self.computing_formula
+        if not source:
+            source = default_formula(self.variables.values_list('code', flat=True))
+        return compile_formula(source)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.__dict__.pop('formula', None)
+
     def value_at(self, date):
         """
         Returns the value of this indicator at the given date
         If indicator is not national, returns the value at each division for this date
         """
-        vars_dict = self.get_vars_dict()
-        computed_vals = []
+        from .asof import values_at
 
-        sorted_vars_dict = {} # place and it's variables
-        for k, v in vars_dict.items():
-            if v not in sorted_vars_dict:
-                sorted_vars_dict[v] = {k: v}
-            else:
-                sorted_vars_dict[v][k] = v
-        
-        for place, places_vars in sorted_vars_dict:
-            value = eval(self.computing_formula.replace('^', '**'),
-                            {code: var.get_value_at(date) for code, var in places_vars})
-            computed_vals.append({place: value})
+        level = self.level or AggregationLevelChoice.NATIONAL
+        variables = {v.code: v for v in self.variables.all()}
+        values_per_code = {}
+        for code, place_vars in self.get_vars_dict().items():
+            # All places of a variable in one as-of lookup
+            found = values_at(place_vars, [date], computed=variables[code].is_computed_at(level))
+            values_per_code[code] = {var.place: found[var.pk][0] for var in place_vars}
 
-        return computed_vals
-        
+        places = sorted({place for values in values_per_code.values() for place in values},
+                        key=str)
 
-    def get_vars_dict(self):
-        """Returns a dict of indicator variables and their codes according to self.level"""
-        if self.level == AggregationLevelChoice.NATIONAL:
-            vars_dict = {
-                v.code: v.get(target=self.country, get_net_value=True)
-                for v in self.variables
-            }
-        
-        if self.level == AggregationLevelChoice.REGIONAL:
-            vars_dict = {
-                v.code: v.get(target=self.country, get_net_value=False)
-                for v in self.variables
-            }
+        # One evaluation over the vector of places instead of one per place
+        arrays = {
+            code: np.array([values.get(place, np.nan) for place in places])
+            for code, values in values_per_code.items()
+        }
+        computed_vals = np.broadcast_to(self.formula(arrays), (len(places),))
 
-        if self.level == AggregationLevelChoice.DISTRICT:
-            vars_dict = {
-                v.code: v.get(all_district_vars=True)
-                for v in self.variables
-            }
+        return {place: value for place, value in zip(places, computed_vals)}
+
+    def get_vars_dict(self):
+        """
+        Returns a dict of indicator variable codes and their variables according to
+        self.level, one variable per place
+        """
+        vars_dict = {}
+        for v in self.variables.all():
+            if self.level == AggregationLevelChoice.REGIONAL:
+                vars_dict[v.code] = list(v.get_all_regional_vars().select_related('region'))
+            elif self.level == AggregationLevelChoice.DISTRICT:
+                vars_dict[v.code] = list(v.get_all_district_vars().select_related('district'))
+            else:
+                vars_dict[v.code] = [v.national_var]
 
         return vars_dict
 
     @property
     def all_vars_values(self):
         all_values = []
-        for var in self.get_vars_dict.values():
-            for value in var.value_models.all():
-                all_values.append(value)
+        for variables in self.get_vars_dict().values():
+            for var in variables:
+                all_values.extend(var.value_models.all())
         return all_values
 
-    def get_min_date(self):
-        min_date_per_value = []
-        for var in self.all_vars_values:
-            min_date_per_value.append((var.value_models.all().aggregate(Min('period')))['period__min'])
+    def get_date_range(self):
+        """The first and last period of the values of this indicator's variables"""
+        from .series import period_range
 
-        return min(min_date_per_value)
+        return period_range(self)
+
+    def get_min_date(self):
+        return self.get_date_range()[0]
 
     def get_max_date(self):
-        max_date_per_value = []
-        for var in self.all_vars_values:
-            max_date_per_value.append((var.value_models.all().aggregate(Max('period')))['period__max'])
-        
-        return max(max_date_per_value)
+        return self.get_date_range()[1]
 
     def divide_dates(self):
-        freg_string = self.get_measurement_freq_label.split('[')[1][:-1]
-        record_per_yr = eval(freg_string)
-
-        intervals = list(
-            rrule(YEARLY, 
-                  interval=record_per_yr,
-                  dtstart=self.get_min_date(),
-                  until=self.get_max_date()
-                  )
-        )
-        return intervals
+        """
+        The start of every measurement_freq bucket from the first to the last
+        period of the indicator's values, the dates its series is read at
+        """
+        from .periods import bucket_of
+
+        start, end = self.get_date_range()
+        if start is None:
+            return []
+        return bucket_of(self.measurement_freq).range(start, end)
 
-    def data(self):
-        """Returns indicator values in pd dataframe format"""
-        import pandas as pd
+    def data(self, dates=None):
+        """
+        Returns indicator values in pd dataframe format, a row per place and a
+        column per date. All places and dates are evaluated in one batch, or
+        served from the series cache when they were evaluated before.
+        At the default dates, a current on disk snapshot is viewed instead.
+        """
+        from .series_cache import cached_indicator_frame
+        from .snapshots import snapshot_frame
 
-        dates = self.divide_dates()
-        values = {date: self.value_at(date) for date in dates}
+        if dates is None:
+            frame = snapshot_frame(self)
+            if frame is not None:
+                return frame
+            dates = self.divide_dates()
+        return cached_indicator_frame(self, dates)
 
-        return pd.DataFrame(values)
+    def history(self, start=None, end=None, places=None):
+        """
+        Returns the stored values of this indicator between start and end as a
+        pd dataframe, a row per place and a column per period, like data().
+        Read in one range scan instead of evaluating the formula.
+        """
+        from .recompute import stored_frame
+
+        return stored_frame(self, start, end, places)
     
     def __str__(self):
-        return self.name + ' ' + self.country.code 
+        return self.name + ' ' + country_code(self.country_id)
+
+
+class Job(models.Model):
+    """
+    A unit of heavy work queued for the run_jobs worker, see jobs.py.
+    Jobs of the same kind, target and period range are only queued once.
+    """
+    kind = models.CharField(max_length=10, choices=JobKindChoice.choices)
+    status = models.CharField(max_length=10, choices=JobStatusChoice.choices,
+                              default=JobStatusChoice.QUEUED)
+    indicator = models.ForeignKey(Indicator, related_name='jobs', on_delete=models.CASCADE,
+                                  null=True, blank=True)
+    variable = models.ForeignKey(IndicatorVariable, related_name='jobs', on_delete=models.CASCADE,
+                                 null=True, blank=True)
+    period_start = models.DateField(null=True, blank=True)
+    period_end = models.DateField(null=True, blank=True)
+    params = models.JSONField(default=dict, blank=True)
+    # kind, target and period range in one column, as unique constraints treat nulls as distinct
+    dedupe_key = models.CharField(max_length=200, editable=False)
+
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    result = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Renewed by the worker running the job, see jobs.requeue_stale_jobs
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def make_dedupe_key(kind, indicator_id=None, variable_id=None,
+                        period_start=None, period_end=None, params=None):
+        params = ','.join(f'{key}={value}' for key, value in sorted((params or {}).items()))
+        return f'{kind}:{indicator_id}:{variable_id}:{period_start}:{period_end}:{params}'
+
+    def save(self, *args, **kwargs):
+        self.dedupe_key = self.make_dedupe_key(self.kind, self.indicator_id, self.variable_id,
+                                               self.period_start, self.period_end, self.params)
+        super().save(*args, **kwargs)
+
+    @property
+    def progress(self):
+        """The share of the job done, between 0 and 1"""
+        if self.status == JobStatusChoice.DONE:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.pk} ({self.get_status_display()})'
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['dedupe_key'],
+                                    condition=Q(status=JobStatusChoice.QUEUED),
+                                    name='unique_queued_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_queue'),
+        ]
@@ -0,0 +1,216 @@
+"""
+Yearly range partitioning of the value tables by period, on Postgres.
+
+Each value table is a partitioned parent with one partition per calendar year,
+named <table>_y<year>, over a contiguous run of years. Two open ended
+partitions, <table>_before and <table>_after, catch the periods before and
+after that run. Unlike a default partition they keep the partitions ordered,
+so Postgres scans them in period order: range queries are pruned to the years
+they touch, and the as-of lookups of get_value_at (the first period on or
+after a date) stop at the first partition holding a value. Old years are
+retired by detaching, and dropping, their partition.
+
+The partitions are managed with the partition_values command. Postgres requires
+the partition key in every unique constraint, so the primary keys of the
+partitioned tables are (id, period). Django still treats id alone as the key;
+ids come from a single identity sequence and stay unique.
+
+This module only deals with table names, so migrations can use it too.
+"""
+from datetime import date
+
+
+BEFORE, AFTER = 'before', 'after'
+
+
+def value_tables():
+    """The tables of the partitioned value models"""
+    from .models import NationalVarValue, RegionalVarValue, DistrictVarValue
+
+    return [model._meta.db_table for model in (NationalVarValue, RegionalVarValue, DistrictVarValue)]
+
+
+def quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def partition_name(table, year):
+    return f'{table}_y{year}'
+
+
+def edge_name(table, edge):
+    return f'{table}_{edge}'
+
+
+def year_start(year):
+    return date(year, 1, 1)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [quote(table)])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partition_years(cursor, table):
+    """The years of the yearly partitions attached to table, sorted"""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits"
+        " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+        " WHERE pg_inherits.inhparent = to_regclass(%s)", [quote(table)]
+    )
+    prefix = partition_name(table, '')
+    return sorted(int(name[len(prefix):]) for name, in cursor.fetchall()
+                  if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def data_years(cursor, table):
+    """The first and last year of the periods in table, (None, None) if it is empty"""
+    cursor.execute(
+        f"SELECT EXTRACT(YEAR FROM MIN(period))::int, EXTRACT(YEAR FROM MAX(period))::int"
+        f" FROM {quote(table)}"
+    )
+    return cursor.fetchone()
+
+
+def create_year(cursor, table, year):
+    cursor.execute(
+        f"CREATE TABLE {quote(partition_name(table, year))} PARTITION OF {quote(table)}"
+        f" FOR VALUES FROM (%s) TO (%s)", [year_start(year), year_start(year + 1)]
+    )
+
+
+def attach_edge(cursor, table, edge, year, create=False):
+    """Attaches, or creates, the edge partition of table, before or from the start of year"""
+    bounds = "FROM (MINVALUE) TO (%s)" if edge == BEFORE else "FROM (%s) TO (MAXVALUE)"
+    name = quote(edge_name(table, edge))
+    if create:
+        statement = f"CREATE TABLE {name} PARTITION OF {quote(table)} FOR VALUES {bounds}"
+    else:
+        statement = f"ALTER TABLE {quote(table)} ATTACH PARTITION {name} FOR VALUES {bounds}"
+    cursor.execute(statement, [year_start(year)])
+
+
+def detach_edge(cursor, table, edge):
+    # An attached partition's bounds are fixed, so the edge partition is
+    # detached and attached again to move them
+    cursor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(edge_name(table, edge))}")
+
+
+def add_years(cursor, table, edge, years):
+    """
+    Creates the partitions of a run of years next to the edge partition, out of
+    its range. The rows of those years it held are moved into them.
+    """
+    if not years:
+        return
+    first, last = min(years), max(years)
+    for year in years:
+        cursor.execute("SELECT to_regclass(%s)", [quote(partition_name(table, year))])
+        if cursor.fetchone()[0] is not None:
+            raise ValueError(f"The detached partition of {year} is still there, drop it first")
+    detach_edge(cursor, table, edge)
+    for year in years:
+        create_year(cursor, table, year)
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {quote(edge_name(table, edge))}"
+        f" WHERE period >= %s AND period < %s RETURNING *)"
+        f" INSERT INTO {quote(table)} OVERRIDING SYSTEM VALUE SELECT * FROM moved",
+        [year_start(first), year_start(last + 1)]
+    )
+    attach_edge(cursor, table, edge, first if edge == BEFORE else last + 1)
+
+
+def extend_partitions(cursor, table, first, last):
+    """
+    Creates the missing yearly partitions so they cover first to last, keeping
+    them contiguous. Returns the years created.
+    """
+    years = partition_years(cursor, table)
+    earlier = list(range(first, years[0]))
+    later = list(range(years[-1] + 1, last + 1))
+    add_years(cursor, table, BEFORE, earlier)
+    add_years(cursor, table, AFTER, later)
+    return earlier + later
+
+
+def detach_partitions(cursor, table, before, drop=False):
+    """
+    Detaches, or drops if drop, the yearly partitions of the years before
+    before, their rows with them. The last yearly partition is always kept.
+    Periods of those years written afterwards land in the before partition.
+    Returns the years detached.
+    """
+    years = partition_years(cursor, table)
+    retired = [year for year in years[:-1] if year < before]
+    if not retired:
+        return []
+    detach_edge(cursor, table, BEFORE)
+    for year in retired:
+        name = quote(partition_name(table, year))
+        cursor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {name}")
+        if drop:
+            cursor.execute(f"DROP TABLE {name}")
+    attach_edge(cursor, table, BEFORE, years[len(retired)])
+    return retired
+
+
+def table_definition(cursor, table):
+    """
+    The constraints and the indexes not backing a constraint of table, as
+    (name, type, definition) and (name, CREATE INDEX statement)
+    """
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint"
+        " WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f', 'c')", [quote(table)]
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table]
+    )
+    names = {name for name, _, _ in constraints}
+    # Indexes of partitioned tables read ON ONLY, which would leave the partitions out
+    indexes = [(name, definition.replace(' ON ONLY ', ' ON ', 1))
+               for name, definition in cursor.fetchall() if name not in names]
+    return constraints, indexes
+
+
+def rebuild_table(cursor, table, first=None, last=None):
+    """
+    Recreates table as a table partitioned by year with partitions for first to
+    last, or as a plain table if they are None, keeping its rows, constraints
+    and indexes
+    """
+    cursor.execute(
+        "SELECT COUNT(*) FROM pg_constraint WHERE confrelid = to_regclass(%s)", [quote(table)]
+    )
+    if cursor.fetchone()[0]:
+        raise ValueError(f"{table} is referenced by foreign keys and can not be rebuilt")
+
+    partitioned = first is not None
+    constraints, indexes = table_definition(cursor, table)
+    old = quote(f'{table}_old')
+    cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {old}")
+    cursor.execute(
+        f"CREATE TABLE {quote(table)} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY)"
+        + (" PARTITION BY RANGE (period)" if partitioned else "")
+    )
+    if partitioned:
+        attach_edge(cursor, table, BEFORE, first, create=True)
+        for year in range(first, last + 1):
+            create_year(cursor, table, year)
+        attach_edge(cursor, table, AFTER, last + 1, create=True)
+
+    cursor.execute(f"INSERT INTO {quote(table)} OVERRIDING SYSTEM VALUE SELECT * FROM {old}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false)"
+        f" FROM {quote(table)}", [quote(table)]
+    )
+    cursor.execute(f"DROP TABLE {old}")
+
+    for name, kind, definition in constraints:
+        if kind == 'p':
+            definition = "PRIMARY KEY (id, period)" if partitioned else "PRIMARY KEY (id)"
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+    for _, definition in indexes:
+        cursor.execute(definition)
@@ -0,0 +1,65 @@
+"""
+Calendar buckets of the indicator measurement frequencies.
+
+Every frequency is a whole number of months, weeks or days, so bucket starts
+are computed on numpy date arrays by flooring the months, weeks or days since
+the epoch to a multiple of the step. Months since 1970 make biennial buckets
+start on even years, and weeks start on Mondays, like Postgres date_trunc.
+"""
+import numpy as np
+
+from .models import MeasurementFreqChoice
+
+
+# 1970-01-01, day 0, is a Thursday
+EPOCH_WEEKDAY = 3
+
+
+class Bucket:
+    """A calendar bucket of step months, weeks or days"""
+    __slots__ = ('unit', 'step')
+
+    def __init__(self, unit, step):
+        self.unit = unit
+        self.step = step
+
+    def ordinals(self, days):
+        """The bucket number of days since the epoch, in units since the epoch"""
+        if self.unit == 'month':
+            months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+            return months - months % self.step
+        if self.unit == 'week':
+            days = days.astype('datetime64[D]').astype(np.int64)
+            return (days + EPOCH_WEEKDAY) // 7
+        return days.astype('datetime64[D]').astype(np.int64)
+
+    def from_ordinals(self, ordinals):
+        """The start dates of bucket ordinals, as datetime64[D]"""
+        if self.unit == 'month':
+            return ordinals.astype('datetime64[M]').astype('datetime64[D]')
+        if self.unit == 'week':
+            return (ordinals * 7 - EPOCH_WEEKDAY).astype('datetime64[D]')
+        return ordinals.astype('datetime64[D]')
+
+    def range(self, start, end):
+        """The starts of the buckets from the one of start to the one of end, as dates"""
+        first, last = self.ordinals(np.array([start, end], dtype='datetime64[D]'))
+        step = self.step if self.unit == 'month' else 1
+        return self.from_ordinals(np.arange(first, last + 1, step)).astype(object).tolist()
+
+
+BUCKETS = {
+    MeasurementFreqChoice.BIENNIAL: Bucket('month', 24),
+    MeasurementFreqChoice.YEARLY: Bucket('month', 12),
+    MeasurementFreqChoice.BIANNUALLY: Bucket('month', 6),
+    MeasurementFreqChoice.QUARTERLY: Bucket('month', 3),
+    MeasurementFreqChoice.MONTHLY: Bucket('month', 1),
+    MeasurementFreqChoice.WEEKLY: Bucket('week', 1),
+    MeasurementFreqChoice.DAILY: Bucket('day', 1),
+}
+
+
+def bucket_of(measurement_freq):
+    """The bucket of a measurement frequency, yearly if it has none"""
+    return BUCKETS.get(measurement_freq, BUCKETS[MeasurementFreqChoice.YEARLY])
+
@@ -0,0 +1,86 @@
+"""
+Stored indicator values.
+
+An indicator is evaluated in one batch (see series.py) at the start of every
+measurement_freq bucket in a period range, for every place at its level, and
+the results replace the stored IndicatorValue rows of that range in one
+transaction. Jobs queued whenever variable values change keep them current
+(see jobs.py), so history is read back without evaluating the formula.
+"""
+import math
+from decimal import Decimal
+
+import pandas as pd
+from django.db import transaction
+
+from .models import IndicatorValue
+from .periods import bucket_of
+from .series import indicator_frame, level_storage
+
+
+def indicator_dates(indicator, start=None, end=None):
+    """The bucket starts between start and end, within the indicator's value range"""
+    first, last = indicator.get_date_range()
+    if first is None:
+        return []
+    start, end = max(start or first, first), min(end or last, last)
+    if start > end:
+        return []
+    return bucket_of(indicator.measurement_freq).range(start, end)
+
+
+def as_stored(value):
+    """A float series value as IndicatorValue keeps it"""
+    if value is None or math.isnan(value):
+        return None
+    field = IndicatorValue._meta.get_field('value')
+    return Decimal(repr(value)).quantize(Decimal(1).scaleb(-field.decimal_places))
+
+
+def store_indicator_values(indicator, start=None, end=None):
+    """
+    Evaluates the indicator at every bucket between start and end and stores the
+    values, replacing every stored value of that range. Without bounds, every
+    stored value is replaced, so values left over from an earlier level or
+    value range go. Returns the number of values stored.
+    """
+    dates = indicator_dates(indicator, start, end)
+    frame = indicator_frame(indicator, dates)
+    values = [
+        IndicatorValue(indicator=indicator, place=place, period=period, value=as_stored(value))
+        for place, row in zip(frame.index.tolist(), frame.to_numpy().tolist())
+        for period, value in zip(dates, row)
+    ]
+
+    stale = IndicatorValue.objects.filter(indicator=indicator)
+    if start is not None:
+        stale = stale.filter(period__gte=bucket_of(indicator.measurement_freq).range(start, start)[0])
+    if end is not None:
+        stale = stale.filter(period__lte=end)
+    with transaction.atomic():
+        stale.delete()
+        IndicatorValue.objects.bulk_create(values, batch_size=5000)
+    return len(values)
+
+
+def stored_frame(indicator, start=None, end=None, places=None):
+    """
+    The stored values of an indicator between start and end, a row per place
+    and a column per period, NaN where a value is missing
+    """
+    queryset = IndicatorValue.objects.filter(indicator=indicator)
+    if start is not None:
+        queryset = queryset.filter(period__gte=start)
+    if end is not None:
+        queryset = queryset.filter(period__lte=end)
+    if places is not None:
+        queryset = queryset.filter(place__in=places)
+
+    rows = pd.DataFrame.from_records(
+        queryset.order_by().values_list('place', 'period', 'value').iterator(chunk_size=10000),
+        columns=['place', 'period', 'value'],
+    )
+    frame = rows.pivot(index='place', columns='period', values='value').astype(float)
+    frame.index.name = level_storage(indicator).place_name
+    frame.columns.name = None
+    return frame.sort_index().sort_index(axis=1)
@@ -0,0 +1,170 @@
+"""
+Process wide registry of the geography hierarchy.
+
+Countries, regions and districts change rarely, so each process loads them
+once into compact arrays: sorted ids, the index of every row's parent in the
+parent table, and code -> id dicts. Hierarchy lookups (a region's country, the
+places of a country at a level, a place's name) then cost no query.
+
+The registry is reloaded when the hierarchy version, kept in the default cache,
+is bumped by the post_save / post_delete signals of the hierarchy models, when
+a lookup misses a row another process added, and at the latest after MAX_AGE.
+Bulk writes to those models send no signals and must call bump_hierarchy_version.
+Bumps only reach other processes when the default cache is a shared backend,
+see CACHES in the settings.
+"""
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import AggregationLevelChoice, Country, Region, District
+
+
+VERSION_KEY = 'hierarchy-version'
+
+# Seconds after which the registry is reloaded even without a version bump,
+# as bumps from other processes are only seen through a shared cache
+MAX_AGE = 300
+
+
+def columns(queryset, *fields):
+    """The fields of the queryset's rows in pk order, a list per field"""
+    rows = list(queryset.order_by('pk').values_list('pk', *fields))
+    return [list(column) for column in zip(*rows)] if rows else [[] for _ in range(len(fields) + 1)]
+
+
+class Table:
+    """The rows of one model as arrays, in id order"""
+    __slots__ = ('ids', 'parents', 'codes', 'names', 'by_code')
+
+    def __init__(self, ids, parent_ids=None, parent=None, codes=None, names=None):
+        """
+        Input:
+            ids -> sorted row ids
+            parent_ids -> the id of every row's parent in the parent table
+            codes -> unique codes, looked up with by_code
+        """
+        self.ids = np.array(ids, dtype=np.int64)
+        self.parents = parent.indices(parent_ids) if parent is not None else None
+        self.codes = codes
+        self.names = names
+        self.by_code = dict(zip(codes, ids)) if codes is not None else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indices(self, pks):
+        """The row index of every pk, -1 where there is none, vectorized"""
+        pks = np.asarray(pks, dtype=np.int64)
+        if not len(self.ids):
+            return np.full(pks.shape, -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.ids, pks), len(self.ids) - 1)
+        return np.where(self.ids[found] == pks, found, -1)
+
+    def index(self, pk):
+        """The row index of pk, KeyError if it is not there"""
+        index = int(self.indices([pk])[0])
+        if index < 0:
+            raise KeyError(pk)
+        return index
+
+    def code(self, pk):
+        return self.codes[self.index(pk)]
+
+    def name(self, pk):
+        return self.names[self.index(pk)]
+
+    def children(self, parent_index):
+        """The ids of the rows whose parent is at parent_index"""
+        return self.ids[self.parents == parent_index]
+
+
+class Registry:
+    """The hierarchy at one version"""
+    __slots__ = ('version', 'loaded_at', 'countries', 'regions', 'districts', 'district_countries')
+
+    def __init__(self, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+        ids, codes, names = columns(Country.objects, 'code', 'name')
+        self.countries = Table(ids, codes=codes, names=names)
+        ids, countries, codes, names = columns(Region.objects, 'country', 'code', 'name')
+        self.regions = Table(ids, countries, self.countries, codes, names)
+        ids, regions, codes, names = columns(District.objects, 'region', 'code', 'name')
+        self.districts = Table(ids, regions, self.regions, codes, names)
+        known = self.districts.parents >= 0
+        self.district_countries = np.full(len(self.districts), -1, dtype=np.int64)
+        self.district_countries[known] = self.regions.parents[self.districts.parents[known]]
+
+    def country_code(self, country_pk):
+        return self.countries.code(country_pk)
+
+    def place_table(self, level):
+        return {
+            AggregationLevelChoice.NATIONAL: self.countries,
+            AggregationLevelChoice.REGIONAL: self.regions,
+            AggregationLevelChoice.DISTRICT: self.districts,
+        }[level or AggregationLevelChoice.NATIONAL]
+
+    def place_ids(self, level, country_pk):
+        """The ids of a country's places at level, sorted"""
+        country = self.countries.index(country_pk)
+        level = level or AggregationLevelChoice.NATIONAL
+        if level == AggregationLevelChoice.NATIONAL:
+            return self.countries.ids[country:country + 1]
+        if level == AggregationLevelChoice.REGIONAL:
+            return self.regions.children(country)
+        return self.districts.ids[self.district_countries == country]
+
+    def place_names(self, level, place_pks):
+        """Place id -> name for the places of place_pks found at level"""
+        table = self.place_table(level)
+        return {int(pk): table.names[index]
+                for pk, index in zip(place_pks, table.indices(place_pks)) if index >= 0}
+
+
+def hierarchy_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_hierarchy_version():
+    """Makes every process reload its registry, now and once the transaction commits"""
+    def bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            hierarchy_version()
+
+    bump()
+    transaction.on_commit(bump)
+
+
+current = None
+
+
+def registry(reload=False):
+    """The registry of the current hierarchy version, loaded on first use"""
+    global current
+    version = hierarchy_version()
+    if (reload or current is None or current.version != version
+            or time.monotonic() - current.loaded_at > MAX_AGE):
+        current = Registry(version)
+    return current
+
+
+def lookup(get):
+    """
+    get(registry), reloaded once if the registry misses a row, as rows added by
+    other processes are not in it until a bump reaches this one
+    """
+    try:
+        return get(registry())
+    except KeyError:
+        return get(registry(reload=True))
@@ -0,0 +1,139 @@
+"""
+Set based recomputation of stored rollups.
+
+Used after bulk writes that skip the per value signals, such as imports and
+rebuilds: the children of every affected (variable, period) are read in one
+query per level and the rollups are upserted in one statement.
+"""
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import AggregationLevelChoice, Indicator
+from .models import RegionalVarValue, DistrictVarValue
+from .models import NationalVarRollup, RegionalVarRollup
+from .models import NationalIndicatorVariable, RegionalIndicatorVariable, as_decimal
+from .series_cache import bump_series_version, bump_variable_series
+
+
+ROLLUP_FIELDS = ['value', 'total', 'count', 'sorted_values']
+
+
+def group_values(rows, pairs):
+    """Groups (variable, period, value) rows by their pair, keeping wanted pairs only"""
+    grouped = defaultdict(list)
+    for variable_pk, period, value in rows:
+        if (variable_pk, period) in pairs and value is not None:
+            grouped[variable_pk, period].append(as_decimal(value))
+    return grouped
+
+
+def write_rollups(rollup_model, pairs, grouped, compute_formats):
+    """
+    Upserts the rollups of pairs that have values and removes the others.
+    Returns the number of rollups written.
+    """
+    rollups = []
+    for (variable_pk, period), values in grouped.items():
+        rollup = rollup_model(variable_id=variable_pk, period=period)
+        rollup.set_values(values, compute_formats[variable_pk])
+        rollups.append(rollup)
+
+    empty = [Q(variable_id=variable_pk, period=period)
+             for variable_pk, period in pairs if (variable_pk, period) not in grouped]
+    with transaction.atomic():
+        if empty:
+            rollup_model.objects.filter(reduce(or_, empty)).delete()
+        rollup_model.objects.bulk_create(
+            rollups, batch_size=5000, update_conflicts=True,
+            unique_fields=['variable', 'period'], update_fields=ROLLUP_FIELDS,
+        )
+    return len(rollups)
+
+
+def rebuild_regional_rollups(pairs, written=None):
+    """
+    Recomputes the regional rollups of (regional var pk, period) pairs from their
+    district values. Returns the (national var pk, period) pairs they feed into.
+    Input:
+        written -> optional list the number of rollups written is appended to
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return set()
+    variable_pks = {variable_pk for variable_pk, _ in pairs}
+    periods = {period for _, period in pairs}
+
+    rows = DistrictVarValue.objects.filter(
+        variable__regional_var__in=variable_pks, period__in=periods
+    ).order_by().values_list('variable__regional_var', 'period', 'inputted_value')
+    regional_vars = RegionalIndicatorVariable.objects.filter(pk__in=variable_pks).values_list(
+        'pk', 'national_var', 'indicator_var__compute_format'
+    )
+    national_vars = {pk: national_var for pk, national_var, _ in regional_vars}
+    compute_formats = {pk: compute_format for pk, _, compute_format in regional_vars}
+
+    count = write_rollups(RegionalVarRollup, pairs, group_values(rows, pairs), compute_formats)
+    if written is not None:
+        written.append(count)
+    return {(national_vars[variable_pk], period) for variable_pk, period in pairs}
+
+
+def rebuild_national_rollups(pairs):
+    """
+    Recomputes the national rollups of (national var pk, period) pairs from the
+    regional rollups, or the regional values of regional level variables.
+    Returns the number of rollups written.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    variable_pks = {variable_pk for variable_pk, _ in pairs}
+    periods = {period for _, period in pairs}
+
+    rows = list(RegionalVarRollup.objects.filter(
+        variable__national_var__in=variable_pks, period__in=periods,
+        variable__indicator_var__level=AggregationLevelChoice.DISTRICT,
+    ).order_by().values_list('variable__national_var', 'period', 'value'))
+    rows += RegionalVarValue.objects.filter(
+        variable__national_var__in=variable_pks, period__in=periods,
+        variable__indicator_var__level=AggregationLevelChoice.REGIONAL,
+    ).order_by().values_list('variable__national_var', 'period', 'inputted_value')
+
+    compute_formats = dict(NationalIndicatorVariable.objects.filter(pk__in=variable_pks)
+                           .values_list('pk', 'indicator_var__compute_format'))
+    return write_rollups(NationalVarRollup, pairs, group_values(rows, pairs), compute_formats)
+
+
+def rebuild_rollups(regional_pairs):
+    """
+    Recomputes the regional rollups of the pairs, then the national ones above
+    them. The bulk writes that call this skip the value signals, so cached
+    series are made stale here.
+    """
+    regional_pairs = set(regional_pairs)
+    rebuild_national_rollups(rebuild_regional_rollups(regional_pairs))
+    bump_variable_series(RegionalIndicatorVariable.objects.filter(
+        pk__in={variable_pk for variable_pk, _ in regional_pairs}
+    ).values_list('indicator_var', flat=True))
+
+
+def rebuild_country_rollups(country_pk):
+    """
+    Recomputes every rollup of a country's variables from their values, removing
+    the rollups left without any. Returns the number of rollups written.
+    """
+    def pairs(model, variable):
+        return set(model.objects.filter(**{variable + '__indicator_var__country': country_pk})
+                   .order_by().values_list(variable, 'period').distinct())
+
+    written = []
+    regional_pairs = pairs(DistrictVarValue, 'variable__regional_var') | pairs(RegionalVarRollup, 'variable')
+    national_pairs = rebuild_regional_rollups(regional_pairs, written)
+    national_pairs |= pairs(RegionalVarValue, 'variable__national_var') | pairs(NationalVarRollup, 'variable')
+    written.append(rebuild_national_rollups(national_pairs))
+    bump_series_version(Indicator.objects.filter(country=country_pk).values_list('pk', flat=True))
+    return sum(written)
@@ -0,0 +1,54 @@
+"""
+Server side search of the variable list.
+
+Variables are matched on a case insensitive prefix of their name, which the
+Upper(name) pattern index serves, or exactly on their indicator variable code. Pages
+are ordered by (name, pk) and continue after the last row of the previous page
+(keyset pagination), so every page costs the same however deep it is.
+"""
+import base64
+import json
+
+from django.db.models import Q
+
+
+PAGE_SIZE = 50
+
+
+class CursorError(ValueError):
+    """Raised when a page cursor can not be decoded"""
+
+
+def encode_cursor(variable):
+    """The opaque cursor of the page after variable"""
+    raw = json.dumps([variable.name, variable.pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """The (name, pk) a cursor points after"""
+    try:
+        name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(name), int(pk)
+    except (ValueError, TypeError):
+        raise CursorError("Invalid cursor") from None
+
+
+def search_variables(queryset, code_field, query='', cursor=None, page_size=PAGE_SIZE):
+    """
+    Returns a page of the variables of queryset matching query, and the cursor
+    of the next page or None if it is the last one.
+    code_field is the lookup path from the variable to its indicator variable code.
+    """
+    query = query.strip()
+    if query:
+        queryset = queryset.filter(Q(name__istartswith=query) | Q(**{f'{code_field}__iexact': query}))
+    if cursor:
+        name, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(name__gt=name) | Q(name=name, pk__gt=pk))
+
+    # One extra row tells if there is a next page without counting
+    page = list(queryset.order_by('name', 'pk')[:page_size + 1])
+    if len(page) > page_size:
+        return page[:page_size], encode_cursor(page[page_size - 1])
+    return page, None
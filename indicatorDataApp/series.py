@@ -0,0 +1,176 @@
+"""
+Batch loading and evaluation of indicator series.
+
+All the values of an indicator's variables at the indicator's level are loaded
+in a couple of queries into dense (place x period) arrays, one per variable code.
+The compiled formula is then evaluated once over those arrays.
+"""
+import numpy as np
+import pandas as pd
+from django.db.models import Min, Max
+
+from .asof import asof_indices
+from .models import AggregationLevelChoice, Country, Region, District
+from .models import NationalVarValue, RegionalVarValue, DistrictVarValue
+from .models import NationalVarRollup, RegionalVarRollup
+
+
+class LevelStorage:
+    """Where the values of variables at one aggregation level are found"""
+    __slots__ = ('value_model', 'rollup_model', 'indicator_var', 'place', 'place_name',
+                 'place_model', 'place_country')
+
+    def __init__(self, value_model, rollup_model, indicator_var, place, place_name,
+                 place_model, place_country):
+        self.value_model = value_model
+        self.rollup_model = rollup_model
+        self.indicator_var = indicator_var
+        self.place = place
+        self.place_name = place_name
+        self.place_model = place_model
+        self.place_country = place_country
+
+    def places(self, country):
+        """The places of a country at this level"""
+        return self.place_model.objects.filter(**{self.place_country: country})
+
+
+LEVEL_STORAGE = {
+    AggregationLevelChoice.NATIONAL: LevelStorage(
+        NationalVarValue, NationalVarRollup,
+        'variable__indicator_var', 'variable__indicator_var__country', 'country',
+        Country, 'pk',
+    ),
+    AggregationLevelChoice.REGIONAL: LevelStorage(
+        RegionalVarValue, RegionalVarRollup,
+        'variable__indicator_var', 'variable__region', 'region',
+        Region, 'country',
+    ),
+    AggregationLevelChoice.DISTRICT: LevelStorage(
+        DistrictVarValue, None,
+        'variable__indicator_var', 'variable__district', 'district',
+        District, 'country',
+    ),
+}
+
+
+def level_storage(indicator):
+    return LEVEL_STORAGE[indicator.level or AggregationLevelChoice.NATIONAL]
+
+
+def value_sources(indicator):
+    """
+    The (model, value field, indicator variable pks) the values of an indicator's
+    variables at its level are read from: the value table for inputted values
+    and the rollup table for computed ones. Sources without variables are left out.
+    """
+    storage = level_storage(indicator)
+    level = indicator.level or AggregationLevelChoice.NATIONAL
+    variables = list(indicator.variables.all())
+    computed = [v.pk for v in variables if v.is_computed_at(level)]
+    inputted = [v.pk for v in variables if not v.is_computed_at(level)]
+
+    sources = [(storage.value_model, 'inputted_value', inputted)]
+    if storage.rollup_model is not None:
+        sources.append((storage.rollup_model, 'value', computed))
+    return [source for source in sources if source[2]]
+
+
+def period_range(indicator):
+    """
+    The first and last period of the indicator's values, (None, None) if it has
+    none. One aggregate query per source table, whatever the number of variables.
+    """
+    storage = level_storage(indicator)
+    firsts, lasts = [], []
+    for model, _, variable_pks in value_sources(indicator):
+        found = model.objects.filter(**{storage.indicator_var + '__in': variable_pks}).aggregate(
+            first=Min('period'), last=Max('period'))
+        if found['first'] is not None:
+            firsts.append(found['first'])
+            lasts.append(found['last'])
+    if not firsts:
+        return None, None
+    return min(firsts), max(lasts)
+
+
+def load_values(indicator, places=None):
+    """
+    Returns a long frame of code, place, period and value for every value of the
+    indicator's variables at its level. Inputted values come from the value table,
+    computed ones from the stored rollups, one query each.
+    Input:
+        places -> optional place ids to restrict the load to
+    """
+    storage = level_storage(indicator)
+    columns = ['code', 'place', 'period', 'value']
+    frames = []
+    for model, value_field, variable_pks in value_sources(indicator):
+        queryset = model.objects.filter(**{storage.indicator_var + '__in': variable_pks})
+        if places is not None:
+            queryset = queryset.filter(**{storage.place + '__in': places})
+        rows = queryset.order_by().values_list(
+            storage.indicator_var + '__code', storage.place, 'period', value_field
+        )
+        # Streamed through a server-side cursor where the database has them
+        frames.append(pd.DataFrame.from_records(rows.iterator(chunk_size=10000),
+                                                columns=columns))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def dense_arrays(values, codes):
+    """
+    Pivots a long frame of values into (place x period) arrays per code.
+    Returns the sorted places, the sorted periods and the arrays, NaN where missing.
+    """
+    places = np.sort(values['place'].unique()) if len(values) else np.array([], dtype=np.int64)
+    periods = np.sort(pd.to_datetime(values['period']).unique()) if len(values) \
+        else np.array([], dtype='datetime64[ns]')
+
+    arrays = {code: np.full((len(places), len(periods)), np.nan) for code in codes}
+    if len(values):
+        place_index = np.searchsorted(places, values['place'].to_numpy())
+        period_index = np.searchsorted(periods, pd.to_datetime(values['period']).to_numpy())
+        amounts = values['value'].astype(float).to_numpy()
+        for code, rows in values.groupby('code').indices.items():
+            if code in arrays:
+                arrays[code][place_index[rows], period_index[rows]] = amounts[rows]
+    return places, periods, arrays
+
+
+def values_as_of(array, periods, dates):
+    """
+    For each date, the first value at a period on or after it, like get_value_at
+    Input:
+        array -> (place x period) values, NaN where missing
+        periods -> sorted periods of the array columns
+        dates -> dates to read the values at
+    """
+    if array.shape[1] == 0:
+        return np.full((array.shape[0], len(dates)), np.nan)
+    # Fill each gap with the next value at a later period
+    filled = pd.DataFrame(array).bfill(axis=1).to_numpy()
+    filled = np.hstack([filled, np.full((array.shape[0], 1), np.nan)])
+    return filled[:, asof_indices(periods, dates)]
+
+
+def indicator_frame(indicator, dates, places=None):
+    """
+    Evaluates an indicator over all its places at dates.
+    Returns a DataFrame with a row per place and a column per date.
+    """
+    dates = list(dates)
+    formula = indicator.formula
+    values = load_values(indicator, places=places)
+    places, periods, arrays = dense_arrays(values, formula.variables)
+
+    at_dates = {code: values_as_of(array, periods, dates) for code, array in arrays.items()}
+    result = np.broadcast_to(formula(at_dates), (len(places), len(dates)))
+
+    return pd.DataFrame(
+        result, columns=dates,
+        index=pd.Index(places, name=level_storage(indicator).place_name),
+    )
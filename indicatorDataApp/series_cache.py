@@ -0,0 +1,118 @@
+"""
+Cache of evaluated indicator series.
+
+Each (indicator, level, place) has one entry mapping the dates it was evaluated
+at to its value, or None if the place has no values at all. A request is served
+from the entries when they hold every date asked for; otherwise the indicator
+is evaluated once for all the places and the entries are extended.
+
+Every key carries the series version of its indicator, which is bumped whenever
+the indicator, its variables, or their values or rollups change, so a change
+only makes the series of the indicators it affects stale. Entries of older
+versions are never read again and age out of the cache, least recently used
+first.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import AggregationLevelChoice, Indicator
+from .registry import lookup
+from .series import indicator_frame, level_storage
+
+
+CACHE_ALIAS = 'series'
+VERSION_KEY = 'series-version'
+
+
+def series_cache():
+    return caches[CACHE_ALIAS]
+
+
+def version_key(indicator_pk):
+    return f'{VERSION_KEY}:{indicator_pk}'
+
+
+def series_version(indicator_pk):
+    """The current series version of an indicator"""
+    cache = series_cache()
+    key = version_key(indicator_pk)
+    version = cache.get(key)
+    if version is None:
+        # Start after any version used before the key was evicted, so entries
+        # written under those versions can not be read again
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_series_version(indicator_pks):
+    """Makes the cached series of indicators stale, now and once the transaction commits"""
+    keys = [version_key(pk) for pk in set(indicator_pks)]
+
+    def bump():
+        for key in keys:
+            try:
+                series_cache().incr(key)
+            except ValueError:
+                # Evicted, the next read starts a newer version
+                pass
+
+    # Bumped again on commit, as series read before it would be of the old values
+    bump()
+    transaction.on_commit(bump)
+
+
+def bump_variable_series(indicator_var_pks):
+    """Makes the cached series of the indicators over indicator variables stale"""
+    bump_series_version(Indicator.objects.filter(variables__in=list(indicator_var_pks))
+                        .values_list('pk', flat=True).distinct())
+
+
+def entry_key(indicator, place, version):
+    level = indicator.level or AggregationLevelChoice.NATIONAL
+    return f'series:{version}:{indicator.pk}:{level}:{place}'
+
+
+def cached_indicator_frame(indicator, dates, places=None):
+    """
+    indicator_frame served from the series cache.
+    Input:
+        places -> optional place ids to evaluate, all the country's places otherwise
+    """
+    cache = series_cache()
+    dates = list(dates)
+    requested = places
+    if places is None:
+        places = lookup(lambda registry: registry.place_ids(indicator.level, indicator.country_id))
+    places = sorted(int(place) for place in places)
+
+    version = series_version(indicator.pk)
+    keys = {place: entry_key(indicator, place, version) for place in places}
+    found = cache.get_many(keys.values())
+    entries = {place: found[key] for place, key in keys.items() if key in found}
+
+    missed = len(entries) < len(places) or any(
+        entry is not None and not entry.keys() >= set(dates) for entry in entries.values()
+    )
+    if missed:
+        frame = indicator_frame(indicator, dates, places=requested)
+        for place in places:
+            if place in frame.index:
+                entry = entries.get(place) or {}
+                entry.update(zip(dates, frame.loc[place].tolist()))
+                entries[place] = entry
+            else:
+                entries[place] = None
+        cache.set_many({keys[place]: entry for place, entry in entries.items()})
+
+    with_values = [place for place in places if entries[place] is not None]
+    values = np.array([[entries[place][d] for d in dates] for place in with_values],
+                      dtype=float).reshape(len(with_values), len(dates))
+    return pd.DataFrame(
+        values, columns=dates,
+        index=pd.Index(with_values, name=level_storage(indicator).place_name),
+    )
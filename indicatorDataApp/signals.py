@@ -1,59 +1,132 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-import pycountry
+from .assignments import forget_assignments
+from .jobs import enqueue, enqueue_recomputes
+from .registry import bump_hierarchy_version
+from .geography import subdivisions, regions_and_districts
+from .series_cache import bump_series_version, bump_variable_series
 from .models import Country, Region, District, Indicator
-from .models import IndicatorValue, NationalVarValue
+from .models import NationalVarValue
+from .models import RegionalVarValue, DistrictVarValue
 from .models import IndicatorVariable, NationalIndicatorVariable
 from .models import DistrictIndicatorVariable, RegionalIndicatorVariable
-from .models import AggregationLevelChoice
+from .models import AggregationLevelChoice, JobKindChoice
 
 @receiver(post_save, sender=Country)
 def create_regions(sender, instance, created, **kwargs):
-    regions = pycountry.subdivisions.get(country_code=instance.code)
-    if created:
-        for region in regions:
-            Region.objects.create(
-                name=region.name,
-                code=region.code,
-                country=instance
-            )
+    """
+    Seeds a new country's regions from its ISO subdivisions in a single insert.
+    With settings.SEED_DISTRICTS, nested subdivisions become districts of their region.
+    """
+    if not created:
+        return
+
+    if getattr(settings, 'SEED_DISTRICTS', False):
+        regions, districts = regions_and_districts(instance.code)
+    else:
+        regions, districts = subdivisions(instance.code), []
+
+    region_name_length = Region._meta.get_field('name').max_length
+    district_name_length = District._meta.get_field('name').max_length
+    with transaction.atomic():
+        created_regions = Region.objects.bulk_create([
+            Region(name=region.name[:region_name_length], code=region.code, country=instance)
+            for region in regions
+        ])
+        regions_by_code = {region.code: region for region in created_regions}
+        District.objects.bulk_create([
+            District(name=district.name[:district_name_length], code=district.code,
+                     region=regions_by_code[region_code], country=instance)
+            for district, region_code in districts
+        ])
+
+
+@receiver(post_save, sender=NationalVarValue)
+@receiver(post_delete, sender=NationalVarValue)
+@receiver(post_save, sender=RegionalVarValue)
+@receiver(post_delete, sender=RegionalVarValue)
+@receiver(post_save, sender=DistrictVarValue)
+@receiver(post_delete, sender=DistrictVarValue)
+def recompute_indicator_values(sender, instance, **kwargs):
+    """
+    Queues a recompute of the stored values of the indicators over the value's
+    variable. Values are read as of the first period on or after a date, so
+    the dates up to the value's period, or the period it was moved from, change.
+    """
+    # Runs before the rollup receivers, which reset the loaded state
+    periods = [instance.period, getattr(instance, '_loaded_period', None)]
+    jobs = enqueue_recomputes([instance.variable.indicator_var_id],
+                              period_end=max(period for period in periods if period is not None))
+    # Only the series of those indicators are stale
+    bump_series_version(job.indicator_id for job in jobs)
 
 
-# @receiver(post_save, sender=IndicatorValue)
-# def calculate_actual_indicator_alue(sender, instance, created, **kwargs):
-#     indicator = instance.indicator
-#     indicator_variables = indicator.variables.all()
-#     formula = indicator.value_calculation.replace('^', '**')
-    
-#     if indicator.level == AggregationLevelChoice.NATIONAL:
-#         vars_dict = {var.code: var.get() for var in indicator_variables}
-    
-#     if indicator.level == AggregationLevelChoice.REGIONAL:
-#         # It has to have multiple values, thus for each region
-#         vars_dict = {var.code: var.get() for var in indicator_variables}
-#     #...
+@receiver(post_save, sender=Indicator)
+def recompute_indicator(sender, instance, created, **kwargs):
+    """The formula or level may have changed, every stored value is replaced"""
+    if not created:
+        enqueue(JobKindChoice.RECOMPUTE, indicator=instance)
 
 
-    # return eval(formula, vars_dict)
+@receiver(m2m_changed, sender=Indicator.variables.through)
+def recompute_indicator_variables(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        enqueue(JobKindChoice.RECOMPUTE, indicator=instance)
+    elif pk_set:
+        # Changed from the variable's side, pk_set holds the indicators
+        for indicator in Indicator.objects.filter(pk__in=pk_set):
+            enqueue(JobKindChoice.RECOMPUTE, indicator=indicator)
 
 
-    # if indicator.level == AggregationLevelChoice.REGIONAL:
-    #     actual_variables = RegionalIndicatorVariable.objects.filter(indicator=indicator)
+@receiver(m2m_changed, sender=Indicator.variables.through)
+def reset_indicator_formula(sender, instance, action, **kwargs):
+    """The default formula sums the variables, so it changes with them"""
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Indicator):
+        instance.__dict__.pop('formula', None)
 
-    # if indicator.level == AggregationLevelChoice.DISTRICT:
-    #     actual_variables = DistrictIndicatorVariable.objects.filter(indicator=indicator)
 
-    # values = None # Should be values in this period match 
-    # if not self.indicator.computing_formula:
-    #     # Default calculation is the sum of all variables
-    #     return values.aggregate(models.Sum('value'))['value__sum']
-    # else:
-    #     # Evaluate the formula
-    #     formula = self.indicator.value_calculation.replace('^', '**')
-    #     vars_dict = {v.code: v.value for v in variables.all()}
-    #     return eval(formula, vars_dict)
+@receiver(post_save, sender=Indicator)
+def reset_series(sender, instance, **kwargs):
+    """Cached series of an indicator are stale once it changes"""
+    bump_series_version([instance.pk])
 
 
+@receiver(post_save, sender=IndicatorVariable)
+def reset_variable_series(sender, instance, **kwargs):
+    """The level or compute format of a variable changes the indicators over it"""
+    bump_variable_series([instance.pk])
+
+
+@receiver(m2m_changed, sender=Indicator.variables.through)
+def reset_indicator_series(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_series_version([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # Changed from the variable's side, pk_set holds the indicators
+        bump_series_version(pk_set)
+    elif action == 'pre_clear':
+        # The cleared indicators are only known before, bumped again on commit
+        bump_series_version(instance.indicators.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=IndicatorVariable.assignees.through)
+def reset_assignments(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drops the cached assignments of the users whose assignments changed"""
+    if reverse:
+        # Changed from the user's side, instance is the user
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            forget_assignments([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        forget_assignments(pk_set)
+    elif action == 'pre_clear':
+        # The users are gone once cleared, so drop them before
+        forget_assignments(instance.assignees.values_list('pk', flat=True))
+
 
 @receiver(post_save, sender=IndicatorVariable)
 def create_indicator_vars(sender, instance, created, **kwargs):
@@ -65,17 +138,85 @@ def create_indicator_vars(sender, instance, created, **kwargs):
         level -> 'c' for country, 'r' for regional and 'd' for district
         country -> country to create vars for
     """
-    if instance.level == AggregationLevelChoice.NATIONAL:
-        instance.get_create_national_var()
-        instance.delete_regional_vars() # Would auto delete district vars, would do
-                                        # nothing if regional or district vars exist not
-    
-    if instance.level == AggregationLevelChoice.REGIONAL:
-        instance.get_create_national_var()
-        instance.get_create_regional_vars()
-        instance.delete_district_vars()
-
-    if instance.level == AggregationLevelChoice.DISTRICT:
-        instance.get_create_national_var()
-        instance.get_create_regional_vars()
-        instance.get_create_district_vars()
+    # Each step diffs and bulk inserts, so this is a constant number of queries
+    # whatever the number of regions and districts
+    with transaction.atomic():
+        if instance.level == AggregationLevelChoice.NATIONAL:
+            instance.get_create_national_var()
+            instance.delete_regional_vars() # Would auto delete district vars, would do
+                                            # nothing if regional or district vars exist not
+        
+        if instance.level == AggregationLevelChoice.REGIONAL:
+            instance.get_create_national_var()
+            instance.get_create_regional_vars()
+            instance.delete_district_vars()
+
+        if instance.level == AggregationLevelChoice.DISTRICT:
+            instance.get_create_national_var()
+            instance.get_create_regional_vars()
+            instance.create_district_vars()
+
+
+def loaded_state(instance):
+    """The period and value a value had when it was loaded, None if it is new"""
+    loaded_period = getattr(instance, '_loaded_period', None)
+    if loaded_period is None:
+        return None, None
+    return loaded_period, instance._loaded_value
+
+
+def shift_rollups(instance, shift, deleted=False):
+    """
+    Moves a value's contribution out of the rollup it was in and into the
+    one for its current period. Only that single parent chain is touched.
+    """
+    loaded_period, loaded_value = loaded_state(instance)
+    if deleted:
+        if loaded_period is not None:
+            shift(loaded_period, removed=loaded_value)
+    elif loaded_period == instance.period:
+        if loaded_value != instance.inputted_value:
+            shift(instance.period, added=instance.inputted_value, removed=loaded_value)
+    else:
+        if loaded_period is not None:
+            shift(loaded_period, removed=loaded_value)
+        shift(instance.period, added=instance.inputted_value)
+    instance.remember_loaded()
+
+
+@receiver(post_save, sender=DistrictVarValue)
+def rollup_district_value(sender, instance, **kwargs):
+    """Shifts the regional then national rollups a district value feeds into"""
+    shift_rollups(instance, instance.variable.regional_var.shift_rollup)
+
+
+@receiver(post_delete, sender=DistrictVarValue)
+def unroll_district_value(sender, instance, **kwargs):
+    shift_rollups(instance, instance.variable.regional_var.shift_rollup, deleted=True)
+
+
+@receiver(post_save, sender=RegionalVarValue)
+def rollup_regional_value(sender, instance, **kwargs):
+    """Shifts the national rollup when regional values are the inputted ones"""
+    national_var = instance.variable.national_var
+    if national_var.indicator_var.level == AggregationLevelChoice.REGIONAL:
+        shift_rollups(instance, national_var.shift_rollup)
+
+
+@receiver(post_delete, sender=RegionalVarValue)
+def unroll_regional_value(sender, instance, **kwargs):
+    national_var = instance.variable.national_var
+    if national_var.indicator_var.level == AggregationLevelChoice.REGIONAL:
+        shift_rollups(instance, national_var.shift_rollup, deleted=True)
+
+
+# Registered last, so the rows create_regions adds are in the reload
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+def reload_hierarchy(sender, **kwargs):
+    """Makes every process reload the hierarchy registry"""
+    bump_hierarchy_version()
@@ -0,0 +1,152 @@
+"""
+Columnar snapshots of indicator series on disk.
+
+A snapshot holds an indicator's (place x period) matrix at its divide_dates as
+.npy files, the values, places and periods, next to a small JSON manifest:
+
+    SNAPSHOT_ROOT/<indicator pk>/manifest.json
+    SNAPSHOT_ROOT/<indicator pk>/<version>/{values,places,periods}.npy
+
+The values are memory-mapped when read, so the processes of a server share the
+same pages through the OS page cache instead of each evaluating and holding the
+series. A new snapshot is written to a new version directory and published by
+replacing the manifest, so readers never see a half written one.
+
+Snapshots are rewritten by the recompute jobs (see jobs.py) and the
+snapshot_indicators command. A snapshot is only read while no recompute of its
+indicator is queued or running, since a value change queues one, and while the
+country's places at the indicator's level are the ones it was written with,
+since adding or moving a region or district queues none.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .models import AggregationLevelChoice, Job, JobKindChoice, JobStatusChoice
+from .registry import lookup
+from .series import indicator_frame, level_storage
+
+
+MANIFEST = 'manifest.json'
+ARRAYS = ('values', 'places', 'periods')
+
+# Arrays of the snapshots opened by this process, per indicator pk, with their
+# version, the least recently read dropped past MAX_OPENED
+opened = OrderedDict()
+MAX_OPENED = 128
+
+
+def snapshot_root():
+    return getattr(settings, 'SNAPSHOT_ROOT', None)
+
+
+def indicator_dir(indicator_pk):
+    return os.path.join(snapshot_root(), str(indicator_pk))
+
+
+def read_manifest(indicator_pk):
+    try:
+        with open(os.path.join(indicator_dir(indicator_pk), MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def places_digest(indicator):
+    """A digest of the ids of the country's places at the indicator's level"""
+    ids = lookup(lambda registry: registry.place_ids(indicator.level, indicator.country_id))
+    return hashlib.sha1(np.asarray(ids, dtype=np.int64).tobytes()).hexdigest()
+
+
+def write_snapshot(indicator):
+    """Evaluates the indicator at its divide_dates and publishes the result as its snapshot"""
+    if snapshot_root() is None:
+        return None
+    dates = indicator.divide_dates()
+    frame = indicator_frame(indicator, dates)
+
+    version = str(time.time_ns())
+    directory = indicator_dir(indicator.pk)
+    os.makedirs(os.path.join(directory, version))
+    arrays = {
+        'values': np.ascontiguousarray(frame.to_numpy(dtype=float)),
+        'places': frame.index.to_numpy(dtype=np.int64),
+        'periods': np.array(dates, dtype='datetime64[D]'),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, version, f'{name}.npy'), array)
+
+    manifest = {
+        'indicator': indicator.pk,
+        'version': version,
+        'level': indicator.level or AggregationLevelChoice.NATIONAL,
+        'places': places_digest(indicator),
+        'shape': list(arrays['values'].shape),
+        'files': {name: f'{version}/{name}.npy' for name in arrays},
+    }
+    temporary = os.path.join(directory, f'{MANIFEST}.{version}')
+    with open(temporary, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+    # Processes still reading older versions keep their mapped files until they let go
+    for entry in os.listdir(directory):
+        if entry.isdigit() and entry != version:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return manifest
+
+
+def is_current(indicator):
+    """False while a recompute of the indicator is pending, its snapshot may be stale"""
+    return not Job.objects.filter(
+        indicator=indicator, kind=JobKindChoice.RECOMPUTE,
+        status__in=[JobStatusChoice.QUEUED, JobStatusChoice.RUNNING],
+    ).exists()
+
+
+def load_arrays(indicator_pk, manifest):
+    """The snapshot's arrays, the values memory-mapped, opened once per version"""
+    version, arrays = opened.get(indicator_pk, (None, None))
+    if version != manifest['version']:
+        directory = indicator_dir(indicator_pk)
+        arrays = {
+            name: np.load(os.path.join(directory, manifest['files'][name]),
+                          mmap_mode='r' if name == 'values' else None)
+            for name in ARRAYS
+        }
+        arrays['periods'] = arrays['periods'].astype(object).tolist()
+        opened[indicator_pk] = manifest['version'], arrays
+        while len(opened) > MAX_OPENED:
+            opened.popitem(last=False)
+    opened.move_to_end(indicator_pk)
+    return arrays
+
+
+def snapshot_frame(indicator):
+    """
+    The indicator's snapshot as a DataFrame shaped like Indicator.data(), viewing
+    the mapped values without copying them. None if there is no current snapshot.
+    """
+    if snapshot_root() is None:
+        return None
+    manifest = read_manifest(indicator.pk)
+    if manifest is None or manifest['level'] != (indicator.level or AggregationLevelChoice.NATIONAL):
+        return None
+    if not is_current(indicator) or manifest.get('places') != places_digest(indicator):
+        return None
+    try:
+        arrays = load_arrays(indicator.pk, manifest)
+    except OSError:
+        # Replaced by a newer snapshot since the manifest was read
+        return None
+    return pd.DataFrame(
+        arrays['values'], columns=arrays['periods'], copy=False,
+        index=pd.Index(arrays['places'], name=level_storage(indicator).place_name),
+    )
@@ -1,3 +1,1201 @@
-from django.test import TestCase
+import csv
+import io
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .asof import values_at
+from .assignments import AssignedVariables
+from .forms import CountryForm
+from .exports import export_frames
+from .formulas import FormulaError, compile_formula, default_formula
+from .geography import subdivisions
+from .imports import ValueImportError, import_values
+from .jobs import LEASE, claim_jobs, enqueue, heartbeat, requeue_stale_jobs, run_job
+from .partitions import detach_partitions, edge_name, extend_partitions, partition_years
+from .rollups import rebuild_country_rollups
+from . import snapshots
+from .search import CursorError, decode_cursor, encode_cursor, search_variables
+from .models import Country, Region, District, Indicator, IndicatorVariable, RegionalIndicatorVariable
+from .periods import BUCKETS
+from .registry import bump_hierarchy_version, registry
+from .series import indicator_frame
+from .series_cache import cached_indicator_frame
+from .snapshots import snapshot_frame, write_snapshot
+from .models import AggregationLevelChoice, CalFormatChoice, MeasurementFreqChoice, ValueTypeChoice
+from .models import DistrictIndicatorVariable, DistrictVarValue, RegionalVarRollup
+from .models import IndicatorValue, Job, JobKindChoice, JobStatusChoice, NationalVarRollup, NationalVarValue
+
+
+class HierarchyTestCase(TestCase):
+    """Builds the country, places, variables and indicators the tests share"""
+
+    def setUp(self):
+        # Assignments, the hierarchy version and cached series outlive the rolled
+        # back transaction of the previous test
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    @classmethod
+    def create_country(cls, regions=0, districts=0):
+        """Country ZZ with regions ZZ-<i>, each with districts ZZ-<i>-<j>"""
+        country = Country.objects.create(name='Testland', code='ZZ')
+        created = Region.objects.bulk_create([
+            Region(name=f'Region {i}', code=f'ZZ-{i}', country=country) for i in range(regions)
+        ])
+        District.objects.bulk_create([
+            District(name=f'District {region.code}-{j}', code=f'{region.code}-{j}',
+                     region=region, country=country)
+            for region in created for j in range(districts)
+        ])
+        # Bulk inserts send no signals
+        bump_hierarchy_version()
+        return country
+
+    @classmethod
+    def create_variable(cls, country, code='V', level=AggregationLevelChoice.NATIONAL,
+                        value_type=ValueTypeChoice.INPUTTED, **kwargs):
+        return IndicatorVariable.objects.create(
+            name=f'Variable {code}', code=code, country=country, value_type=value_type,
+            level=level, **kwargs
+        )
+
+    @classmethod
+    def create_indicator(cls, country, variables, level=AggregationLevelChoice.NATIONAL, **kwargs):
+        indicator = Indicator.objects.create(
+            name='Indicator', code='I', country=country, measurement_unit='Num', level=level,
+            **kwargs
+        )
+        indicator.variables.add(*variables)
+        return indicator
+
+
+class InputDataViewQueriesTest(HierarchyTestCase):
+    """The input page renders in a fixed number of queries, however many values it lists"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = cls.create_country(regions=3)
+        cls.regional_var = cls.create_regional_var('IN', ValueTypeChoice.INPUTTED)
+        cls.computed_var = cls.create_regional_var('CO', ValueTypeChoice.COMPUTED)
+        cls.user = User.objects.create_superuser('admin')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    @classmethod
+    def create_regional_var(cls, code, value_type):
+        indicator_var = cls.create_variable(cls.country, code, AggregationLevelChoice.DISTRICT, value_type)
+        return indicator_var.get_create_national_var().regional_vars.first()
+
+    def add_values(self, variable, count, year=2020):
+        for day in range(1, count + 1):
+            variable.create_value(period=date(year, 1, day), inputted_value=day)
+
+    def count_queries(self, variable, existing_value=None):
+        kwargs = {'var_class_name': type(variable).__name__, 'var_pk': variable.pk}
+        name = 'update_variable'
+        if existing_value is not None:
+            kwargs['existing_value_pk'] = existing_value.pk
+            name = 'update_existing_value'
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, kwargs=kwargs))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_fixed_queries(self, variable):
+        self.add_values(variable, 2)
+        few = self.count_queries(variable)
+        self.add_values(variable, 20, year=2021)
+        self.assertEqual(self.count_queries(variable), few)
+
+    def test_inputted_values(self):
+        self.assert_fixed_queries(self.regional_var)
+
+    def test_computed_values(self):
+        self.assert_fixed_queries(self.computed_var)
+
+    def test_existing_value(self):
+        self.add_values(self.computed_var, 20)
+        value = self.computed_var.value_models.last()
+        self.assertEqual(self.count_queries(self.computed_var, existing_value=value),
+                         self.count_queries(self.computed_var))
+
+
+class AssignedVariablesTest(HierarchyTestCase):
+    """Users only resolve the variables assigned to them, as assignments change"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=1)
+        cls.indicator_var = cls.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        cls.regional_var = RegionalIndicatorVariable.objects.get()
+        cls.user = User.objects.create_user('user')
+
+    def assigned(self):
+        return list(AssignedVariables(self.user).queryset(RegionalIndicatorVariable))
+
+    def test_assignment_changes(self):
+        self.assertEqual(self.assigned(), [])
+        self.indicator_var.assignees.add(self.user)
+        self.assertEqual(self.assigned(), [self.regional_var])
+        self.user.assigned_variables.remove(self.indicator_var)
+        self.assertEqual(self.assigned(), [])
+        self.indicator_var.assignees.add(self.user)
+        self.indicator_var.assignees.clear()
+        self.assertEqual(self.assigned(), [])
+
+    def test_update_existing_value(self):
+        self.indicator_var.assignees.add(self.user)
+        self.create_indicator(self.indicator_var.country, [self.indicator_var], AggregationLevelChoice.REGIONAL)
+        value = self.regional_var.create_value(period=date(2021, 1, 1), inputted_value=1)
+        Job.objects.all().delete()
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('update_existing_value', kwargs={
+            'var_class_name': 'RegionalIndicatorVariable', 'var_pk': self.regional_var.pk,
+            'existing_value_pk': value.pk,
+        }), {'var_value': '2.5', 'var_value_date': '2020-01-01', 'variable_class': 'RegionalIndicatorVariable',
+             'variable_pk': self.regional_var.pk, 'existing_value_pk': value.pk})
+        self.assertEqual(response.status_code, 200)
+        value.refresh_from_db()
+        self.assertEqual((value.period, value.inputted_value), (date(2020, 1, 1), Decimal('2.50')))
+        # Dates up to the period the value moved from are recomputed
+        self.assertEqual(Job.objects.get().period_end, date(2021, 1, 1))
+
+    def test_unassigned_variable_not_found(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('update_variable', kwargs={
+            'var_class_name': 'RegionalIndicatorVariable', 'var_pk': self.regional_var.pk}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('update_variable', kwargs={
+            'var_class_name': 'Indicator', 'var_pk': self.regional_var.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class AssignedApiTest(HierarchyTestCase):
+    """The async API only serves the variables and indicators assigned to the user"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=1)
+        assigned_var = cls.create_variable(country, 'V', AggregationLevelChoice.REGIONAL)
+        other_var = cls.create_variable(country, 'W', AggregationLevelChoice.REGIONAL)
+        cls.indicator = cls.create_indicator(country, [assigned_var], AggregationLevelChoice.REGIONAL)
+        cls.other_indicator = Indicator.objects.create(
+            name='Other', code='O', country=country, measurement_unit='Num',
+            level=AggregationLevelChoice.REGIONAL, computing_formula='V + W'
+        )
+        cls.other_indicator.variables.add(assigned_var, other_var)
+        cls.regional_var = assigned_var.get_all_regional_vars().get()
+        cls.other_regional_var = other_var.get_all_regional_vars().get()
+        cls.regional_var.create_value(period=date(2020, 1, 1), inputted_value=1)
+        cls.user = User.objects.create_user('user')
+        assigned_var.assignees.add(cls.user)
+
+    def values(self, regional_var):
+        return self.client.get(reverse('api_variable_values', kwargs={
+            'var_class_name': 'RegionalIndicatorVariable', 'var_pk': regional_var.pk}))
+
+    def test_variable_values(self):
+        self.assertEqual(self.values(self.regional_var).status_code, 401)
+        self.client.force_login(self.user)
+        response = self.values(self.regional_var)
+        self.assertEqual(response.json()['values'], [
+            {'pk': self.regional_var.value_models.get().pk, 'period': '2020-01-01', 'value': 1.0}
+        ])
+        self.assertEqual(self.values(self.other_regional_var).status_code, 404)
+
+    # Threads of their own would not see the test's transaction
+    @mock.patch('indicatorDataApp.views.threaded', sync_to_async)
+    def test_indicator_series(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('api_indicators_series'),
+                                   {'indicator': [self.indicator.pk, self.other_indicator.pk]})
+        self.assertEqual([series['code'] for series in response.json()['results']], ['I'])
+        response = self.client.get(reverse('api_indicator_series', kwargs={'pk': self.other_indicator.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class SeriesCacheTest(HierarchyTestCase):
+    """Indicator data is served from the series cache until its values change"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=3)
+        indicator_var = cls.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        cls.indicator = cls.create_indicator(country, [indicator_var], AggregationLevelChoice.REGIONAL)
+        cls.regional_vars = list(RegionalIndicatorVariable.objects.order_by('pk'))
+        for i, regional_var in enumerate(cls.regional_vars[:2]):
+            regional_var.create_value(period=date(2020, 1, 1), inputted_value=i + 1)
+        cls.dates = [date(2019, 1, 1), date(2020, 1, 1), date(2021, 1, 1)]
+
+    def test_cached_data_matches(self):
+        expected = indicator_frame(self.indicator, self.dates)
+        self.assertTrue(self.indicator.data(self.dates).equals(expected))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.indicator.data(self.dates).equals(expected))
+
+    def test_value_change_invalidates(self):
+        self.indicator.data(self.dates)
+        value = self.regional_vars[0].value_models.get()
+        value.inputted_value = 10
+        value.save()
+        self.regional_vars[2].create_value(period=date(2020, 1, 1), inputted_value=3)
+        self.assertTrue(self.indicator.data(self.dates).equals(
+            indicator_frame(self.indicator, self.dates)))
+
+
+    def test_other_indicators_kept(self):
+        country = self.indicator.country
+        other_var = self.create_variable(country, 'W', AggregationLevelChoice.REGIONAL)
+        other = Indicator.objects.create(name='Other', code='O', country=country, measurement_unit='Num',
+                                         level=AggregationLevelChoice.REGIONAL)
+        other.variables.add(other_var)
+        other_var.get_all_regional_vars().first().create_value(period=date(2020, 1, 1), inputted_value=5)
+        expected = other.data(self.dates)
+
+        self.regional_vars[0].create_value(period=date(2021, 1, 1), inputted_value=7)
+        with self.assertNumQueries(0):
+            self.assertTrue(other.data(self.dates).equals(expected))
+        self.assertTrue(self.indicator.data(self.dates).equals(indicator_frame(self.indicator, self.dates)))
+        self.assertEqual(self.indicator.data(self.dates).loc[self.regional_vars[0].region_id].tolist()[2], 7)
+
+
+class RegistryTest(HierarchyTestCase):
+    """Hierarchy lookups cost no query and follow changes to the hierarchy"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = cls.create_country(regions=2)
+        cls.regions = list(cls.country.regions.order_by('pk'))
+        cls.district = District.objects.create(name='District', code='ZZ-0-0', region=cls.regions[0])
+
+    def test_lookups(self):
+        registry()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(self.regions[0]), 'Region 0 ZZ')
+            self.assertEqual(list(registry().place_ids(AggregationLevelChoice.REGIONAL, self.country.pk)),
+                             [region.pk for region in self.regions])
+            self.assertEqual(list(registry().place_ids(AggregationLevelChoice.DISTRICT, self.country.pk)),
+                             [self.district.pk])
+            self.assertEqual(registry().place_names(AggregationLevelChoice.NATIONAL, [self.country.pk, 0]),
+                             {self.country.pk: 'Testland'})
+
+    def test_reload_on_change(self):
+        registry()
+        region = Region.objects.create(name='Region 2', code='ZZ-2', country=self.country)
+        self.assertIn(region.pk, registry().place_ids(AggregationLevelChoice.REGIONAL, self.country.pk))
+        self.country.code = 'ZY'
+        self.country.save()
+        self.assertEqual(str(region), 'Region 2 ZY')
+        region.delete()
+        self.assertNotIn(region.pk, registry().place_ids(AggregationLevelChoice.REGIONAL, self.country.pk))
+
+
+class SeedRegionsTest(TestCase):
+    """A new country's regions, and districts if enabled, are seeded from its ISO subdivisions"""
+
+    def seed(self):
+        with CaptureQueriesContext(connection) as queries:
+            country = Country.objects.create(name='Cabo Verde', code='CV')
+        return country, len(queries)
+
+    def test_regions(self):
+        country, _ = self.seed()
+        self.assertEqual(country.regions.count(), len(subdivisions('CV')))
+        self.assertEqual(country.regions.get(code='CV-BR').name, 'Brava')
+        self.assertFalse(country.districts.exists())
+
+        # Only seeded once
+        country.name = 'Cape Verde'
+        with self.assertNumQueries(1):
+            country.save()
+
+    @override_settings(SEED_DISTRICTS=True)
+    def test_districts(self):
+        country, queries = self.seed()
+        self.assertEqual(sorted(country.regions.values_list('code', flat=True)), ['CV-B', 'CV-S'])
+        self.assertEqual(country.districts.count(), len(subdivisions('CV')) - 2)
+        district = country.districts.get(code='CV-BR')
+        self.assertEqual((district.name, district.region.code), ('Brava', 'CV-S'))
+        # A single insert per table, however many subdivisions
+        self.assertLess(queries, 10)
+
+
+class CountryFormTest(TestCase):
+    """The country is resolved from its ISO code"""
+
+    def test_country_from_code(self):
+        form = CountryForm(data={'country': 'KE'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save().name, 'Kenya')
+        self.assertFalse(CountryForm(data={'country': 'XX'}).is_valid())
+        self.assertFalse(CountryForm(data={'country': ''}).is_valid())
+
+
+class FormulaTest(SimpleTestCase):
+    """Formulas evaluate arithmetic over arrays and reject everything else"""
+
+    def test_evaluate(self):
+        formula = compile_formula('(A + B) * 2 - A ^ 2 / 4')
+        self.assertEqual(formula.variables, {'A', 'B'})
+        np.testing.assert_array_equal(formula({'A': np.array([2.0, 4.0]), 'B': np.array([1.0, np.nan])}),
+                                      [5.0, np.nan])
+        self.assertEqual(compile_formula('max(abs(A), 3)')({'A': -5}), 5)
+
+    def test_rejected(self):
+        for source in ['__import__("os")', 'A.real', 'open("f")', 'lambda: 1', '[A]', 'A if B else 1',
+                       '"text"', 'True', 'round(A, ndigits=1)', 'A +', '1' + '0' * 400]:
+            with self.subTest(source=source), self.assertRaises(FormulaError):
+                compile_formula(source)
+        with self.assertRaises(FormulaError):
+            compile_formula('A + B')({'A': 1})
+
+    def test_function_arguments(self):
+        a, b, c = np.array([1.0, 5.0]), np.array([2.0, 3.0]), np.array([0.0, 4.0])
+        np.testing.assert_array_equal(compile_formula('max(A, B, C)')({'A': a, 'B': b, 'C': c}), [2.0, 5.0])
+        np.testing.assert_array_equal(compile_formula('min(A, B, C)')({'A': a, 'B': b, 'C': c}), [0.0, 3.0])
+        # No argument is taken for the output array
+        np.testing.assert_array_equal(c, [0.0, 4.0])
+        self.assertEqual(compile_formula('round(A, 1)')({'A': 1.26}), 1.3)
+        self.assertEqual(compile_formula('round(A)')({'A': 1.6}), 2)
+
+        for source in ['sqrt(A, 2)', 'abs()', 'max(A)', 'min()', 'round(A, 1, 2)', 'round(A, B)', 'round(A, 1.5)']:
+            with self.subTest(source=source), self.assertRaises(FormulaError):
+                compile_formula(source)
+
+    def test_huge_power(self):
+        # Evaluated in floats, so this overflows at once instead of computing a huge int
+        self.assertEqual(compile_formula('9^9^9')({}), np.inf)
+
+    def test_default_formula(self):
+        self.assertEqual(default_formula(['B', 'A']), 'A + B')
+        self.assertEqual(compile_formula(default_formula([]))({}), 0)
+
+
+class IndicatorFrameTest(HierarchyTestCase):
+    """The batch evaluation gives what evaluating each place at each date on its own gives"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=2, districts=2)
+        inputted = cls.create_variable(country, 'A', AggregationLevelChoice.REGIONAL)
+        computed = cls.create_variable(country, 'B', AggregationLevelChoice.DISTRICT,
+                                       ValueTypeChoice.COMPUTED)
+        cls.indicator = cls.create_indicator(country, [inputted, computed], AggregationLevelChoice.REGIONAL,
+                                             computing_formula='A / B + 1')
+        cls.regions = list(country.regions.order_by('code'))
+        first, second = cls.regions
+
+        a = {var.region_id: var for var in inputted.get_all_regional_vars()}
+        a[first.pk].create_value(period=date(2020, 1, 1), inputted_value=4)
+        a[first.pk].create_value(period=date(2021, 6, 1), inputted_value=6)
+        a[second.pk].create_value(period=date(2021, 1, 1), inputted_value=3)
+
+        for i, district_var in enumerate(computed.get_all_district_vars().order_by('district__code')):
+            district_var.create_value(period=date(2020, 3, 1), inputted_value=i + 1)
+            if i == 0:
+                district_var.create_value(period=date(2021, 3, 1), inputted_value=2)
+        # Computed values used to be read through a value row of their period
+        b = {var.region_id: var for var in computed.get_all_regional_vars()}
+        b[first.pk].create_value(period=date(2020, 3, 1), inputted_value=0)
+        b[first.pk].create_value(period=date(2021, 3, 1), inputted_value=0)
+        b[second.pk].create_value(period=date(2020, 3, 1), inputted_value=0)
+        cls.variables = {'A': a, 'B': b}
+        cls.dates = [date(2019, 1, 1), date(2020, 1, 1), date(2020, 6, 1), date(2021, 3, 1), date(2022, 1, 1)]
+
+    def per_place(self):
+        """Each place and date evaluated on its own with get_value_at"""
+        def value_at(variable, day):
+            value = variable.get_value_at(day)
+            return np.nan if value is None else float(value)
+
+        return np.array([
+            [self.indicator.formula({code: value_at(variables[region.pk], day)
+                                     for code, variables in self.variables.items()})
+             for day in self.dates]
+            for region in self.regions
+        ])
+
+    def test_matches_per_place(self):
+        frame = indicator_frame(self.indicator, self.dates)
+        self.assertEqual(frame.index.tolist(), [region.pk for region in self.regions])
+        self.assertEqual(frame.columns.tolist(), self.dates)
+        expected = self.per_place()
+        np.testing.assert_allclose(frame.to_numpy(), expected)
+        self.assertEqual(np.isnan(expected).sum(), 4)
+
+        values = self.indicator.value_at(date(2020, 6, 1))
+        np.testing.assert_allclose([values[region] for region in self.regions], frame[date(2020, 6, 1)])
+
+
+class AsOfTest(HierarchyTestCase):
+    """Bulk as-of lookups read the first value on or after each date, like get_value_at"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=2)
+        indicator_var = cls.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        cls.national_var = indicator_var.national_var
+        cls.regional_vars = list(indicator_var.get_all_regional_vars().order_by('pk'))
+        for i, regional_var in enumerate(cls.regional_vars):
+            regional_var.create_value(period=date(2020, 1, 1), inputted_value=i + 1)
+            regional_var.create_value(period=date(2021, 1, 1), inputted_value=i + 3)
+        # Before the first value, on it, between two, on the last and after it
+        cls.dates = [date(2019, 6, 1), date(2020, 1, 1), date(2020, 6, 1), date(2021, 1, 1), date(2021, 6, 1)]
+
+    def assertValuesAt(self, variables, expected, computed=False):
+        found = values_at(variables, self.dates, computed=computed)
+        for variable, values in zip(variables, expected):
+            np.testing.assert_array_equal(found[variable.pk], values)
+
+    def test_values_at(self):
+        expected = [[1, 1, 3, 3, np.nan], [2, 2, 4, 4, np.nan]]
+        # The LATERAL join only runs on Postgres, other databases read a range and
+        # search it in numpy, which any database can run
+        vendors = ['postgresql', 'other'] if connection.vendor == 'postgresql' else ['other']
+        for vendor in vendors:
+            with self.subTest(vendor=vendor), mock.patch.object(connection, 'vendor', vendor):
+                self.assertValuesAt(self.regional_vars, expected)
+                self.assertValuesAt([self.national_var], [[3, 3, 7, 7, np.nan]], computed=True)
+
+        for regional_var, values in zip(self.regional_vars, expected):
+            self.assertEqual([regional_var.get_value_at(day) for day in self.dates],
+                             [None if np.isnan(value) else value for value in values])
+        self.assertEqual(values_at([], self.dates), {})
+
+
+class ProvisioningTest(HierarchyTestCase):
+    """Saving a variable creates the missing vars below it and drops the ones below its level"""
+
+    def create_counted(self, country, code):
+        with CaptureQueriesContext(connection) as queries:
+            self.create_variable(country, code, AggregationLevelChoice.DISTRICT)
+        return len(queries)
+
+    def assertVars(self, indicator_var, regional, district):
+        self.assertEqual(indicator_var.get_all_regional_vars().count(), regional)
+        self.assertEqual(indicator_var.get_all_district_vars().count(), district)
+
+    def test_diffs(self):
+        country = self.create_country(regions=2, districts=2)
+        few = self.create_counted(country, 'A')
+        indicator_var = IndicatorVariable.objects.get(code='A')
+        self.assertVars(indicator_var, 2, 4)
+
+        region = Region.objects.create(name='Region 2', code='ZZ-2', country=country)
+        District.objects.create(name='District ZZ-2-0', code='ZZ-2-0', region=region)
+        indicator_var.save()
+        self.assertVars(indicator_var, 3, 5)
+        self.assertEqual(sorted(indicator_var.get_all_district_vars().values_list('district__code', flat=True)),
+                         ['ZZ-0-0', 'ZZ-0-1', 'ZZ-1-0', 'ZZ-1-1', 'ZZ-2-0'])
+        self.assertEqual(indicator_var.get_all_district_vars().get(district__code='ZZ-2-0').region, region)
+
+        indicator_var.level = AggregationLevelChoice.REGIONAL
+        indicator_var.save()
+        self.assertVars(indicator_var, 3, 0)
+        indicator_var.level = AggregationLevelChoice.NATIONAL
+        indicator_var.save()
+        self.assertVars(indicator_var, 0, 0)
+
+        # As many queries whatever the number of places
+        for i in range(3, 6):
+            region = Region.objects.create(name=f'Region {i}', code=f'ZZ-{i}', country=country)
+            District.objects.create(name=f'District ZZ-{i}-0', code=f'ZZ-{i}-0', region=region)
+        self.assertEqual(self.create_counted(country, 'B'), few)
+
+
+def installed(module):
+    try:
+        import_module(module)
+    except ImportError:
+        return False
+    return True
+
+
+class ImportValuesTest(HierarchyTestCase):
+    """District values are imported from CSV or Excel files, skipping and reporting bad rows"""
+
+    ROWS = [
+        ['variable', 'district', 'period', 'value'],
+        ['V', 'ZZ-0-0', '2020-01-01', '1.5'],
+        ['V', 'ZZ-0-1', '2020-01-01', '2.5'],
+        ['V', 'ZZ-0-0', '2020-01-01', '3'],
+        ['V', 'ZZ-9-9', '2020-01-01', '1'],
+        ['V', 'ZZ-0-0', 'not a date', '1'],
+        ['V', 'ZZ-0-0', '2020-02-01', 'abc'],
+        ['V', 'ZZ-0-0', '2020-02-01', '1e12'],
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = cls.create_country(regions=1, districts=2)
+        cls.indicator_var = cls.create_variable(cls.country, level=AggregationLevelChoice.DISTRICT)
+
+    def csv_file(self, rows):
+        return io.BytesIO('\n'.join(','.join(row) for row in rows).encode())
+
+    def assertImported(self, result):
+        self.assertEqual((result.imported, result.skipped), (3, 4))
+        self.assertEqual([error.split(':')[0] for error in result.errors],
+                         ['Row 5', 'Row 6', 'Row 7', 'Row 8'])
+        values = DistrictVarValue.objects.order_by('variable__district__code')
+        self.assertEqual(list(values.values_list('variable__district__code', 'inputted_value')),
+                         [('ZZ-0-0', Decimal('3.00')), ('ZZ-0-1', Decimal('2.50'))])
+        # Rollups are rebuilt once the values are in
+        self.assertEqual(self.indicator_var.national_var.rollups.get().value, Decimal('5.50'))
+
+    def test_csv(self):
+        # Chunks of two rows, the later row for a variable and period wins across chunks
+        self.assertImported(import_values(self.csv_file(self.ROWS), 'values.csv', self.country, chunk_size=2))
+
+    @skipUnless(installed('openpyxl'), "openpyxl is not installed")
+    def test_excel(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        for row in self.ROWS:
+            workbook.active.append([date.fromisoformat(cell) if cell.startswith('2020') else cell
+                                    for cell in row])
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+        self.assertImported(import_values(file, 'values.xlsx', self.country, chunk_size=2))
+
+    def test_bad_files(self):
+        result = import_values(self.csv_file([['variable', 'district', 'period'], ['V', 'ZZ-0-0', '2020-01-01']]),
+                               'values.csv', self.country)
+        self.assertEqual(result.as_dict(), {'imported': 0, 'skipped': 1,
+                                            'errors': ["Row 2: missing column 'value'"]})
+        with self.assertRaises(ValueImportError):
+            import_values(self.csv_file(self.ROWS), 'values.txt', self.country)
+
+    def test_assigned_variables(self):
+        other_var = self.create_variable(self.country, 'W', AggregationLevelChoice.DISTRICT)
+        user = User.objects.create_user('user')
+        self.indicator_var.assignees.add(user)
+        self.client.force_login(user)
+
+        file = self.csv_file([self.ROWS[0], ['V', 'ZZ-0-0', '2020-01-01', '1'], ['W', 'ZZ-0-0', '2020-01-01', '1']])
+        file.name = 'values.csv'
+        response = self.client.post(reverse('import_values'), {'file': file, 'country': 'zz'})
+        self.assertEqual(response.json(), {'imported': 1, 'skipped': 1,
+                                           'errors': ["Row 3: no variable W for district ZZ-0-0"]})
+        self.assertFalse(DistrictVarValue.objects.filter(variable__indicator_var=other_var).exists())
+
+
+class ExportTest(HierarchyTestCase):
+    """Indicator exports stream every place at every date as CSV or Arrow"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=3)
+        indicator_var = cls.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        cls.indicator = cls.create_indicator(country, [indicator_var], AggregationLevelChoice.REGIONAL,
+                                             computing_formula='V * 2')
+        cls.regions = list(country.regions.order_by('pk'))
+        for i, regional_var in enumerate(indicator_var.get_all_regional_vars().order_by('region')[:2]):
+            regional_var.create_value(period=date(2020, 1, 1), inputted_value=i + 1)
+            regional_var.create_value(period=date(2021, 1, 1), inputted_value=i + 3)
+        cls.user = User.objects.create_superuser('admin')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        return self.client.get(reverse('export_indicator', kwargs={'pk': self.indicator.pk}),
+                               {'date': ['2020-06-01', '2021-06-01'], **params})
+
+    def expected(self):
+        values = {self.regions[0].pk: ['6.0', ''], self.regions[1].pk: ['8.0', ''], self.regions[2].pk: ['', '']}
+        return [[str(region.pk), region.name, day, values[region.pk][i]]
+                for region in self.regions for i, day in enumerate(['2020-06-01', '2021-06-01'])]
+
+    def test_csv(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows, [['place', 'place_name', 'date', 'value']] + self.expected())
+
+        # Chunks of places give the same rows
+        dates = [date(2020, 6, 1), date(2021, 6, 1)]
+        self.assertTrue(pd.concat(export_frames(self.indicator, dates, chunk_size=2), ignore_index=True).equals(
+            pd.concat(export_frames(self.indicator, dates), ignore_index=True)))
+
+    @skipUnless(installed('pyarrow'), "pyarrow is not installed")
+    def test_arrow(self):
+        import pyarrow as pa
+
+        response = self.export(format='arrow')
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        table = pa.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        rows = [[str(row['place']), row['place_name'], row['date'].isoformat(),
+                 '' if row['value'] is None or np.isnan(row['value']) else str(row['value'])]
+                for row in table.to_pylist()]
+        self.assertEqual(rows, self.expected())
+
+    def test_unassigned(self):
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.export().status_code, 404)
+
+    def test_bad_request(self):
+        self.assertEqual(self.export(format='xml').status_code, 400)
+        self.assertEqual(self.export(date='not a date').status_code, 400)
+
+
+class SearchVariablesTest(HierarchyTestCase):
+    """Sidebar variables are searched by name prefix or code and paged by keyset cursors"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=1)
+        for code in 'EDCBA':
+            cls.create_variable(country, code, AggregationLevelChoice.REGIONAL)
+        cls.user = User.objects.create_superuser('admin')
+
+    def pages(self, queryset, page_size, query=''):
+        pages, cursor = [], None
+        while True:
+            page, cursor = search_variables(queryset, 'indicator_var__code', query, cursor, page_size)
+            pages.append([variable.name for variable in page])
+            if cursor is None:
+                return pages
+
+    def test_pages(self):
+        queryset = RegionalIndicatorVariable.objects.all()
+        self.assertEqual(self.pages(queryset, 2), [
+            ['ZZ Variable A ZZ-0', 'ZZ Variable B ZZ-0'], ['ZZ Variable C ZZ-0', 'ZZ Variable D ZZ-0'],
+            ['ZZ Variable E ZZ-0'],
+        ])
+        # A full last page has no next page
+        self.assertEqual(self.pages(queryset, 5), [[variable.name for variable in queryset.order_by('name')]])
+
+        # Equal names continue on the pk
+        queryset.update(name='Variable')
+        pks = [variable.pk for variable in queryset.order_by('pk')]
+        page, cursor = search_variables(queryset, 'indicator_var__code', page_size=3)
+        self.assertEqual([variable.pk for variable in page], pks[:3])
+        page, cursor = search_variables(queryset, 'indicator_var__code', cursor=cursor, page_size=3)
+        self.assertEqual([variable.pk for variable in page], pks[3:])
+        self.assertIsNone(cursor)
+
+    def test_query(self):
+        queryset = RegionalIndicatorVariable.objects.all()
+        self.assertEqual(self.pages(queryset, 10, ' zz variable c'), [['ZZ Variable C ZZ-0']])
+        self.assertEqual(self.pages(queryset, 10, 'd'), [['ZZ Variable D ZZ-0']])
+        self.assertEqual(self.pages(queryset, 10, 'Other'), [[]])
+
+    def test_invalid_cursor(self):
+        for cursor in ['not base64!', 'bm90IGpzb24=', encode_cursor(Region(name='x', pk=1))[:-4]]:
+            with self.assertRaises(CursorError):
+                decode_cursor(cursor)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search_variables'), {'cursor': 'bm90IGpzb24='})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': "Invalid cursor"})
+
+    def test_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('search_variables'), {'q': 'zz variable'})
+        self.assertEqual([result['name'] for result in response.json()['results']],
+                         [f'ZZ Variable {code} ZZ-0' for code in 'ABCDE'])
+        self.assertIsNone(response.json()['next_cursor'])
+
+
+class PeriodsTest(HierarchyTestCase):
+    """Buckets agree with pandas periods, and indicators are divided by them"""
+
+    def test_bucket_starts(self):
+        for freq, period in [(MeasurementFreqChoice.YEARLY, 'Y'), (MeasurementFreqChoice.QUARTERLY, 'Q'),
+                             (MeasurementFreqChoice.MONTHLY, 'M'), (MeasurementFreqChoice.WEEKLY, 'W-SUN')]:
+            expected = pd.period_range('1990-02-15', '2030-12-31', freq=period).start_time.date.tolist()
+            self.assertEqual(BUCKETS[freq].range(date(1990, 2, 15), date(2030, 12, 31)), expected)
+
+    def test_ranges(self):
+        self.assertEqual(BUCKETS[MeasurementFreqChoice.BIENNIAL].range(date(2019, 5, 1), date(2023, 1, 1)),
+                         [date(2018, 1, 1), date(2020, 1, 1), date(2022, 1, 1)])
+        self.assertEqual(BUCKETS[MeasurementFreqChoice.BIANNUALLY].range(date(2020, 8, 1), date(2021, 7, 1)),
+                         [date(2020, 7, 1), date(2021, 1, 1), date(2021, 7, 1)])
+
+    def test_divide_dates(self):
+        country = self.create_country()
+        indicator_var = self.create_variable(country)
+        indicator = self.create_indicator(country, [indicator_var], None,
+                                          measurement_freq=MeasurementFreqChoice.QUARTERLY)
+        self.assertEqual(indicator.divide_dates(), [])
+
+        national_var = indicator_var.get_create_national_var()
+        national_var.create_value(period=date(2020, 2, 10), inputted_value=1)
+        national_var.create_value(period=date(2020, 8, 1), inputted_value=2)
+        self.assertEqual(indicator.divide_dates(),
+                         [date(2020, 1, 1), date(2020, 4, 1), date(2020, 7, 1)])
+
+
+@override_settings(SNAPSHOT_ROOT=None)
+class JobQueueTest(HierarchyTestCase):
+    """Queued jobs are deduplicated, claimed once and store the indicator values"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country()
+        indicator_var = cls.create_variable(country)
+        cls.indicator = cls.create_indicator(country, [indicator_var], computing_formula='V * 2',
+                                             measurement_freq=MeasurementFreqChoice.YEARLY)
+        national_var = indicator_var.get_create_national_var()
+        national_var.create_value(period=date(2020, 1, 1), inputted_value=1)
+        national_var.create_value(period=date(2021, 1, 1), inputted_value=3)
+
+    def test_dedupe_and_claim(self):
+        # Drops the jobs the setup's signals queued
+        Job.objects.all().delete()
+        job = enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator)
+        self.assertEqual(enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator), job)
+        other = enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator, period_start=date(2021, 1, 1))
+        self.assertNotEqual(other, job)
+
+        self.assertEqual(claim_jobs(5), [job.pk, other.pk])
+        self.assertEqual(claim_jobs(5), [])
+        # A running job no longer absorbs new ones
+        self.assertNotEqual(enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator), job)
+
+    def test_enqueue_conflict_raised(self):
+        # A constraint violation with no queued duplicate is retried once, then raised
+        with mock.patch.object(Job, 'save', side_effect=IntegrityError) as save:
+            with self.assertRaises(IntegrityError):
+                enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator)
+        self.assertEqual(save.call_count, 2)
+
+    def test_stale_jobs_requeued(self):
+        Job.objects.all().delete()
+        job = enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator)
+        self.assertEqual(claim_jobs(5), [job.pk])
+        self.assertEqual(requeue_stale_jobs(), [])
+
+        # The worker stopped renewing the lease
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=LEASE + 1))
+        self.assertEqual(claim_jobs(5), [job.pk])
+        heartbeat([job.pk])
+        self.assertEqual(requeue_stale_jobs(), [])
+
+        # The same job was queued meanwhile, the lost one fails instead
+        stale = timezone.now() - timedelta(seconds=LEASE + 1)
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+        queued = enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator)
+        self.assertEqual(requeue_stale_jobs(), [job.pk])
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatusChoice.FAILED)
+        self.assertEqual(claim_jobs(5), [queued.pk])
+
+    def test_recompute(self):
+        job = enqueue(JobKindChoice.RECOMPUTE, indicator=self.indicator)
+        self.assertTrue(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (JobStatusChoice.DONE, 1))
+        self.assertEqual(
+            [(period, float(value)) for period, value in IndicatorValue.objects.filter(
+                indicator=self.indicator).order_by('period').values_list('period', 'value')],
+            [(date(2020, 1, 1), 2.0), (date(2021, 1, 1), 6.0)],
+        )
+
+
+class DenormalizedAncestorsTest(HierarchyTestCase):
+    """The ancestor columns copied down the hierarchy follow their source when it moves"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = cls.create_country(regions=2, districts=2)
+        cls.other_country = Country.objects.create(name='Otherland', code='YY')
+        cls.indicator_var = cls.create_variable(cls.country, level=AggregationLevelChoice.DISTRICT)
+        cls.other_var = cls.create_variable(cls.country, 'W', level=AggregationLevelChoice.DISTRICT)
+
+    def assertInSync(self):
+        self.assertFalse(District.objects.exclude(country=F('region__country')).exists())
+        self.assertFalse(RegionalIndicatorVariable.objects.exclude(
+            indicator_var=F('national_var__indicator_var')).exists())
+        self.assertFalse(DistrictIndicatorVariable.objects.exclude(
+            national_var=F('regional_var__national_var'), indicator_var=F('regional_var__indicator_var'),
+            region=F('regional_var__region'),
+        ).exists())
+
+    def test_places(self):
+        region = Region.objects.get(code='ZZ-0')
+        region.country = self.other_country
+        region.save()
+        self.assertEqual(set(region.districts.values_list('country', flat=True)), {self.other_country.pk})
+
+        district = District.objects.get(code='ZZ-1-0')
+        district.region = region
+        district.save()
+        self.assertEqual(district.country, self.other_country)
+        self.assertInSync()
+
+    def test_variables(self):
+        regional_var = self.indicator_var.get_all_regional_vars().get(region__code='ZZ-0')
+        regional_var.region = Region.objects.get(code='ZZ-1')
+        regional_var.national_var = self.other_var.national_var
+        regional_var.save()
+        self.assertEqual(set(regional_var.district_vars.values_list('indicator_var', flat=True)),
+                         {self.other_var.pk})
+        self.assertInSync()
+
+        # An indicator variable has a single national var
+        moved_var = self.create_variable(self.country, 'X', level=AggregationLevelChoice.DISTRICT)
+        moved_var.national_var.delete()
+        national_var = self.indicator_var.national_var
+        national_var.indicator_var = moved_var
+        national_var.save()
+        self.assertEqual(set(national_var.regional_vars.values_list('indicator_var', flat=True)), {moved_var.pk})
+        self.assertFalse(RegionalIndicatorVariable.objects.filter(indicator_var=self.indicator_var).exists())
+        self.assertFalse(DistrictIndicatorVariable.objects.filter(indicator_var=self.indicator_var).exists())
+        self.assertInSync()
+
+        district_var = DistrictIndicatorVariable.objects.filter(regional_var__region__code='ZZ-1').first()
+        district_var.regional_var = regional_var
+        district_var.save()
+        self.assertEqual(district_var.region_id, regional_var.region_id)
+        self.assertInSync()
+
+
+class RollupTest(HierarchyTestCase):
+    """Rollups aggregate the values one level below by the variable's compute format"""
+
+    def test_aggregates(self):
+        values = [Decimal('1.50'), Decimal('4'), Decimal('2')]
+        for compute_format, expected in [(CalFormatChoice.NET, '7.50'), (CalFormatChoice.AVERAGE, '2.50'),
+                                         (CalFormatChoice.MEDIAN, '2.00')]:
+            rollup = NationalVarRollup()
+            rollup.set_values(values, compute_format)
+            self.assertEqual(rollup.value, Decimal(expected))
+        rollup.set_values([], CalFormatChoice.NET)
+        self.assertIsNone(rollup.value)
+
+    def test_computed_values(self):
+        country = self.create_country(regions=2, districts=2)
+        indicator_var = self.create_variable(country, level=AggregationLevelChoice.DISTRICT,
+                                             value_type=ValueTypeChoice.COMPUTED,
+                                             compute_format=CalFormatChoice.AVERAGE)
+        period = date(2020, 1, 1)
+        for i, district_var in enumerate(DistrictIndicatorVariable.objects.order_by('district__code')):
+            district_var.create_value(period=period, inputted_value=i + 1)
+        national_var = indicator_var.national_var
+        self.assertEqual(list(RegionalVarRollup.objects.order_by('variable__region__code')
+                              .values_list('value', flat=True)), [Decimal('1.50'), Decimal('3.50')])
+        self.assertEqual(national_var.create_value(period=period, inputted_value=0).value, Decimal('2.50'))
+
+        DistrictVarValue.objects.filter(variable__national_var=national_var).delete()
+        self.assertFalse(RegionalVarRollup.objects.exists())
+        self.assertFalse(NationalVarRollup.objects.exists())
+
+    def test_backfill(self):
+        country = self.create_country(regions=2, districts=2)
+        district_var = self.create_variable(country, 'D', AggregationLevelChoice.DISTRICT, ValueTypeChoice.COMPUTED,
+                                            compute_format=CalFormatChoice.MEDIAN)
+        regional_var = self.create_variable(country, 'R', AggregationLevelChoice.REGIONAL, ValueTypeChoice.COMPUTED,
+                                            compute_format=CalFormatChoice.NET)
+        for i, variable in enumerate(district_var.get_all_district_vars().order_by('district__code')):
+            variable.create_value(period=date(2020, 1, 1), inputted_value=i * 1.5)
+            variable.create_value(period=date(2021, 1, 1), inputted_value=i)
+        for i, variable in enumerate(regional_var.get_all_regional_vars()):
+            variable.create_value(period=date(2020, 1, 1), inputted_value=i + 2)
+
+        def rollups():
+            return [list(model.objects.order_by('variable', 'period').values_list(
+                        'variable', 'period', 'value', 'total', 'count', 'sorted_values'))
+                    for model in (RegionalVarRollup, NationalVarRollup)]
+
+        rebuild_country_rollups(country.pk)
+        expected = rollups()
+        NationalVarRollup.objects.all().delete()
+        RegionalVarRollup.objects.all().delete()
+        # Run on the models as of the migration
+        migration = ('indicatorDataApp', '0021_backfill_rollups')
+        state = MigrationLoader(connection).project_state(migration)
+        import_module('indicatorDataApp.migrations.0021_backfill_rollups').backfill_rollups(state.apps, None)
+        self.assertEqual(rollups(), expected)
+        self.assertEqual(len(expected[1]), 3)
+
+
+class ShiftRollupsTest(HierarchyTestCase):
+    """Value writes shift their rollups to what a rebuild from the stored values gives"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=3)
+        cls.national_vars = [
+            cls.create_variable(country, code, AggregationLevelChoice.REGIONAL,
+                                compute_format=compute_format).national_var
+            for code, compute_format in [('N', CalFormatChoice.NET), ('A', CalFormatChoice.AVERAGE),
+                                         ('M', CalFormatChoice.MEDIAN)]
+        ]
+
+    def rollups(self):
+        return list(NationalVarRollup.objects.order_by('variable', 'period').values_list(
+            'variable', 'period', 'value', 'total', 'count', 'sorted_values'))
+
+    def assertRollupsRebuilt(self):
+        shifted = self.rollups()
+        rebuild_country_rollups(self.national_vars[0].indicator_var.country_id)
+        self.assertEqual(shifted, self.rollups())
+
+    def test_shifts(self):
+        for national_var in self.national_vars:
+            for i, regional_var in enumerate(national_var.regional_vars.order_by('pk')):
+                regional_var.create_value(period=date(2020, 1, 1), inputted_value=i + 1)
+            self.assertRollupsRebuilt()
+
+            # Edited as the input form does, with a datetime and an unrounded float
+            value = national_var.regional_vars.order_by('pk').first().value_models.get()
+            value.period = datetime(2020, 1, 1)
+            value.inputted_value = 3.14159
+            value.save()
+            self.assertEqual(value.inputted_value, Decimal('3.14'))
+            self.assertRollupsRebuilt()
+
+            # Moved to another period, then edited and deleted once reloaded
+            value.period = datetime(2021, 1, 1)
+            value.save()
+            self.assertRollupsRebuilt()
+            value = type(value).objects.get(pk=value.pk)
+            value.inputted_value = 0.005
+            value.save()
+            self.assertRollupsRebuilt()
+            value.delete()
+            self.assertRollupsRebuilt()
+
+        periods = NationalVarRollup.objects.values_list('period', flat=True).distinct()
+        self.assertEqual(list(periods), [date(2020, 1, 1)])
+        median = NationalVarRollup.objects.get(variable=self.national_vars[2])
+        self.assertEqual((median.value, median.sorted_values), (Decimal('2.50'), ['2.00', '3.00']))
+
+
+class RebuildRollupsTest(HierarchyTestCase):
+    """A full rebuild gives the rollups the value signals maintain"""
+
+    def test_rebuild_country_rollups(self):
+        country = self.create_country(regions=2)
+        self.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        for i, regional_var in enumerate(RegionalIndicatorVariable.objects.order_by('pk')):
+            regional_var.create_value(period=date(2020, 1, 1), inputted_value=i + 1)
+            regional_var.create_value(period=date(2021, 1, 1), inputted_value=i * 2)
+        rollup_fields = ['variable', 'period', 'value', 'total', 'count']
+        expected = list(NationalVarRollup.objects.order_by('period').values_list(*rollup_fields))
+
+        stale = NationalVarRollup.objects.get(period=date(2021, 1, 1))
+        NationalVarRollup.objects.exclude(pk=stale.pk).delete()
+        stale.period = date(2019, 1, 1)
+        stale.save()
+        self.assertEqual(rebuild_country_rollups(country.pk), 2)
+        self.assertEqual(
+            list(NationalVarRollup.objects.order_by('period').values_list(*rollup_fields)), expected)
+
+
+@override_settings(SNAPSHOT_ROOT=None)
+class IndicatorHistoryTest(HierarchyTestCase):
+    """Value changes queue recomputes that keep the stored history equal to the live data"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=3)
+        indicator_var = cls.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        cls.indicator = cls.create_indicator(country, [indicator_var], AggregationLevelChoice.REGIONAL,
+                                             measurement_freq=MeasurementFreqChoice.YEARLY,
+                                             computing_formula='V + 1')
+        cls.regional_vars = list(RegionalIndicatorVariable.objects.order_by('pk'))
+        for i, regional_var in enumerate(cls.regional_vars[:2]):
+            regional_var.create_value(period=date(2020, 1, 1), inputted_value=i)
+            regional_var.create_value(period=date(2022, 6, 1), inputted_value=i + 5)
+
+    def run_queued_jobs(self):
+        for pk in claim_jobs(100):
+            self.assertTrue(run_job(pk))
+
+    def assertHistoryMatches(self):
+        self.run_queued_jobs()
+        history = self.indicator.history()
+        self.assertTrue(history.equals(self.indicator.data(history.columns.tolist())))
+        return history
+
+    def test_history(self):
+        history = self.assertHistoryMatches()
+        self.assertEqual(history.shape, (2, 3))
+        with self.assertNumQueries(1):
+            self.indicator.history(date(2021, 1, 1), date(2022, 1, 1), places=[self.regional_vars[0].region_id])
+
+    def test_value_changes(self):
+        self.run_queued_jobs()
+        value = self.regional_vars[0].value_models.get(period=date(2022, 6, 1))
+        value.inputted_value = 10
+        value.save()
+        self.regional_vars[2].create_value(period=date(2019, 1, 1), inputted_value=3)
+        self.assertEqual(Job.objects.filter(status=JobStatusChoice.QUEUED).count(), 2)
+        self.assertEqual(self.assertHistoryMatches().shape, (3, 4))
+
+        self.regional_vars[1].value_models.get(period=date(2022, 6, 1)).delete()
+        self.assertHistoryMatches()
+
+
+class RebuildIndicatorsTest(HierarchyTestCase):
+    """The rebuild_indicators command stores the same values the indicator computes live"""
+
+    @classmethod
+    def setUpClass(cls):
+        root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, root)
+        settings_override = override_settings(SNAPSHOT_ROOT=root)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=3, districts=2)
+        indicator_var = cls.create_variable(country, level=AggregationLevelChoice.DISTRICT,
+                                            value_type=ValueTypeChoice.COMPUTED)
+        cls.indicator = cls.create_indicator(country, [indicator_var], AggregationLevelChoice.REGIONAL,
+                                             measurement_freq=MeasurementFreqChoice.YEARLY,
+                                             computing_formula='V * 2')
+        for i, district_var in enumerate(DistrictIndicatorVariable.objects.order_by('district__code')):
+            district_var.create_value(period=date(2020, 1, 1), inputted_value=i)
+            district_var.create_value(period=date(2022, 6, 1), inputted_value=i + 5)
+
+    def test_rebuild(self):
+        IndicatorValue.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_indicators', '--workers', '1', stdout=out)
+        self.assertIn('1 indicators', out.getvalue())
+
+        history = self.indicator.history()
+        self.assertEqual(history.shape, (3, 3))
+        self.assertTrue(history.equals(self.indicator.data(history.columns.tolist())))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Value tables are only partitioned on Postgres")
+class ValuePartitionsTest(HierarchyTestCase):
+    """Yearly value partitions are added and retired without losing the values kept"""
+
+    def test_extend_and_detach(self):
+        indicator_var = self.create_variable(self.create_country())
+        national_var = indicator_var.get_create_national_var()
+        table = NationalVarValue._meta.db_table
+        with connection.cursor() as cursor:
+            # Deferred foreign key checks of the values written in the test's
+            # transaction would keep their partitions from being dropped
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            first, last = partition_years(cursor, table)[0], partition_years(cursor, table)[-1]
+            national_var.create_value(period=date(last + 3, 5, 1), inputted_value=1)
+            national_var.create_value(period=date(first - 2, 5, 1), inputted_value=2)
+
+            self.assertEqual(extend_partitions(cursor, table, first - 2, last + 3),
+                             [first - 2, first - 1, last + 1, last + 2, last + 3])
+            for edge in ('before', 'after'):
+                cursor.execute(f'SELECT COUNT(*) FROM "{edge_name(table, edge)}"')
+                self.assertEqual(cursor.fetchone()[0], 0)
+            self.assertEqual(national_var.get_value_at(date(last, 1, 1)), 1)
+
+            self.assertEqual(detach_partitions(cursor, table, first, drop=True), [first - 2, first - 1])
+            self.assertEqual(partition_years(cursor, table)[0], first)
+        self.assertEqual(list(national_var.value_models.values_list('inputted_value', flat=True)), [1])
+        national_var.create_value(period=date(first - 2, 5, 1), inputted_value=3)
+        self.assertEqual(national_var.get_value_at(date(first - 3, 1, 1)), 3)
+
+
+class SnapshotTest(HierarchyTestCase):
+    """Indicator data is viewed from its snapshot until a recompute is pending or places change"""
+
+    @classmethod
+    def setUpClass(cls):
+        root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, root)
+        settings_override = override_settings(SNAPSHOT_ROOT=root)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        country = cls.create_country(regions=3)
+        indicator_var = cls.create_variable(country, level=AggregationLevelChoice.REGIONAL)
+        cls.indicator = cls.create_indicator(country, [indicator_var], AggregationLevelChoice.REGIONAL,
+                                             measurement_freq=MeasurementFreqChoice.QUARTERLY)
+        cls.regional_vars = list(RegionalIndicatorVariable.objects.order_by('pk'))
+        for i, regional_var in enumerate(cls.regional_vars[:2]):
+            regional_var.create_value(period=date(2020, 1, 1), inputted_value=i + 1)
+            regional_var.create_value(period=date(2021, 3, 1), inputted_value=i + 3)
+
+    def live_data(self):
+        return cached_indicator_frame(self.indicator, self.indicator.divide_dates())
+
+    def test_snapshot_read(self):
+        for pk in claim_jobs(100):
+            self.assertTrue(run_job(pk))
+        with self.assertNumQueries(1):
+            frame = self.indicator.data()
+        self.assertTrue(frame.equals(self.live_data()))
+        # A view of the mapped file, not a copy
+        self.assertFalse(frame.to_numpy().flags.writeable)
+
+        self.regional_vars[2].create_value(period=date(2021, 1, 1), inputted_value=5)
+        self.assertTrue(self.indicator.data().equals(self.live_data()))
+        self.assertEqual(self.indicator.data().shape, (3, 5))
+
+    # Threads of their own would not see the test's transaction
+    @mock.patch('indicatorDataApp.views.threaded', sync_to_async)
+    def test_series_view(self):
+        for pk in claim_jobs(100):
+            self.assertTrue(run_job(pk))
+        expected = self.live_data()
+        self.client.force_login(User.objects.create_superuser('admin'))
+        url = reverse('api_indicator_series', kwargs={'pk': self.indicator.pk})
+        with mock.patch('indicatorDataApp.series_cache.cached_indicator_frame', side_effect=AssertionError):
+            series = self.client.get(url).json()
+        self.assertEqual(series['dates'], [day.isoformat() for day in expected.columns])
+        self.assertEqual([place['place'] for place in series['places']], expected.index.tolist())
+        self.assertEqual([place['values'] for place in series['places']],
+                         [[None if np.isnan(value) else value for value in row] for row in expected.to_numpy()])
+
+        # Dates other than the indicator's periods are evaluated
+        series = self.client.get(url, {'date': '2020-06-01'}).json()
+        self.assertEqual(series['dates'], ['2020-06-01'])
+
+    def test_places_changed(self):
+        for pk in claim_jobs(100):
+            self.assertTrue(run_job(pk))
+        self.assertIsNotNone(snapshot_frame(self.indicator))
+
+        # A new region queues no recompute, but the snapshot no longer covers every place
+        Region.objects.create(name='New region', code='ZZ-9', country=self.indicator.country)
+        self.assertFalse(Job.objects.filter(status=JobStatusChoice.QUEUED).exists())
+        self.assertIsNone(snapshot_frame(self.indicator))
+        write_snapshot(self.indicator)
+        self.assertIsNotNone(snapshot_frame(self.indicator))
+
+    def test_opened_bounded(self):
+        for pk in claim_jobs(100):
+            self.assertTrue(run_job(pk))
+        with mock.patch.dict(snapshots.opened, {-1: ('0', {})}, clear=True), \
+                mock.patch.object(snapshots, 'MAX_OPENED', 1):
+            self.assertIsNotNone(snapshot_frame(self.indicator))
+            self.assertEqual(list(snapshots.opened), [self.indicator.pk])
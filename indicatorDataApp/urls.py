@@ -1,10 +1,18 @@
 from django.urls import path
 from django.contrib.auth.views import LoginView
-from .views import InputDataView
+from .views import InputDataView, SearchVariablesView, ImportValuesView, ExportIndicatorView
+from .views import IndicatorSeriesView, VariableValuesView
 
 urlpatterns = [
     path('', LoginView.as_view(template_name='login.html'), name='login'),
     path('input-data/', InputDataView.as_view(), name='input_data'),
+    path('input-data/variables/', SearchVariablesView.as_view(), name='search_variables'),
+    path('input-data/import/', ImportValuesView.as_view(), name='import_values'),
+    path('indicators/<int:pk>/export/', ExportIndicatorView.as_view(), name='export_indicator'),
+    path('api/indicators/series/', IndicatorSeriesView.as_view(), name='api_indicators_series'),
+    path('api/indicators/<int:pk>/series/', IndicatorSeriesView.as_view(), name='api_indicator_series'),
+    path('api/variables/<str:var_class_name>/<int:var_pk>/values/', VariableValuesView.as_view(),
+         name='api_variable_values'),
     path('input-data/<str:var_class_name>/<str:var_pk>/', InputDataView.as_view(), name='update_variable'),
     path('input-data/<str:var_class_name>/<str:var_pk>/<str:existing_value_pk>/', InputDataView.as_view(), name='update_existing_value'),
 
@@ -1,20 +1,73 @@
-from django.shortcuts import render
+import asyncio
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404
 from django.views.generic import View
-from datetime import datetime
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from datetime import date, datetime
 from django.contrib import messages
+from django.db import IntegrityError, connections
+
+from .assignments import AssignedVariables, VARIABLE_MODELS
+from .exports import export_frames, get_encoder, ExportError
+from .imports import import_values, ValueImportError
+from .registry import lookup
+from .search import search_variables, CursorError
+from .series import level_storage
+from .models import Country, AggregationLevelChoice, ValueTypeChoice
+from .models import RegionalIndicatorVariable
+
 
-from .models import NationalIndicatorVariable, RegionalIndicatorVariable, DistrictIndicatorVariable, NationalVarValue, RegionalVarValue, DistrictVarValue
+# The variables listed in the sidebar and the path to their code
+SIDEBAR_MODEL = RegionalIndicatorVariable
+SIDEBAR_CODE_FIELD = 'indicator_var__code'
 
 
-class InputDataView(View):
+def value_cards(variable):
+    """
+    Returns the variable's values with the value to show set as shown_value.
+    Reads the values and, if they are computed, the rollups in one query each,
+    whatever the number of values.
+    """
+    values = list(variable.value_models.all())
+    for value in values:
+        value.variable = variable
+
+    if values and not (values[0].value_type == ValueTypeChoice.INPUTTED or values[0].is_leaf):
+        rollups = dict(variable.rollups.values_list('period', 'value'))
+        for value in values:
+            value.shown_value = rollups.get(value.period)
+    else:
+        for value in values:
+            value.shown_value = value.inputted_value
+    return values
+
+
+class AssignedVariablesMixin(LoginRequiredMixin):
+    """Resolves the variables assigned to the request's user, when first needed"""
+    login_url = 'login'
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        self.assigned = AssignedVariables(request.user)
+
+    def get_variable(self, var_class_name, pk):
+        """The assigned variable, 404 if it does not exist or is not assigned"""
+        try:
+            return self.assigned.get(var_class_name, pk)
+        except (KeyError, ValueError, ObjectDoesNotExist):
+            raise Http404("No such variable assigned to you")
+
+
+class InputDataView(AssignedVariablesMixin, View):
     """
     View for letting users access indicator variables they are 
     permitted to edit
     """
-    from itertools import chain
-    queryset = chain(NationalIndicatorVariable.objects.all(),
-                 RegionalIndicatorVariable.objects.all(),
-                 DistrictIndicatorVariable.objects.all())
 
     def get(self, request,*args, **kwargs):
         var_pk = kwargs.get('var_pk')
@@ -24,59 +77,53 @@ class InputDataView(View):
 
         # If a variable was clicked on, get it or set variable to ""
         variable = ""
+        values = []
         if var_pk and var_class:
-            variable = globals().get(var_class).objects.get(pk=var_pk)
+            variable = self.get_variable(var_class, var_pk)
+            values = value_cards(variable)
 
         # If an existing value was clicked on, get it or set existing value to ""
         existing_value = ""        
         if existing_value_pk:
-            existing_value = variable.value_models.get(pk=existing_value_pk)
-            variable = existing_value.variable
+            existing_value = next((value for value in values if str(value.pk) == existing_value_pk), "")
 
-        queryset = RegionalIndicatorVariable.objects.all()
+        # The first page of the sidebar, the rest is loaded from SearchVariablesView
+        sidebar, next_cursor = search_variables(self.assigned.queryset(SIDEBAR_MODEL),
+                                                SIDEBAR_CODE_FIELD)
 
-        context = {'variables': queryset, 'variable': variable, 'existing_value': existing_value}
+        context = {'variables': sidebar, 'next_cursor': next_cursor, 'variable': variable,
+                   'values': values, 'existing_value': existing_value}
         return render(request, 'indicatorDataApp/input_data.html', context)
 
     def post(self, request, *args, **kwargs):
         value = request.POST.get("var_value")
         date = request.POST.get("var_value_date")
-        variable_pk = request.POST.get("variable_pk")
-        variable_class = request.POST.get("variable_class")
-        
+        variable = self.get_variable(request.POST.get("variable_class"),
+                                     request.POST.get("variable_pk"))
+
         existing_value_pk = request.POST.get("existing_value_pk")
         existing_value = None
-
-        if variable_class == "NationalIndicatorVariable":
-            if existing_value_pk:
-                existing_value  = NationalVarValue.objects.get(pk=existing_value_pk)
-
-            variable = NationalIndicatorVariable.objects.get(pk=variable_pk)
-
-        if variable_class == "RegionalIndicatorVariable":
-            if existing_value_pk:
-                existing_value  = RegionalVarValue.objects.get(pk=existing_value_pk)
-
-            variable = RegionalIndicatorVariable.objects.get(pk=variable_pk)
-
-        if variable_class == "DistrictIndicatorVariable":
-            if existing_value_pk:
-                existing_value  = DistrictVarValue.objects.get(pk=existing_value_pk)
-
-            variable = DistrictIndicatorVariable.objects.get(pk=variable_pk)
+        if existing_value_pk:
+            existing_value = get_object_or_404(variable.value_models, pk=existing_value_pk)
 
         if value and date:
-            if existing_value:
-                existing_value.period = datetime.strptime(date, "%Y-%m-%d")
-                existing_value.inputted_value = float(value)
-                existing_value.save()
-                messages.success(request, f"Value for {date} update to {float(value)} successfully")
-            else:
-                variable.create_value(
-                    period=datetime.strptime(date, "%Y-%m-%d"),
-                    inputted_value=float(value)
-                )
-                messages.success(request, "Value added successfully")
+            try:
+                # Periods are dates, a datetime would not compare with the stored ones
+                period = datetime.strptime(date, "%Y-%m-%d").date()
+                if existing_value:
+                    existing_value.period = period
+                    existing_value.inputted_value = float(value)
+                    existing_value.save()
+                    messages.success(request, f"Value for {date} update to {float(value)} successfully")
+                else:
+                    variable.create_value(
+                        period=period,
+                        inputted_value=float(value)
+                    )
+                    messages.success(request, "Value added successfully")
+            except IntegrityError:
+                # Only one value per variable per period
+                messages.error(request, f"A value for {date} already exists, update it instead")
 
         elif date:
             messages.error(request, "Invalide value!")
@@ -85,4 +132,195 @@ class InputDataView(View):
             messages.error(request, "Invalide Date!")
             print("Invalide date!")
 
-        return self.get(request, *args, **kwargs)
\ No newline at end of file
+        return self.get(request, *args, **kwargs)
+
+
+class SearchVariablesView(AssignedVariablesMixin, View):
+    """
+    Returns a page of the sidebar variables as JSON.
+    Query parameters:
+        q -> prefix of the variable name, or its code
+        cursor -> the next_cursor of the previous page
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            page, next_cursor = search_variables(self.assigned.queryset(SIDEBAR_MODEL),
+                                                 SIDEBAR_CODE_FIELD,
+                                                 query=request.GET.get('q', ''),
+                                                 cursor=request.GET.get('cursor'))
+        except CursorError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        results = [
+            {'pk': variable.pk, 'name': variable.name,
+             'url': reverse('update_variable', kwargs={
+                 'var_class_name': type(variable).__name__, 'var_pk': variable.pk})}
+            for variable in page
+        ]
+        return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+
+class ImportValuesView(AssignedVariablesMixin, View):
+    """
+    Imports a CSV or Excel file of district values of the variables assigned to the user.
+    Expects the file as 'file' and the code of the variables' country as 'country'.
+    """
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'error': "No file uploaded"}, status=400)
+
+        try:
+            country = Country.objects.get(code=request.POST.get('country', '').upper())
+        except Country.DoesNotExist:
+            return JsonResponse({'error': "Unknown country"}, status=400)
+
+        try:
+            result = import_values(upload, upload.name, country,
+                                   indicator_var_pks=self.assigned.indicator_var_pks)
+        except ValueImportError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse(result.as_dict())
+
+
+class ExportIndicatorView(AssignedVariablesMixin, View):
+    """
+    Streams the values of an indicator at every place as CSV or an Arrow IPC stream,
+    for an indicator whose variables are all assigned to the user.
+    Query parameters:
+        format -> 'csv' (default) or 'arrow'
+        date -> dates to export at, repeatable, defaults to the indicator's periods
+    """
+
+    def get(self, request, pk, *args, **kwargs):
+        indicator = get_object_or_404(self.assigned.indicators(), pk=pk)
+        export_format = request.GET.get('format', 'csv')
+        try:
+            encode, content_type, extension = get_encoder(export_format)
+            dates = [date.fromisoformat(d) for d in request.GET.getlist('date')]
+        except (ExportError, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if not dates:
+            dates = indicator.divide_dates()
+
+        response = StreamingHttpResponse(encode(export_frames(indicator, dates)),
+                                         content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{indicator.code}.{extension}"'
+        return response
+
+
+def threaded(func):
+    """
+    Wraps a sync function to run in a worker thread of its own, so several can
+    run at once, closing the thread's database connections when it is done
+    """
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def series_json(indicator, dates):
+    """The indicator's series at dates, or at its divide_dates, JSON ready"""
+    # Without dates the series may be viewed from the indicator's snapshot
+    frame = indicator.data(dates or None)
+    dates = frame.columns.tolist()
+    names = lookup(lambda registry: registry.place_names(indicator.level, frame.index.tolist()))
+    values = np.where(np.isnan(frame.to_numpy()), None, frame.to_numpy())
+    return {
+        'indicator': indicator.pk,
+        'code': indicator.code,
+        'level': indicator.level or AggregationLevelChoice.NATIONAL,
+        'dates': [d.isoformat() for d in dates],
+        'places': [
+            {'place': place, 'name': names.get(place), 'values': row.tolist()}
+            for place, row in zip(frame.index.tolist(), values)
+        ],
+    }
+
+
+async def is_authenticated(request):
+    # The user is loaded from the session lazily, with sync queries
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+async def assigned_variables(request):
+    """The request user's AssignedVariables, with the assigned pks already read"""
+    assigned = AssignedVariables(request.user)
+    # The pks are read with sync queries, querysets built on them are then lazy
+    await sync_to_async(lambda: assigned.indicator_var_pks)()
+    return assigned
+
+
+class IndicatorSeriesView(View):
+    """
+    Async JSON series of indicators at every place, for the indicators whose
+    variables are all assigned to the user.
+    Query parameters:
+        indicator -> indicator pks, repeatable, when no pk is in the url
+        date -> dates to read the series at, repeatable, defaults to each
+                indicator's periods
+    The indicators are evaluated concurrently, each in its own thread.
+    """
+
+    async def get(self, request, pk=None, *args, **kwargs):
+        if not await is_authenticated(request):
+            return JsonResponse({'error': "Login required"}, status=401)
+
+        try:
+            dates = [date.fromisoformat(d) for d in request.GET.getlist('date')]
+            pks = [pk] if pk is not None else [int(p) for p in request.GET.getlist('indicator')]
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        assigned = await assigned_variables(request)
+        indicators = [indicator async for indicator in assigned.indicators().filter(pk__in=pks)]
+        if pk is not None and not indicators:
+            return JsonResponse({'error': "No such indicator"}, status=404)
+
+        series = await asyncio.gather(*(
+            threaded(series_json)(indicator, dates) for indicator in indicators
+        ))
+        if pk is not None:
+            return JsonResponse(series[0])
+        return JsonResponse({'results': series})
+
+
+class VariableValuesView(View):
+    """Async JSON values of a national, regional or district variable assigned to the user"""
+
+    async def get(self, request, var_class_name, var_pk, *args, **kwargs):
+        if not await is_authenticated(request):
+            return JsonResponse({'error': "Login required"}, status=401)
+
+        if var_class_name not in VARIABLE_MODELS:
+            return JsonResponse({'error': "Unknown variable class"}, status=404)
+        assigned = await assigned_variables(request)
+        try:
+            variable = await sync_to_async(assigned.get)(var_class_name, var_pk)
+        except ObjectDoesNotExist:
+            return JsonResponse({'error': "No such variable assigned to you"}, status=404)
+
+        values = [value async for value in
+                  variable.value_models.values_list('pk', 'period', 'inputted_value')]
+        level = variable.value_models.model.level
+        if variable.indicator_var.is_computed_at(level):
+            rollups = {period: value async for period, value in
+                       variable.rollups.values_list('period', 'value')}
+            values = [(pk, period, rollups.get(period)) for pk, period, _ in values]
+
+        return JsonResponse({
+            'variable': variable.pk,
+            'name': variable.name,
+            'values': [
+                {'pk': pk, 'period': period.isoformat(),
+                 'value': float(value) if value is not None else None}
+                for pk, period, value in values
+            ],
+        })
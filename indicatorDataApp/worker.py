@@ -0,0 +1,64 @@
+"""
+Entry points of the run_jobs and rebuild_indicators worker processes.
+
+Spawned processes import this module before Django is set up, so it must not
+import models at module level.
+"""
+from functools import wraps
+
+import django
+from django.db import close_old_connections
+
+
+def init_worker():
+    """Sets Django up in a fresh worker process"""
+    django.setup()
+
+
+def in_worker(func):
+    """Workers live across tasks, drop connections the database may have closed after each"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+@in_worker
+def run_job(job_pk):
+    from .jobs import run_job
+
+    return run_job(job_pk)
+
+
+@in_worker
+def rebuild_country(country_pk):
+    """Rebuilds the rollups of a country, returns the number written"""
+    from .rollups import rebuild_country_rollups
+
+    return rebuild_country_rollups(country_pk)
+
+
+@in_worker
+def rebuild_indicator(indicator_pk):
+    """Recomputes the stored values and snapshot of an indicator, returns the number of values written"""
+    from .models import Indicator
+    from .recompute import store_indicator_values
+    from .snapshots import write_snapshot
+
+    indicator = Indicator.objects.get(pk=indicator_pk)
+    stored = store_indicator_values(indicator)
+    write_snapshot(indicator)
+    return stored
+
+
+@in_worker
+def snapshot_indicator(indicator_pk):
+    """Writes the snapshot of an indicator, returns its number of places"""
+    from .models import Indicator
+    from .snapshots import write_snapshot
+
+    manifest = write_snapshot(Indicator.objects.get(pk=indicator_pk))
+    return manifest['shape'][0] if manifest else 0
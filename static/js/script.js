@@ -1,10 +1,52 @@
-// Search (filter) variables script
+// Search variables script, pages of variables are loaded from the server
 $(document).ready(function(){
-$("#search-input").on("keyup", function() {
-    var value = $(this).val().toLowerCase();
-    $("#variables li").filter(function() {
-    $(this).toggle($(this).text().toLowerCase().indexOf(value) > -1)
+var $variables = $("#variables");
+var $loadMore = $("#load-more-variables");
+var nextCursor = $variables.data("next-cursor") || null;
+var searchTimer = null;
+var request = null;
+
+function loadVariables(replace) {
+    if (request) {
+        request.abort();
+    }
+    var params = {q: $("#search-input").val()};
+    if (!replace && nextCursor) {
+        params.cursor = nextCursor;
+    }
+    request = $.getJSON($variables.data("url"), params, function(response) {
+        if (replace) {
+            $variables.empty();
+        }
+        $.each(response.results, function(i, variable) {
+            var $link = $("<a>").attr("href", variable.url).text(variable.name);
+            $("<li>").addClass("list-group-item variable").attr("id", variable.pk)
+                .append($link).appendTo($variables);
+        });
+        if (replace && !response.results.length) {
+            $variables.append($("<p>").text("No variables found"));
+        }
+        nextCursor = response.next_cursor;
+        $loadMore.prop("hidden", !nextCursor);
+    }).always(function() {
+        request = null;
     });
+}
+
+$("#search-input").on("keyup", function() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(function() { loadVariables(true); }, 250);
+});
+
+$loadMore.on("click", function() {
+    loadVariables(false);
+});
+
+// Load the next page when the sidebar is scrolled to the bottom
+$(".data-input-sidebar").on("scroll", function() {
+    if (nextCursor && !request && this.scrollTop + this.clientHeight >= this.scrollHeight - 50) {
+        loadVariables(false);
+    }
 });
 });
 